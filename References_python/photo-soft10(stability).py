@@ -129,14 +129,75 @@ def load_overlay():
     else:
         pad = (1800 - nh) // 2
         overlay_image_cv = cv2.copyMakeBorder(resized, pad, 1800-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
+    invalidate_overlay_cache()
     print("Overlay loaded successfully.")
 
 def clear_overlay():
     global overlay_image_path, overlay_image_cv
     overlay_image_path = None
     overlay_image_cv = None
+    invalidate_overlay_cache()
     print("Overlay cleared.")
 
+# Кэш подготовленной рамки: масштабирование, разделение на цвет/альфу и
+# предумножение выполняются один раз на (ширина, высота, режим смешивания)
+overlay_cache = {}
+overlay_cache_stats = {"hits": 0, "misses": 0}
+overlay_cache_generation = 0
+overlay_cache_lock = threading.Lock()
+
+def invalidate_overlay_cache():
+    global overlay_cache_generation
+    with overlay_cache_lock:
+        overlay_cache.clear()
+        overlay_cache_generation += 1
+        print(f"Overlay cache invalidated (hits={overlay_cache_stats['hits']}, misses={overlay_cache_stats['misses']})")
+
+def get_overlay_cache_stats():
+    with overlay_cache_lock:
+        return dict(overlay_cache_stats, entries=len(overlay_cache))
+
+def get_prepared_overlay(width, height):
+    src = overlay_image_cv
+    if src is None:
+        return None
+    mode = "alpha" if src.shape[2] == 4 else "weighted"
+    key = (width, height, mode)
+    with overlay_cache_lock:
+        prepared = overlay_cache.get(key)
+        if prepared is not None:
+            overlay_cache_stats["hits"] += 1
+            return prepared
+        overlay_cache_stats["misses"] += 1
+        generation = overlay_cache_generation
+    ov = cv2.resize(src, (width, height))
+    if mode == "alpha":
+        # Альфа 0..255 переводится в вес 0..256, чтобы результат делился сдвигом на 8
+        a = ov[:, :, 3:].astype(np.uint16)
+        a += a >> 7
+        premul = ov[:, :, :3].astype(np.uint16) * a
+        inv = 256 - a
+    else:
+        # Аналог cv2.addWeighted(frame, 0.7, ov, 0.3, 0) в фиксированной точке
+        premul = ov.astype(np.uint16) * np.uint16(77)
+        inv = np.uint16(179)
+    prepared = (mode, premul, inv)
+    with overlay_cache_lock:
+        if generation == overlay_cache_generation:
+            overlay_cache[key] = prepared
+        print(f"Overlay cache miss for {width}x{height} {mode} (hits={overlay_cache_stats['hits']}, misses={overlay_cache_stats['misses']})")
+    return prepared
+
+def blend_prepared_overlay(frame, prepared):
+    # (frame * inv + premul + 128) >> 8 — целочисленное смешивание без float-массивов
+    _, premul, inv = prepared
+    acc = frame.astype(np.uint16)
+    acc *= inv
+    acc += premul
+    acc += 128
+    acc >>= 8
+    return acc.astype(np.uint8)
+
 preview_queue = queue.Queue(maxsize=10)
 
 def process_frames():
@@ -163,13 +224,9 @@ def process_frames():
             pad = (900 - nh) // 2
             frame = cv2.copyMakeBorder(frame, pad, 900-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
         if overlay_image_cv is not None:
-            ov = cv2.resize(overlay_image_cv, (600, 900))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                frame = (frame * (1 - alpha) + rgb * alpha).astype(np.uint8)
-            else:
-                frame = cv2.addWeighted(frame, 0.7, ov, 0.3, 0)
+            prepared = get_prepared_overlay(600, 900)
+            if prepared is not None:
+                frame = blend_prepared_overlay(frame, prepared)
         if countdown_value is not None:
             txt = str(countdown_value)
             org = (frame.shape[1]//2 - 60, frame.shape[0]//2 + 60)
@@ -8,10 +8,17 @@ import numpy as np
 from PIL import Image, ImageTk
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+import io
 import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple, deque
 import threading
 import time
+import sys
+import json
+import sqlite3
 
 # Google Drive config
 SERVICE_ACCOUNT_FILE = 'photoboothproject-459010-c725b2899f7f.json'
@@ -27,6 +34,19 @@ except Exception as e:
     drive_service = None
     print(f"Failed to initialize Google Drive service: {e}")
 
+# Клиент Drive держит один httplib2.Http, который нельзя делить между потоками.
+# Поток Tk пользуется drive_service, каждый фоновый поток (загрузки, пул папок,
+# журнал) — собственным клиентом на тех же учётных данных
+drive_local = threading.local()
+
+def drive():
+    if threading.current_thread() is threading.main_thread():
+        return drive_service
+    client = getattr(drive_local, "service", None)
+    if client is None:
+        client = drive_local.service = build('drive', 'v3', credentials=credentials, cache_discovery=False)
+    return client
+
 SAVE_DIR = os.path.abspath("photos")
 os.makedirs(SAVE_DIR, exist_ok=True)
 
@@ -34,11 +54,11 @@ DEVICE_NAME = "EOS Webcam Utility"
 camera_index = 0
 overlay_image_path = None
 overlay_image_cv = None
-cap = None
 preview_running = False
+preview_generation = 0
 capturing = False
 countdown_value = None
-last_uni_folder_id = None
+result_path = None  # Файл, который сейчас показан на экране результата
 ROTATION_OPTIONS = {
     "Без поворота": None,
     "90° вправо (вертикально)": cv2.ROTATE_90_CLOCKWISE,
@@ -46,12 +66,34 @@ ROTATION_OPTIONS = {
     "180°": cv2.ROTATE_180
 }
 
+# Неизменяемый снимок настроек с номером версии. Tk-переменные читаются только
+# в главном потоке (trace на запись), рабочие потоки берут готовый объект settings,
+# а кэши, привязанные к версии, сбрасываются сами при её смене
+Settings = namedtuple("Settings", ["version", "rotation", "photos", "format_a", "frame_mode", "overlay",
+                                   "overlay_hash", "burst"])
+settings = Settings(0, ROTATION_OPTIONS["90° вправо (вертикально)"], 1, False,
+                    "Наложить рамку на каждую фотку отдельно", None, None, False)
+settings_lock = threading.Lock()
+
+def publish_settings(**changes):
+    global settings
+    with settings_lock:
+        settings = settings._replace(version=settings.version + 1, **changes)
+    return settings
+
+def on_settings_var_changed(*_):
+    publish_settings(rotation=ROTATION_OPTIONS[selected_rotation.get()],
+                     photos=int(selected_photos.get()),
+                     format_a=format_a_var.get(),
+                     frame_mode=selected_frame_mode.get(),
+                     burst=burst_var.get())
+
 def list_events():
     if drive_service is None:
         print("Google Drive service not initialized.")
         return [], {}
     try:
-        res = drive_service.files().list(
+        res = drive().files().list(
             q=f"'{EVENTS_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
             spaces='drive', fields='files(id,name)', pageSize=1000
         ).execute()
@@ -67,38 +109,76 @@ def create_event(name):
         return None
     try:
         meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [EVENTS_FOLDER_ID]}
-        folder = drive_service.files().create(body=meta, fields='id').execute()
+        folder = drive().files().create(body=meta, fields='id').execute()
         return folder['id']
     except Exception as e:
         print(f"Failed to create event: {e}")
         return None
 
-def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_folder_id=None):
+def upload_media(path, encoded):
+    if encoded is not None:
+        return MediaIoBaseUpload(io.BytesIO(encoded.data()), mimetype=encoded.profile.mimetype)
+    return MediaFileUpload(path, mimetype='image/png')
+
+def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_folder_id=None,
+                    encoded=None, share=None, folder_id=None, claim_name=False, on_sent=None, outbox_id=None):
+    # encoded — артефакт печатного мастера для папки события, share — копия
+    # для папки по QR; если их нет, с диска читается path
     if drive_service is None:
         print("Google Drive service not initialized.")
         return None, None, None
-    if not os.path.exists(path):
+    if encoded is None and not os.path.exists(path):
         print(f"File {path} not found.")
         return None, None, None
+    share = share or encoded
+    share_path = share.path if share is not None else path
+    
+    # Сделанные шаги запоминаются в строке журнала (outbox_id), и повтор их
+    # пропускает: файл в папке события, новая папка гостя и копия в ней
+    # создаются по одному разу, сколько бы попыток ни понадобилось
+    steps = outbox.steps(outbox_id) if outbox_id is not None else {}
+    def done_step(column, value):
+        steps[column] = value
+        if outbox_id is not None:
+            outbox.record_step(outbox_id, column, value)
     
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            media = MediaFileUpload(path, mimetype='image/png')
-            drive_service.files().create(
-                body={'name': os.path.basename(path), 'parents': [event_folder_id]},
-                media_body=media
-            ).execute()
-            if reuse_last and last_folder_id:
+            if not steps.get("event_file_id"):
+                media = upload_media(path, encoded)
+                uploaded = drive().files().create(
+                    body={'name': os.path.basename(path), 'parents': [event_folder_id]},
+                    media_body=media, fields='id'
+                ).execute()
+                if on_sent:
+                    on_sent(media.size())
+                done_step("event_file_id", uploaded['id'])
+            if folder_id is not None:
+                # Папка из пула или уже показанная в QR; из пула — получает имя сессии
+                uni_id = folder_id
+                if claim_name:
+                    drive().files().update(fileId=folder_id, body={'name': folder_name}).execute()
+            elif reuse_last and last_folder_id:
                 uni_id = last_folder_id
+            elif steps.get("folder_id"):
+                uni_id = steps["folder_id"]
             else:
                 uni_meta = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [UNIVERSAL_FOLDER_ID]}
-                uni_folder = drive_service.files().create(body=uni_meta, fields='id').execute()
+                uni_folder = drive().files().create(body=uni_meta, fields='id').execute()
                 uni_id = uni_folder['id']
-            drive_service.files().create(
-                body={'name': os.path.basename(path), 'parents': [uni_id]},
-                media_body=media
-            ).execute()
+                done_step("folder_id", uni_id)
+            if not steps.get("share_file_id"):
+                # В папку по QR идёт отдельный уменьшенный рендишен, а не второй раз мастер
+                share_media = upload_media(share_path, share)
+                shared = drive().files().create(
+                    body={'name': os.path.basename(share_path), 'parents': [uni_id]},
+                    media_body=share_media, fields='id'
+                ).execute()
+                if on_sent:
+                    on_sent(share_media.size())
+                done_step("share_file_id", shared['id'])
+            folder_pool.filled(uni_id)
             uni_url = f'https://drive.google.com/drive/folders/{uni_id}'
             qr = qrcode.make(uni_url)
             return qr, uni_url, uni_id
@@ -109,6 +189,411 @@ def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_f
                 print(f"Failed to upload file to Google Drive after {max_retries} attempts: {e}")
                 return None, None, None
 
+# Загрузка на Google Drive идёт в фоне: задание ставится в очередь пула, у
+# каждого своё состояние и тайминги, а колбэк завершения вызывается в потоке Tk
+# через window.after — экран результата и следующий гость не ждут сеть и паузы
+# между повторами. Задания с reuse_last идут по одному, чтобы попасть в одну папку
+class UploadJob:
+    def __init__(self, name, args, kwargs, reuse_last, done):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.reuse_last = reuse_last
+        self.done = done
+        self.state = "queued"  # queued -> uploading -> done / failed
+        self.bytes_sent = 0
+        self.result = (None, None, None)  # (qr, url, uni_id) из upload_to_drive
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    def add_sent(self, size):
+        self.bytes_sent += size
+
+class UploadService:
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.completed = queue.Queue()
+        self.lock = threading.Lock()
+        self.folder_lock = threading.Lock()
+        self.pending = 0
+        self.polling = False
+        self.last_folder_id = None
+
+    def submit(self, name, path, folder_name, event_folder_id, reuse_last, done, **kwargs):
+        # Вызывается в потоке Tk; done(job) тоже будет вызван в нём. Папка,
+        # заданная заранее (folder_id), сразу становится последней
+        job = UploadJob(name, (path, folder_name, event_folder_id), kwargs, reuse_last, done)
+        share = kwargs.get("share") or kwargs.get("encoded")
+        job.outbox_id = outbox.enqueue(name, path, share.path if share is not None else path, folder_name,
+                                       event_folder_id, kwargs.get("folder_id"), kwargs.get("claim_name", False))
+        if kwargs.get("folder_id") is not None:
+            self.last_folder_id = kwargs["folder_id"]
+        with self.lock:
+            self.pending += 1
+            depth = self.pending
+        print(f"Upload {name} queued ({depth} in queue)")
+        self.executor.submit(self._run, job)
+        if not self.polling:
+            self.polling = True
+            window.after(50, self._poll)
+        return job
+
+    def queue_depth(self):
+        with self.lock:
+            return self.pending
+
+    def _run(self, job):
+        job.state = "uploading"
+        job.started_at = time.monotonic()
+        try:
+            for artifact in (job.kwargs.get("encoded"), job.kwargs.get("share")):
+                if artifact is not None:
+                    artifact.materialize()  # Журнал дозагружает файлы с диска
+            if job.reuse_last:
+                with self.folder_lock:
+                    job.result = upload_to_drive(*job.args, reuse_last=True, last_folder_id=self.last_folder_id,
+                                                 on_sent=job.add_sent, outbox_id=job.outbox_id, **job.kwargs)
+                    if job.result[2] is not None:
+                        self.last_folder_id = job.result[2]
+            else:
+                job.result = upload_to_drive(*job.args, on_sent=job.add_sent, outbox_id=job.outbox_id, **job.kwargs)
+                if job.result[2] is not None:
+                    self.last_folder_id = job.result[2]
+        except Exception as e:
+            print(f"Upload {job.name} failed: {e}")
+        job.state = "done" if job.result[0] is not None else "failed"
+        if job.state == "done":
+            outbox.finish(job.outbox_id, job.result[2])
+        else:
+            outbox.retry_later(job.outbox_id, "upload failed")
+        job.finished_at = time.monotonic()
+        self.completed.put(job)
+
+    def _poll(self):
+        while True:
+            try:
+                job = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.pending -= 1
+                depth = self.pending
+            print(f"Upload {job.name} {job.state}: waited {(job.started_at - job.submitted_at) * 1000:.0f} ms, "
+                  f"took {(job.finished_at - job.started_at) * 1000:.0f} ms, sent {job.bytes_sent // 1024} KB "
+                  f"({depth} in queue)")
+            try:
+                job.done(job)
+            except Exception as e:
+                print(f"Upload callback failed: {e}")
+        if self.queue_depth() > 0:
+            window.after(50, self._poll)
+        else:
+            self.polling = False
+
+upload_service = UploadService()
+
+# Пул заранее созданных пустых папок под UNIVERSAL_FOLDER_ID: сессия сразу берёт
+# ID папки, и QR показывается до первого загруженного байта, а файл доезжает
+# позже. Пул пополняется в фоне и хранится на диске между запусками; папки
+# старше FOLDER_POOL_MAX_AGE удаляются при старте. Выданные папки помнятся, пока
+# в них не дойдёт файл: брошенная сессия (загрузка так и не завершилась и не ждёт
+# в журнале) оставила бы пустую папку, её QR уже видел гость — такая папка
+# удаляется при старте, а не возвращается в пул
+FOLDER_POOL_FILE = os.path.abspath("folder_pool.json")
+FOLDER_POOL_SIZE = 3
+FOLDER_POOL_MAX_AGE = 7 * 24 * 3600
+
+class FolderPool:
+    def __init__(self, size=FOLDER_POOL_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.folders = []  # [{"id": ..., "created": время создания}]
+        self.claimed = []  # [{"id": ..., "claimed": время выдачи}] — файл ещё не дошёл
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.refilling = False
+
+    def start(self):
+        with self.lock:
+            self.refilling = True
+        self.executor.submit(self._start)
+
+    def claim(self):
+        # ID свободной папки или None, если пул пуст (тогда папку создаст загрузка)
+        with self.lock:
+            folder = self.folders.pop(0) if self.folders else None
+            if folder is not None:
+                self.claimed.append({"id": folder["id"], "claimed": time.time()})
+            self._save()
+        self.refill()
+        return folder["id"] if folder else None
+
+    def filled(self, folder_id):
+        # Загрузка дошла до папки: она больше не считается брошенной
+        with self.lock:
+            before = len(self.claimed)
+            self.claimed = [f for f in self.claimed if f["id"] != folder_id]
+            if len(self.claimed) != before:
+                self._save()
+
+    def refill(self):
+        with self.lock:
+            if self.refilling or len(self.folders) >= self.size:
+                return
+            self.refilling = True
+        self.executor.submit(self._refill)
+
+    def _save(self):
+        try:
+            with open(FOLDER_POOL_FILE, "w", encoding="utf-8") as fh:
+                json.dump({"folders": self.folders, "claimed": self.claimed}, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save folder pool: {e}")
+
+    def _start(self):
+        try:
+            with open(FOLDER_POOL_FILE, encoding="utf-8") as fh:
+                saved = json.load(fh)
+            folders, claimed = saved.get("folders", []), saved.get("claimed", [])
+        except (OSError, ValueError):
+            folders, claimed = [], []
+        kept, abandoned = self._check_claimed(claimed)
+        now = time.time()
+        fresh = [f for f in folders if now - f["created"] < FOLDER_POOL_MAX_AGE]
+        for folder in folders:
+            if folder in fresh or drive_service is None:
+                continue
+            try:
+                drive().files().delete(fileId=folder["id"]).execute()
+            except Exception as e:
+                print(f"Failed to delete stale pool folder {folder['id']}: {e}")
+        with self.lock:
+            self.folders = fresh + self.folders
+            self.claimed = kept + self.claimed
+            self._save()
+        print(f"Folder pool: {len(fresh)} reused, {len(folders) - len(fresh)} stale removed, "
+              f"{abandoned} abandoned removed")
+        self._refill()
+
+    def _check_claimed(self, claimed):
+        # Выданная папка остаётся за сессией, пока её загрузка ждёт в журнале;
+        # пустая и никем не ожидаемая удаляется, непустая просто забывается
+        kept, abandoned = [], 0
+        for folder in claimed:
+            if drive_service is None or outbox.waits_for_folder(folder["id"]):
+                kept.append(folder)
+                continue
+            try:
+                children = drive().files().list(q=f"'{folder['id']}' in parents and trashed=false",
+                                                fields='files(id)', pageSize=1).execute().get('files', [])
+                if not children:
+                    drive().files().delete(fileId=folder["id"]).execute()
+                    abandoned += 1
+            except Exception as e:
+                print(f"Failed to check claimed pool folder {folder['id']}: {e}")
+                kept.append(folder)
+        return kept, abandoned
+
+    def _refill(self):
+        try:
+            while drive_service is not None:
+                with self.lock:
+                    if len(self.folders) >= self.size:
+                        break
+                name = f"pool_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [UNIVERSAL_FOLDER_ID]}
+                folder = drive().files().create(body=meta, fields='id').execute()
+                with self.lock:
+                    self.folders.append({"id": folder['id'], "created": time.time()})
+                    self._save()
+        except Exception as e:
+            print(f"Failed to refill folder pool: {e}")
+        finally:
+            with self.lock:
+                self.refilling = False
+
+folder_pool = FolderPool()
+
+def claim_share_folder(reuse_last):
+    # Папка для QR известна сразу: последняя (при reuse_last) или свободная из пула.
+    # Возвращает (ID или None, нужно ли переименовать папку под сессию)
+    if reuse_last and upload_service.last_folder_id:
+        return upload_service.last_folder_id, False
+    return folder_pool.claim(), True
+
+def folder_qr(folder_id):
+    return qrcode.make(f'https://drive.google.com/drive/folders/{folder_id}')
+
+# Журнал загрузок в SQLite: сессия записывается до начала загрузки (файлы,
+# событие, папка гостя, статус), поэтому загрузка, сорвавшаяся без сети, не
+# теряется. Фоновый разборщик повторяет отложенные записи с растущей паузой и
+# после перезапуска продолжает с того места, где остановился. После
+# OUTBOX_MAX_ATTEMPTS неудач запись помечается 'failed' и ждёт оператора;
+# загруженные записи удаляются через OUTBOX_KEEP_DAYS
+OUTBOX_DB = os.path.abspath("outbox.sqlite3")
+OUTBOX_POLL_S = 5
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 30 * 60
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_KEEP_DAYS = 7
+OUTBOX_PRUNE_S = 60 * 60
+OUTBOX_STEPS = ("event_file_id", "folder_id", "share_file_id")  # ID, созданные шагами загрузки
+
+class Outbox:
+    def __init__(self, db_path=OUTBOX_DB):
+        self.db_path = db_path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY, name TEXT, path TEXT, share_path TEXT, folder_name TEXT,
+                event_id TEXT, folder_id TEXT, claim_name INTEGER, status TEXT,
+                attempts INTEGER DEFAULT 0, created REAL, next_try REAL, last_error TEXT, uni_id TEXT,
+                event_file_id TEXT, share_file_id TEXT)""")
+            # Журналы, созданные до записи шагов, получают недостающие столбцы
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(outbox)")}
+            for column in ("event_file_id", "share_file_id"):
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+            # Загрузки, прерванные закрытием программы, снова ждут своей очереди
+            self.db.execute("UPDATE outbox SET status = 'pending' WHERE status = 'uploading'")
+        self.prune()
+        count, oldest, failed = self.status()
+        print(f"Outbox: {count} pending" + (f", oldest {oldest / 60:.0f} min" if oldest is not None else "")
+              + (f", {failed} failed" if failed else ""))
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def enqueue(self, name, path, share_path, folder_name, event_id, folder_id, claim_name):
+        # Запись принадлежит живому заданию UploadService, пока оно не отчитается
+        now = time.time()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO outbox (name, path, share_path, folder_name, event_id, folder_id, claim_name, "
+                "status, created, next_try) VALUES (?, ?, ?, ?, ?, ?, ?, 'uploading', ?, ?)",
+                (name, path, share_path, folder_name, event_id, folder_id, int(claim_name), now, now))
+            return cursor.lastrowid
+
+    def steps(self, row_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(OUTBOX_STEPS)} FROM outbox WHERE id = ?", (row_id,)).fetchone()
+        return {column: row[column] for column in OUTBOX_STEPS if row[column]} if row else {}
+
+    def record_step(self, row_id, column, value):
+        if column not in OUTBOX_STEPS:
+            raise ValueError(f"Unknown outbox step {column}")
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE outbox SET {column} = ? WHERE id = ?", (value, row_id))
+
+    def finish(self, row_id, uni_id):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET status = 'done', uni_id = ?, last_error = NULL WHERE id = ?",
+                            (uni_id, row_id))
+
+    def fail(self, row_id, error):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, row_id))
+
+    def retry_later(self, row_id, error):
+        with self.lock, self.db:
+            attempts = self.db.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()[0] + 1
+            status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+            delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+            self.db.execute("UPDATE outbox SET status = ?, attempts = ?, next_try = ?, last_error = ? "
+                            "WHERE id = ?", (status, attempts, time.time() + delay, error, row_id))
+        if status == "failed":
+            print(f"Outbox: giving up on row {row_id} after {attempts} attempts: {error}")
+
+    def prune(self):
+        with self.lock, self.db:
+            deleted = self.db.execute("DELETE FROM outbox WHERE status = 'done' AND created < ?",
+                                      (time.time() - OUTBOX_KEEP_DAYS * 24 * 60 * 60,)).rowcount
+        if deleted:
+            print(f"Outbox: pruned {deleted} uploaded rows")
+
+    def waits_for_folder(self, folder_id):
+        # Есть ли незавершённая загрузка в эту папку (в том числе брошенная после попыток)
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM outbox WHERE folder_id = ? AND status != 'done' LIMIT 1",
+                                   (folder_id,)).fetchone() is not None
+
+    def status(self):
+        # (сколько ещё не на Drive, возраст самой старой записи в секундах или None,
+        #  сколько записей брошено после OUTBOX_MAX_ATTEMPTS попыток)
+        with self.lock:
+            count, oldest = self.db.execute(
+                "SELECT COUNT(*), MIN(created) FROM outbox WHERE status IN ('pending', 'uploading')").fetchone()
+            failed = self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+        return count, time.time() - oldest if oldest is not None else None, failed
+
+    def _claim_due(self):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT * FROM outbox WHERE status = 'pending' AND next_try <= ? "
+                                  "ORDER BY created LIMIT 1", (time.time(),)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE outbox SET status = 'uploading' WHERE id = ?", (row["id"],))
+        return row
+
+    def _drain(self):
+        pruned_at = time.monotonic()
+        while True:
+            if time.monotonic() - pruned_at > OUTBOX_PRUNE_S:
+                self.prune()
+                pruned_at = time.monotonic()
+            if drive_service is None:
+                # Без Drive попытки только копили бы неудачи: записи ждут перезапуска
+                time.sleep(OUTBOX_POLL_S)
+                continue
+            row = self._claim_due()
+            if row is None:
+                time.sleep(OUTBOX_POLL_S)
+                continue
+            if not os.path.exists(row["path"]):
+                print(f"Outbox: {row['path']} is gone, dropping {row['name']}")
+                self.fail(row["id"], "file missing")
+                continue
+            print(f"Outbox: uploading {row['name']} (attempt {row['attempts'] + 1})")
+            try:
+                qr, url, uni_id = outbox_upload(row)
+                error = "upload failed"
+            except Exception as e:
+                qr, uni_id, error = None, None, str(e)
+            if qr is not None:
+                self.finish(row["id"], uni_id)
+                print(f"Outbox: {row['name']} uploaded")
+            else:
+                self.retry_later(row["id"], error)
+
+outbox = Outbox()
+
+def file_artifact(path, session_io):
+    ext = os.path.splitext(path)[1]
+    profile = next(p for p in ENCODER_PROFILES.values() if p.ext == ext)
+    return SessionArtifact(session_io, path, profile=profile)
+
+def outbox_upload(row):
+    # Повтор из журнала: файлы уже на диске, папка гостя — та, что была в QR
+    session_io = SessionIO()
+    share_path = row["share_path"] if os.path.exists(row["share_path"]) else row["path"]
+    return upload_to_drive(row["path"], row["folder_name"], row["event_id"], folder_id=row["folder_id"],
+                           outbox_id=row["id"],
+                           claim_name=bool(row["claim_name"]), encoded=file_artifact(row["path"], session_io),
+                           share=file_artifact(share_path, session_io))
+
+def update_outbox_status():
+    count, oldest, failed = outbox.status()
+    if count:
+        text = f"Ждут загрузки: {count}, самая старая — {oldest / 60:.0f} мин"
+    else:
+        text = "Все загрузки завершены"
+    if failed:
+        text += f"\nНе загрузились после {OUTBOX_MAX_ATTEMPTS} попыток: {failed}"
+    outbox_label.config(text=text, fg="#ff6666" if failed else "white")
+    window.after(5000, update_outbox_status)
+
 def load_overlay():
     global overlay_image_path, overlay_image_cv
     file = filedialog.askopenfilename(filetypes=[("Image Files", ".png;.jpg;*.jpeg")])
@@ -129,363 +614,903 @@ def load_overlay():
     else:
         pad = (1800 - nh) // 2
         overlay_image_cv = cv2.copyMakeBorder(resized, pad, 1800-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
+    publish_settings(overlay=overlay_image_cv, overlay_hash=image_hash(overlay_image_cv))
     print("Overlay loaded successfully.")
 
 def clear_overlay():
     global overlay_image_path, overlay_image_cv
     overlay_image_path = None
     overlay_image_cv = None
+    publish_settings(overlay=None, overlay_hash=None)
     print("Overlay cleared.")
 
-preview_queue = queue.Queue(maxsize=10)
-
-def process_frames():
-    global cap, overlay_image_cv, countdown_value
-    while preview_running:
-        if not (cap and cap.isOpened()):
-            time.sleep(0.01)
-            continue
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.01)
-            continue
-        rot = ROTATION_OPTIONS[selected_rotation.get()]
-        if rot is not None:
-            frame = cv2.rotate(frame, rot)
-        h, w = frame.shape[:2]
-        scale = 600 / w
-        nh = int(h * scale)
-        frame = cv2.resize(frame, (600, nh))
-        if nh > 900:
-            off = (nh - 900) // 2
-            frame = frame[off:off+900, :]
-        else:
-            pad = (900 - nh) // 2
-            frame = cv2.copyMakeBorder(frame, pad, 900-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
-        if overlay_image_cv is not None and not format_a_var.get():
-            ov = cv2.resize(overlay_image_cv, (600, 900))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                frame = (frame * (1 - alpha) + rgb * alpha).astype(np.uint8)
-            else:
-                frame = cv2.addWeighted(frame, 0.7, ov, 0.3, 0)
-        if countdown_value is not None:
-            txt = str(countdown_value)
-            org = (frame.shape[1]//2 - 60, frame.shape[0]//2 + 60)
-            cv2.putText(frame, txt, org,
-                        cv2.FONT_HERSHEY_SIMPLEX, 5,
-                        (255,255,255), 10, cv2.LINE_AA)
+# Смешивание в фиксированной точке, общее для превью, отсчёта, коллажей и шаблонов:
+# рамка один раз переводится в предумноженный вид (цвет * вес, вес 0..256 в uint16),
+# а результат пишется прямо в кадр или его ROI, без float-массивов. Отличие от
+# float-формулы photo * (1 - a) + rgb * a — не больше 1 LSB
+def premultiply(ov):
+    if ov.shape[2] == 4:
+        # Альфа 0..255 переводится в вес 0..256, чтобы результат делился сдвигом на 8
+        a = ov[:, :, 3:].astype(np.uint16)
+        a += a >> 7
+        return ov[:, :, :3] * a, 256 - a
+    # Аналог cv2.addWeighted(frame, 0.7, ov, 0.3, 0)
+    return ov.astype(np.uint16) * np.uint16(77), np.uint16(179)
+
+def blend_into(dst, premul, inv):
+    # (dst * inv + premul + 128) >> 8 на месте; dst — uint8-кадр или его ROI
+    acc = dst.astype(np.uint16)
+    acc *= inv
+    acc += premul
+    acc += 128
+    acc >>= 8
+    dst[...] = acc
+    return dst
+
+# Кэш подготовленной рамки: масштабирование, разделение на цвет/альфу и
+# предумножение выполняются один раз на (ширина, высота, режим смешивания)
+overlay_cache = {}
+OVERLAY_CACHE_MAX_ENTRIES = 8
+overlay_cache_stats = {"hits": 0, "misses": 0}
+overlay_cache_version = 0  # версия снимка настроек, для которой собран кэш
+overlay_cache_lock = threading.Lock()
+
+def sync_overlay_cache(version):
+    # Вызывается под overlay_cache_lock: более новый снимок настроек сбрасывает кэш
+    global overlay_cache_version
+    if version > overlay_cache_version:
+        if overlay_cache:
+            print(f"Overlay cache invalidated (hits={overlay_cache_stats['hits']}, misses={overlay_cache_stats['misses']})")
+        overlay_cache.clear()
+        overlay_cache_version = version
+
+def get_overlay_cache_stats():
+    with overlay_cache_lock:
+        return dict(overlay_cache_stats, entries=len(overlay_cache))
+
+def get_prepared_overlay(width, height, snapshot=None):
+    snapshot = snapshot or settings
+    src = snapshot.overlay
+    if src is None:
+        return None
+    mode = "alpha" if src.shape[2] == 4 else "weighted"
+    key = (width, height, mode)
+    with overlay_cache_lock:
+        sync_overlay_cache(snapshot.version)
+        prepared = overlay_cache.get(key) if snapshot.version == overlay_cache_version else None
+        if prepared is not None:
+            overlay_cache_stats["hits"] += 1
+            return prepared
+        overlay_cache_stats["misses"] += 1
+    premul, inv = premultiply(cv2.resize(src, (width, height)))
+    prepared = (mode, premul, inv)
+    with overlay_cache_lock:
+        if snapshot.version == overlay_cache_version:
+            if len(overlay_cache) >= OVERLAY_CACHE_MAX_ENTRIES:
+                overlay_cache.pop(next(iter(overlay_cache)))
+            overlay_cache[key] = prepared
+        print(f"Overlay cache miss for {width}x{height} {mode} (hits={overlay_cache_stats['hits']}, misses={overlay_cache_stats['misses']})")
+    return prepared
+
+def blend_prepared_overlay(frame, prepared):
+    # Смешивание на месте: кадр должен принадлежать вызывающему
+    _, premul, inv = prepared
+    return blend_into(frame, premul, inv)
+
+# Согласование режима камеры: реально поддерживаемые режимы (разрешение, fps,
+# fourcc) определяются один раз и кэшируются на диске по имени устройства
+CAMERA_MODES_FILE = os.path.abspath("camera_modes.json")
+CAMERA_CANDIDATE_SIZES = [(640, 480), (1280, 720), (1024, 768), (1600, 1200), (1920, 1080),
+                          (2048, 1536), (2592, 1944), (3840, 2160)]
+CAMERA_FOURCCS = ["MJPG", "YUY2"]
+camera_mode_logged = False
+
+def fourcc_to_str(value):
+    code = int(value)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00")
+
+def probe_camera_modes(index):
+    # OpenCV не перечисляет режимы сам, поэтому каждый кандидат запрашивается
+    # и сверяется с тем, что драйвер выставил на самом деле
+    probe = cv2.VideoCapture(index, cv2.CAP_DSHOW)
+    if not probe.isOpened():
+        print("Failed to open camera for mode probing.")
+        return []
+    modes = []
+    try:
+        for fourcc in CAMERA_FOURCCS:
+            for width, height in CAMERA_CANDIDATE_SIZES:
+                probe.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+                probe.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                probe.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                probe.set(cv2.CAP_PROP_FPS, 30)
+                actual = (int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                actual_fourcc = fourcc_to_str(probe.get(cv2.CAP_PROP_FOURCC))
+                if actual != (width, height) or actual_fourcc != fourcc:
+                    continue
+                mode = {"width": width, "height": height,
+                        "fps": round(probe.get(cv2.CAP_PROP_FPS), 2), "fourcc": fourcc}
+                if mode not in modes:
+                    modes.append(mode)
+    finally:
+        probe.release()
+    return modes
+
+def load_camera_modes(index):
+    try:
+        with open(CAMERA_MODES_FILE, encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        cached = {}
+    if cached.get(DEVICE_NAME):
+        return cached[DEVICE_NAME]
+    modes = probe_camera_modes(index)
+    print(f"Probed {len(modes)} camera modes for {DEVICE_NAME}: {modes}")
+    if modes:
+        cached[DEVICE_NAME] = modes
         try:
-            preview_queue.put_nowait(frame)
-        except queue.Full:
-            pass
-        time.sleep(0.01)
+            with open(CAMERA_MODES_FILE, "w", encoding="utf-8") as fh:
+                json.dump(cached, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save camera modes: {e}")
+    return modes
+
+def select_camera_mode(modes, width, fps, rotation):
+    # Кадр масштабируется по ширине, поэтому матрица должна покрывать ширину
+    # после поворота; из подходящих берётся самый дешёвый по числу пикселей,
+    # для больших разрешений предпочитается сжатый MJPG
+    rotated = rotation in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    def cost(mode):
+        pixels = mode["width"] * mode["height"]
+        prefer_mjpg = pixels > 640 * 480
+        return (pixels, 0 if (mode["fourcc"] == "MJPG") == prefer_mjpg else 1)
+    # Многие драйверы DirectShow отдают CAP_PROP_FPS = 0: такая частота
+    # неизвестна и режим не отсеивается, иначе всегда брался бы самый большой
+    suitable = [m for m in modes
+                if (m["height"] if rotated else m["width"]) >= width and (m["fps"] <= 0 or m["fps"] >= fps)]
+    if suitable:
+        return min(suitable, key=cost)
+    if modes:
+        return max(modes, key=lambda m: (m["width"] * m["height"], m["fourcc"] == "MJPG", m["fps"]))
+    return None
+
+def measure_camera_fps(camera, frames=20):
+    camera.read()  # первый кадр включает прогрев камеры
+    start = time.monotonic()
+    received = 0
+    for _ in range(frames):
+        ret, _ = camera.read()
+        if ret:
+            received += 1
+    elapsed = time.monotonic() - start
+    return received / elapsed if elapsed > 0 else 0.0
+
+def open_camera(fps, width, height, rotation):
+    global camera_mode_logged
+    mode = select_camera_mode(load_camera_modes(camera_index), width, fps, rotation)
+    camera = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
+    if not camera.isOpened():
+        return camera
+    if mode is not None:
+        # FOURCC нужно выставлять до размера кадра, иначе DirectShow его игнорирует
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode["fourcc"]))
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, mode["width"])
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, mode["height"])
+    else:
+        if rotation in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+            width, height = height, width
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    camera.set(cv2.CAP_PROP_FPS, fps)
+    if not camera_mode_logged:
+        camera_mode_logged = True
+        actual = (int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)), int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        actual_fourcc = fourcc_to_str(camera.get(cv2.CAP_PROP_FOURCC))
+        print(f"Camera mode for {DEVICE_NAME}: chosen {mode}, driver reports "
+              f"{actual[0]}x{actual[1]} {actual_fourcc}, measured {measure_camera_fps(camera):.1f} fps")
+    return camera
+
+# План геометрии: поворот, масштаб, обрезка/поля и зеркало сводятся в одну
+# аффинную матрицу на (размер входа, настройки) и применяются за один проход
+geometry_cache = {}
+geometry_cache_version = 0  # версия снимка настроек, для которой собран кэш
+
+def get_geometry_plan(src_w, src_h, rotation, target_w=None, target_h=None, mirror=False):
+    global geometry_cache_version
+    version = settings.version
+    if version != geometry_cache_version:
+        geometry_cache.clear()  # планы старых настроек больше не понадобятся
+        geometry_cache_version = version
+    key = (src_w, src_h, rotation, target_w, target_h, mirror)
+    plan = geometry_cache.get(key)
+    if plan is not None:
+        return plan
+    # Поворот в непрерывных координатах (границы пикселей — целые числа)
+    if rotation == cv2.ROTATE_90_CLOCKWISE:
+        m = np.array([[0, -1, src_h], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_h, src_w
+    elif rotation == cv2.ROTATE_90_COUNTERCLOCKWISE:
+        m = np.array([[0, 1, 0], [-1, 0, src_w], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_h, src_w
+    elif rotation == cv2.ROTATE_180:
+        m = np.array([[-1, 0, src_w], [0, -1, src_h], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_w, src_h
+    else:
+        m = np.eye(3)
+        rw, rh = src_w, src_h
+    # Масштаб по ширине target_w, по высоте — центрированная обрезка или чёрные поля до target_h
+    out_w = target_w or rw
+    nh = int(rh * out_w / rw) if target_w else rh
+    out_h = target_h or nh
+    offset_y = -((nh - out_h) // 2) if nh > out_h else (out_h - nh) // 2
+    m = np.array([[out_w / rw, 0, 0], [0, nh / rh, offset_y], [0, 0, 1]]) @ m
+    if mirror:
+        m = np.array([[-1, 0, out_w], [0, 1, 0], [0, 0, 1]]) @ m
+    # Переход к индексам пикселей (центр пикселя i находится в i + 0.5), как в cv2.resize
+    m = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]]) @ m @ np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+    if (out_w, out_h) == (src_w, src_h) and np.allclose(m, np.eye(3)):
+        matrix = None
+    else:
+        matrix = m[:2]
+    # Без масштабирования матрица переставляет пиксели целиком, интерполяция не нужна
+    interpolation = cv2.INTER_NEAREST if (out_w, nh) == (rw, rh) else cv2.INTER_LINEAR
+    # Строки чёрных полей сверху и снизу; края кадра продолжаются своими пикселями, как в cv2.resize
+    pad = (offset_y, offset_y + nh) if nh < out_h else None
+    plan = (matrix, (out_w, out_h), interpolation, pad)
+    geometry_cache[key] = plan
+    return plan
+
+def apply_geometry(frame, rotation, target_w=None, target_h=None, mirror=False):
+    h, w = frame.shape[:2]
+    matrix, size, interpolation, pad = get_geometry_plan(w, h, rotation, target_w, target_h, mirror)
+    if matrix is None:
+        return frame
+    out = cv2.warpAffine(frame, matrix, size, flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
+    if pad is not None:
+        out[:pad[0]] = 0
+        out[pad[1]:] = 0
+    return out
+
+class LatestFrameSlot:
+    # Одноместный обмен кадрами между потоками: новый кадр вытесняет
+    # непрочитанный старый, поэтому превью всегда показывает самый свежий кадр
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, frame, ts):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = (frame, ts)
+            self._cond.notify_all()
+
+    def take(self, timeout=None):
+        with self._cond:
+            if self._item is None and timeout:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def clear(self):
+        with self._cond:
+            self._item = None
+
+class DisplaySurface:
+    # Один PhotoImage на размер виджета: новый кадр вставляется в него на месте
+    # через paste(), вместо создания нового PhotoImage на каждом тике
+    def __init__(self, label):
+        self.label = label
+        self.photo = None
+
+    def show(self, image):
+        if self.photo is None or (self.photo.width(), self.photo.height()) != image.size:
+            self.photo = ImageTk.PhotoImage(image)
+            self.label.imgtk = self.photo
+            self.label.config(image=self.photo)
+        else:
+            self.photo.paste(image)
+
+    def clear(self):
+        self.photo = None
+        self.label.imgtk = None
+        self.label.config(image='')
+
+preview_slot = LatestFrameSlot()
+PREVIEW_STATS_INTERVAL = 5.0
+preview_stats = {"displayed": 0, "dropped": 0, "age_ms": 0.0, "avg_age_ms": 0.0, "fps": 0.0}
+preview_stats_window = {"start": time.monotonic(), "frames": 0, "age_sum": 0.0, "dropped": 0}
+
+def record_preview_frame(capture_ts):
+    # Возраст кадра от захвата до показа, потерянные кадры и фактический fps
+    now = time.monotonic()
+    age_ms = (now - capture_ts) * 1000
+    preview_stats["displayed"] += 1
+    preview_stats["dropped"] = preview_slot.dropped
+    preview_stats["age_ms"] = age_ms
+    window_stats = preview_stats_window
+    window_stats["frames"] += 1
+    window_stats["age_sum"] += age_ms
+    elapsed = now - window_stats["start"]
+    if elapsed >= PREVIEW_STATS_INTERVAL:
+        preview_stats["fps"] = window_stats["frames"] / elapsed
+        preview_stats["avg_age_ms"] = window_stats["age_sum"] / window_stats["frames"]
+        dropped = preview_slot.dropped - window_stats["dropped"]
+        print(f"Preview: {preview_stats['fps']:.1f} fps, frame age {preview_stats['avg_age_ms']:.0f} ms avg / "
+              f"{age_ms:.0f} ms last, dropped {dropped} (total {preview_slot.dropped})")
+        window_stats.update(start=now, frames=0, age_sum=0.0, dropped=preview_slot.dropped)
+
+def get_preview_stats():
+    return dict(preview_stats)
+
+# Снимок без задержки затвора: сессия держит несколько последних полноразмерных
+# кадров с monotonic-метками, снимок берётся из них по моменту конца отсчёта
+ZSL_RING_FRAMES = 8
+shutter_lags = []  # на каждый снимок: (опоздание таймера, отклонение кадра от цели), мс
+
+def record_shutter_lag(target_ts, captured_at, fired_at=None):
+    timer_late_ms = ((fired_at or time.monotonic()) - target_ts) * 1000
+    lag_ms = (captured_at - target_ts) * 1000
+    shutter_lags.append((timer_late_ms, lag_ms))
+    print(f"Shutter lag {lag_ms:+.0f} ms (timer fired {timer_late_ms:.0f} ms late, "
+          f"ring {camera.ring_span_ms():.0f} ms)")
+
+class CameraSession:
+    # Долгоживущая сессия камеры: владеет устройством, читает кадры в своём
+    # потоке и раздаёт их подписчикам (превью, снимок, запись). Режим меняется
+    # без закрытия и повторного открытия устройства.
+    def __init__(self, index):
+        self.index = index
+        self.capture = None
+        self.fps = None
+        self.last_switch_ms = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._latest = None
+        self._running = False
+        self._thread = None
+        self._switch_started = None
+        self._ring = deque(maxlen=ZSL_RING_FRAMES)
+
+    def is_open(self):
+        return self.capture is not None
+
+    def open(self, fps, width, height, rotation):
+        if self.is_open():
+            self.switch_mode(fps)
+            return True
+        capture = open_camera(fps, width, height, rotation)
+        if not capture.isOpened():
+            return False
+        self.capture = capture
+        self.fps = fps
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def _read_loop(self):
+        while self._running:
+            with self._lock:
+                if self.capture is None:
+                    break
+                ret, frame = self.capture.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            captured_at = time.monotonic()
+            self._latest = (frame, captured_at)
+            self._ring.append(self._latest)
+            if self._switch_started is not None:
+                self.last_switch_ms = (captured_at - self._switch_started) * 1000
+                self._switch_started = None
+                print(f"Camera switched to {self.fps} fps in {self.last_switch_ms:.0f} ms")
+            for slot in list(self._subscribers):
+                slot.put(frame, captured_at)
+
+    def subscribe(self):
+        slot = LatestFrameSlot()
+        self._subscribers.append(slot)
+        return slot
+
+    def unsubscribe(self, slot):
+        if slot in self._subscribers:
+            self._subscribers.remove(slot)
+
+    def latest(self):
+        return self._latest
+
+    def frame_at(self, target_ts):
+        # Кадр из кольца последних кадров, ближайший по времени захвата к target_ts
+        frames = list(self._ring)
+        if not frames:
+            return self._latest
+        return min(frames, key=lambda item: abs(item[1] - target_ts))
+
+    def frames_around(self, target_ts, count):
+        # count кадров кольца, ближайших к target_ts, в порядке захвата
+        frames = sorted(self._ring, key=lambda item: abs(item[1] - target_ts))[:count]
+        return sorted(frames, key=lambda item: item[1])
+
+    def ring_span_ms(self):
+        frames = list(self._ring)
+        return (frames[-1][1] - frames[0][1]) * 1000 if len(frames) > 1 else 0.0
+
+    def switch_mode(self, fps):
+        # Задержка переключения — от запроса до первого кадра в новом режиме
+        if not self.is_open() or fps == self.fps:
+            return
+        started = time.monotonic()
+        with self._lock:
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+        self.fps = fps
+        self._switch_started = started
+
+    def close(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        with self._lock:
+            if self.capture is not None:
+                self.capture.release()
+            self.capture = None
+        self._thread = None
+        self._latest = None
+        self._ring.clear()
+        self.fps = None
+        self._subscribers.clear()
+
+camera = CameraSession(camera_index)
+
+# Превью рендерится ровно в размер метки на экране: кадр 2:3 вписывается в её
+# внутреннюю область, кэши геометрии и рамки перестраиваются только при смене размера
+preview_size = (600, 900)
+
+def on_preview_configure(event):
+    global preview_size
+    border = 2 * (int(preview_label.cget("bd")) + int(preview_label.cget("highlightthickness")))
+    avail_w, avail_h = event.width - border, event.height - border
+    width = min(avail_w, avail_h * 2 // 3) // 2 * 2
+    if width >= 2 and (width, width * 3 // 2) != preview_size:
+        preview_size = (width, width * 3 // 2)
+        print(f"Preview size: {preview_size[0]}x{preview_size[1]}")
+
+# Спрайты цифр отсчёта: каждая цифра растеризуется один раз на (масштаб превью,
+# шрифт, кадр анимации) и смешивается с кадром только внутри своего прямоугольника
+COUNTDOWN_FONT = cv2.FONT_HERSHEY_SIMPLEX
+COUNTDOWN_ANIMATION_FRAMES = 1  # больше 1 — цифра появляется крупнее и гаснет к концу секунды
+COUNTDOWN_SPRITES_MAX = 64
+countdown_sprites = {}
+countdown_changed_at = time.monotonic()
+countdown_target = None  # момент, когда отсчёт доходит до снимка
+
+def get_countdown_sprite(text, k, step=0):
+    key = (text, round(k, 3), COUNTDOWN_FONT, step)
+    sprite = countdown_sprites.get(key)
+    if sprite is not None:
+        return sprite
+    thickness = max(1, int(10 * k))
+    (bw, bh), _ = cv2.getTextSize(text, COUNTDOWN_FONT, 5 * k, thickness)
+    grow, fade = 1.0, 1.0
+    if COUNTDOWN_ANIMATION_FRAMES > 1:
+        t = step / COUNTDOWN_ANIMATION_FRAMES
+        grow = 1.0 + 0.25 * (1 - t) ** 2
+        fade = min(1.0, 2 * (1 - t))
+    (tw, th), baseline = cv2.getTextSize(text, COUNTDOWN_FONT, 5 * k * grow, thickness)
+    pad = thickness
+    mask = np.zeros((th + baseline + 2 * pad, tw + 2 * pad), dtype=np.uint8)
+    cv2.putText(mask, text, (pad, pad + th), COUNTDOWN_FONT, 5 * k * grow, 255, thickness, cv2.LINE_AA)
+    # Вес 0..256, как у рамки: белая цифра даёт premul = 255 * a
+    a = np.round(mask.astype(np.float32) * (256 / 255 * fade)).astype(np.uint16)[:, :, None]
+    premul = a * np.uint16(255)
+    inv = np.uint16(256) - a
+    # Центр цифры совпадает с тем, что рисовал cv2.putText с org = (W/2 - 60k, H/2 + 60k)
+    cx = -int(60 * k) + bw / 2
+    cy = int(60 * k) - bh / 2
+    sprite = (premul, inv, int(round(cx - pad - tw / 2)), int(round(cy - pad - th / 2)))
+    if len(countdown_sprites) >= COUNTDOWN_SPRITES_MAX:
+        countdown_sprites.clear()
+    countdown_sprites[key] = sprite
+    return sprite
+
+def countdown_step():
+    # Кадр анимации — по времени, прошедшему с показа текущей цифры
+    if COUNTDOWN_ANIMATION_FRAMES == 1:
+        return 0
+    elapsed = time.monotonic() - countdown_changed_at
+    return min(COUNTDOWN_ANIMATION_FRAMES - 1, int(elapsed * COUNTDOWN_ANIMATION_FRAMES))
+
+def draw_countdown(frame, text, k, step=0):
+    premul, inv, dx, dy = get_countdown_sprite(text, k, step)
+    h, w = frame.shape[:2]
+    x0, y0 = w // 2 + dx, h // 2 + dy
+    sh, sw = inv.shape[:2]
+    fx0, fy0 = max(x0, 0), max(y0, 0)
+    fx1, fy1 = min(x0 + sw, w), min(y0 + sh, h)
+    if fx0 >= fx1 or fy0 >= fy1:
+        return
+    cut = (slice(fy0 - y0, fy1 - y0), slice(fx0 - x0, fx1 - x0))
+    blend_into(frame[fy0:fy1, fx0:fx1], premul[cut], inv[cut])
+
+def process_frames(generation):
+    frames = camera.subscribe()
+    try:
+        while preview_running and generation == preview_generation:
+            item = frames.take(timeout=0.1)
+            if item is None:
+                continue
+            compose_preview_frame(*item)
+    finally:
+        camera.unsubscribe(frames)
+
+def compose_preview_frame(frame, captured_at):
+    s = settings
+    source = frame
+    width, height = preview_size
+    frame = apply_geometry(frame, s.rotation, width, height)
+    if frame is source:
+        frame = frame.copy()  # дальше кадр меняется на месте, а исходный общий с другими подписчиками
+    if s.overlay is not None and not s.format_a:
+        prepared = get_prepared_overlay(width, height, s)
+        if prepared is not None:
+            blend_prepared_overlay(frame, prepared)
+    if countdown_value is not None:
+        k = frame.shape[0] / 900  # размер цифр — как раньше на превью 600x900
+        draw_countdown(frame, str(countdown_value), k, countdown_step())
+    # Перевод в RGB и подготовка PIL-изображения — в рабочем потоке, а не в Tk
+    preview_slot.put(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), captured_at)
 
 def update_preview():
-    global cap, preview_running
-    if cap and cap.isOpened():
-        cap.release()
-    cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    if not cap.isOpened():
+    global preview_running, preview_generation
+    if not camera.open(30, 1200, 1800, settings.rotation):
         print("Failed to open camera for preview.")
         return
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1200)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1800)
     preview_running = True
-    threading.Thread(target=process_frames, daemon=True).start()
+    preview_generation += 1
+    generation = preview_generation
+    preview_slot.clear()
+    preview_stats_window.update(start=time.monotonic(), frames=0, age_sum=0.0, dropped=preview_slot.dropped)
+    threading.Thread(target=process_frames, args=(generation,), daemon=True).start()
     def loop():
-        if not preview_running:
+        if not preview_running or generation != preview_generation:
             return
-        try:
-            frame = preview_queue.get_nowait()
-            preview_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            imgtk = ImageTk.PhotoImage(Image.fromarray(preview_rgb))
-            preview_label.imgtk = imgtk
-            preview_label.config(image=imgtk)
-        except queue.Empty:
-            pass
-        preview_label.after(33, loop)
+        item = preview_slot.take()
+        if item is not None:
+            image, captured_at = item
+            preview_surface.show(image)
+            record_preview_frame(captured_at)
+        preview_label.after(15, loop)
     loop()
 
 def stop_preview():
-    global cap, preview_running
+    global preview_running
     preview_running = False
-    if cap and cap.isOpened():
-        cap.release()
-        cap = None
-    preview_label.config(image='')
+    preview_surface.clear()
 
 def start_countdown(sec, callback):
-    global countdown_value
-    def finish():
-        global countdown_value
-        countdown_value = None
-        callback()
+    global countdown_value, countdown_target
+    # Снимок — в момент появления «0»; «0» остаётся на экране, пока снимок не
+    # сделан, и убирается finish_still()
+    countdown_target = time.monotonic() + sec
     def tick(n):
-        global countdown_value
+        global countdown_value, countdown_changed_at
         countdown_value = n
+        countdown_changed_at = time.monotonic()
         print(countdown_value)
         if n > 0:
             window.after(1000, lambda: tick(n-1))
         else:
-            window.after(1000, finish)
+            callback()
     tick(sec)
 
-def capture_photo():
-    global cap
-    if not (cap and cap.isOpened()):
-        print("Camera not opened for capture.")
-        return None
-    ret, frame = cap.read()
-    if not ret:
+def finish_still():
+    # Снимок сделан: «0» убирается с экрана, цель сбрасывается до следующего отсчёта
+    global countdown_value, countdown_target
+    countdown_value = None
+    countdown_target = None
+
+def capture_photo(snapshot):
+    target = countdown_target if countdown_target is not None else time.monotonic()
+    latest = camera.frame_at(target)
+    finish_still()
+    if latest is None:
         print("Failed to capture frame.")
         return None
-    rot = ROTATION_OPTIONS[selected_rotation.get()]
-    if rot is not None:
-        frame = cv2.rotate(frame, rot)
-    h, w = frame.shape[:2]
-    scale = 1200 / w
-    nh = int(h * scale)
-    frame = cv2.resize(frame, (1200, nh))
-    if nh > 1800:
-        off = (nh - 1800) // 2
-        frame = frame[off:off+1800, :]
-    else:
-        pad = (1800 - nh) // 2
-        frame = cv2.copyMakeBorder(frame, pad, 1800-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
-    return frame
+    frame, captured_at = latest
+    record_shutter_lag(target, captured_at)
+    return prepare_still(frame, snapshot)
 
-def create_collage(photos, num_photos):
-    # Целевой размер для печати (4x6 дюймов при 300 DPI)
-    target_width = 1200
-    target_height = 1800
+def prepare_still(frame, snapshot):
+    # Геометрия — из снимка настроек сессии, чтобы все кадры коллажа были одинаковыми
+    return apply_geometry(frame, snapshot.rotation, 1200, 1800)
+
+# Серийная съёмка: несколько кадров вокруг момента снимка оцениваются на уменьшенных
+# копиях (резкость — дисперсия лапласиана, открытые глаза — каскады Хаара) в фоновом
+# потоке с ограничением по времени, в снимок идёт лучший
+BURST_FRAMES = 5
+BURST_SCORE_WIDTH = 320
+BURST_SCORE_BUDGET = 0.25  # секунд на оценку одной серии
+burst_executor = ThreadPoolExecutor(max_workers=1)
+burst_cascades = {}
+
+def get_burst_cascades():
+    # Каскады грузятся один раз и используются только потоком burst_executor
+    if not burst_cascades:
+        base = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        face = cv2.CascadeClassifier(os.path.join(base, "haarcascade_frontalface_default.xml"))
+        eye = cv2.CascadeClassifier(os.path.join(base, "haarcascade_eye_tree_eyeglasses.xml"))
+        if face.empty() or eye.empty():
+            print("Haar cascades not found, burst frames are scored by sharpness only.")
+            face = eye = None
+        burst_cascades.update(face=face, eye=eye)
+    return burst_cascades["face"], burst_cascades["eye"]
+
+def score_burst_frame(frame, rotation):
+    small = apply_geometry(frame, rotation, BURST_SCORE_WIDTH)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    face_cascade, eye_cascade = get_burst_cascades()
+    eyes_open = 0
+    if face_cascade is not None:
+        for x, y, w, h in face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(32, 32)):
+            # Глаза ищутся только в верхней половине лица
+            eyes = eye_cascade.detectMultiScale(gray[y:y + h // 2, x:x + w], 1.1, 3)
+            eyes_open += min(len(eyes), 2)
+    return eyes_open, sharpness
 
-    # Проверяем, включён ли формат А
-    use_format_a = format_a_var.get()
+def select_best_frame(frames, target_ts, rotation, budget=BURST_SCORE_BUDGET):
+    # Кадры оцениваются от ближайшего к моменту снимка; когда бюджет исчерпан,
+    # остальные пропускаются и лучший выбирается из уже оценённых
+    started = time.monotonic()
+    best, best_score, scored = None, None, 0
+    for item in sorted(frames, key=lambda item: abs(item[1] - target_ts)):
+        if scored and time.monotonic() - started > budget:
+            break
+        score = score_burst_frame(item[0], rotation)
+        scored += 1
+        if best_score is None or score > best_score:
+            best, best_score = item, score
+    return best, best_score, scored, (time.monotonic() - started) * 1000
 
+def capture_burst(done, snapshot):
+    # Кадры после момента снимка дожидаются через window.after, оценка идёт
+    # в burst_executor, done(photo) вызывается в потоке Tk
+    fired_at = time.monotonic()
+    target = countdown_target if countdown_target is not None else fired_at
+    rotation = snapshot.rotation
+    def finish(photo):
+        finish_still()
+        done(photo)
+    deadline = target + (BURST_FRAMES // 2 + 1) / (camera.fps or 30) + 0.2
+    def collect():
+        frames = camera.frames_around(target, BURST_FRAMES)
+        later = sum(1 for _, ts in frames if ts > target)
+        if later < BURST_FRAMES // 2 and time.monotonic() < deadline:
+            window.after(10, collect)
+            return
+        if not frames:
+            print("Failed to capture burst.")
+            finish(None)
+            return
+        wait(burst_executor.submit(select_best_frame, frames, target, rotation), len(frames))
+    def wait(future, count):
+        if not future.done():
+            window.after(10, lambda: wait(future, count))
+            return
+        try:
+            (frame, captured_at), (eyes, sharpness), scored, elapsed_ms = future.result()
+        except Exception as e:
+            print(f"Burst scoring failed: {e}")
+            finish(None)
+            return
+        print(f"Burst: scored {scored}/{count} frames in {elapsed_ms:.0f} ms, best at "
+              f"{(captured_at - target) * 1000:+.0f} ms (eyes {eyes}, sharpness {sharpness:.0f})")
+        record_shutter_lag(target, captured_at, fired_at)
+        finish(prepare_still(frame, snapshot))
+    collect()
+
+
+# Раскладка коллажа описывается декларативно (LayoutSpec) и компилируется один раз
+# в прямоугольники ячеек, цели масштабирования и готовые тайлы рамки/шаблона.
+# Скомпилированные раскладки кэшируются по (спецификация, хэш рамки): размер
+# результата входит в спецификацию. Сборка коллажа — только копирования и смешивания.
+#   size            — (ширина, высота) результата
+#   cells           — (x, y, ширина, высота) окна каждой фотографии
+#   fit             — "contain": фото целиком по центру окна; "cover": обрезка по пропорции окна
+#   crop_top        — доля высоты, срезаемая сверху перед вписыванием
+#   background      — "black", "white" или "template" (сама рамка-шаблон)
+#   overlay_scope   — None, "cell", "column", "canvas" или "template" (шаблон поверх фото в окне)
+#   weighted_overlay — рамку без альфы смешивать с весами 0.7/0.3, а не пропускать
+LayoutSpec = namedtuple("LayoutSpec", ["size", "cells", "fit", "crop_top", "background",
+                                       "overlay_scope", "weighted_overlay"])
+COMPILED_LAYOUTS_MAX = 16
+compiled_layouts = {}
+compiled_layouts_lock = threading.Lock()
+
+def image_hash(image):
+    if image is None:
+        return None
+    return hashlib.sha1(str(image.shape).encode() + image.tobytes()).hexdigest()
+
+def grid_cells(count, cols, size, edge, top, bottom, spacing_x, spacing_y, column_major=False):
+    # Равные окна сетки с отступами по краям, сверху, снизу и между окнами
+    width, height = size
+    rows = -(-count // cols)
+    cell_w = (width - edge * 2 - (cols - 1) * spacing_x) // cols
+    cell_h = (height - top - bottom - (rows - 1) * spacing_y) // rows
+    cells = []
+    for i in range(count):
+        row, col = (i % rows, i // rows) if column_major else (i // cols, i % cols)
+        cells.append((edge + col * (cell_w + spacing_x), top + row * (cell_h + spacing_y), cell_w, cell_h))
+    return tuple(cells)
+
+class CompiledLayout:
+    def __init__(self, spec, overlay):
+        self.spec = spec
+        self.overlay = overlay
+        width, height = spec.size
+        if spec.background == "template" and overlay is not None:
+            self.background = overlay.copy()
+        else:
+            self.background = np.full((height, width, 3), 255 if spec.background == "white" else 0, dtype=np.uint8)
+        self.rects = []  # (x, y, ширина, высота, premul, inv) — рамка поверх готового коллажа
+        self._cells = {}
+        if overlay is None:
+            return
+        alpha = overlay.shape[2] == 4
+        if spec.overlay_scope == "canvas" and (alpha or spec.weighted_overlay):
+            self.rects.append((0, 0, width, height) + premultiply(cv2.resize(overlay, (width, height))))
+        elif spec.overlay_scope == "column" and alpha:
+            # Столбец — от верхнего окна до низа коллажа
+            top = min(y for _, y, _, _ in spec.cells)
+            for x, w in sorted({(x, w) for x, _, w, _ in spec.cells}):
+                if x + w <= width:
+                    self.rects.append((x, top, w, height - top) +
+                                      premultiply(cv2.resize(overlay, (w, height - top))))
+
+    def _plan_cell(self, index, src_w, src_h):
+        spec = self.spec
+        width, height = spec.size
+        x, y, w, h = spec.cells[index]
+        if spec.fit == "cover":
+            target_aspect = w / h
+            if src_w / src_h > target_aspect:
+                new_width = int(src_h * target_aspect)
+                offset = (src_w - new_width) // 2
+                crop = (0, src_h, offset, offset + new_width)
+            else:
+                new_height = int(src_w / target_aspect)
+                offset = (src_h - new_height) // 2
+                crop = (offset, offset + new_height, 0, src_w)
+            size, dest = (w, h), (x, y)
+        else:
+            top = int(src_h * spec.crop_top)
+            crop = (top, src_h, 0, src_w)
+            scale = min(w / src_w, h / (src_h - top))
+            size = (int(src_w * scale), int((src_h - top) * scale))
+            dest = (x + (w - size[0]) // 2, y + (h - size[1]) // 2)
+        dx, dy = dest
+        if dx < 0 or dy < 0 or dx + size[0] > width or dy + size[1] > height:
+            return None
+        blend = None
+        if self.overlay is not None and self.overlay.shape[2] == 4:
+            if spec.overlay_scope == "cell":
+                blend = premultiply(cv2.resize(self.overlay, size))
+            elif spec.overlay_scope == "template":
+                blend = premultiply(self.overlay[dy:dy + size[1], dx:dx + size[0]])
+        return crop, size, dest, blend
+
+    def render_cell(self, index, photo):
+        # Одна фотография в своё окно; (тайл, x, y) или None, если окно вне коллажа
+        key = (index,) + photo.shape[:2]
+        if key not in self._cells:
+            self._cells[key] = self._plan_cell(index, photo.shape[1], photo.shape[0])
+        plan = self._cells[key]
+        if plan is None:
+            return None
+        (y0, y1, x0, x1), size, (x, y), blend = plan
+        crop = photo[y0:y1, x0:x1]
+        tile = cv2.resize(crop, size) if (x1 - x0, y1 - y0) != size else crop.copy()
+        if blend is not None:
+            blend_into(tile, *blend)
+        return tile, x, y
+
+    def compose(self, cells):
+        image = self.background.copy()
+        for cell in cells:
+            if cell is not None:
+                tile, x, y = cell
+                h, w = tile.shape[:2]
+                image[y:y + h, x:x + w, :3] = tile
+        for x, y, w, h, premul, inv in self.rects:
+            blend_into(image[y:y + h, x:x + w], premul, inv)
+        return image
+
+def get_compiled_layout(spec, overlay, overlay_hash):
+    key = (spec, overlay_hash)
+    with compiled_layouts_lock:
+        layout = compiled_layouts.get(key)
+    if layout is None:
+        started = time.perf_counter()
+        layout = CompiledLayout(spec, overlay)
+        with compiled_layouts_lock:
+            if len(compiled_layouts) >= COMPILED_LAYOUTS_MAX:
+                compiled_layouts.pop(next(iter(compiled_layouts)))
+            compiled_layouts[key] = layout
+        print(f"Collage layout compiled in {(time.perf_counter() - started) * 1000:.0f} ms "
+              f"({len(spec.cells)} cells, {spec.size[0]}x{spec.size[1]})")
+    return layout
+
+# Коллаж собирается по ячейкам: каждая фотография обрабатывается в свою ячейку
+# в фоне сразу после снимка, пока идёт следующий отсчёт; в конце остаются только
+# раскладка готовых ячеек, общая рамка и запись файла
+collage_executor = ThreadPoolExecutor(max_workers=2)
+FRAME_MODE_SCOPES = {
+    "Наложить рамку на каждую фотку отдельно": "cell",
+    "Наложить рамку на итоговую картинку": "canvas",
+    "Наложить рамку на каждый столбец": "column",
+}
+
+def collage_layout_spec(num_photos, use_format_a, frame_mode):
+    # Целевой размер для печати (4x6 дюймов при 300 DPI)
+    size = (1200, 1800)
+    scope = FRAME_MODE_SCOPES.get(frame_mode)
     if num_photos == 1:
-        photo = photos[0]
-        if overlay_image_cv is not None and not use_format_a and selected_frame_mode.get() == "Наложить рамку на каждую фотку отдельно":
-            ov = cv2.resize(overlay_image_cv, (photo.shape[1], photo.shape[0]))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                photo = (photo * (1 - alpha) + rgb * alpha).astype(np.uint8)
-        if overlay_image_cv is not None and not use_format_a and selected_frame_mode.get() == "Наложить рамку на итоговую картинку":
-            ov = cv2.resize(overlay_image_cv, (target_width, target_height))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                photo = (photo * (1 - alpha) + rgb * alpha).astype(np.uint8)
-        return photo
-    
-    # Создаём пустой коллаж (чёрный фон)
-    collage = np.zeros((target_height, target_width, 3), dtype=np.uint8)
-    
+        # Одно фото на весь лист; рамка без альфы на итоговую картинку не кладётся
+        return LayoutSpec(size, ((0, 0) + size,), "contain", 0.0, "black",
+                          None if use_format_a or scope == "column" else scope, False)
     if use_format_a:
-        # Формат А - две полоски фотографий
-        # Базовый отступ между фотографиями в столбце
-        base_spacing = 10
-        
-        # Отступ между фотографиями в столбце (в 2 раза больше базового)
-        spacing_vertical = base_spacing * 2
-        
-        # Отступ по краям (в 2 раза меньше, чем между фотографиями)
-        edge_spacing = base_spacing // 2
-        
-        # Отступ между двумя столбцами
-        center_spacing = base_spacing
-        
-        # Высота нижнего пространства (пустого места для имитации 4 фото)
-        bottom_space_height = int(target_height * 0.25)  # 25% от общей высоты
-        
-        # Отступ сверху (20% от нижнего пространства)
-        top_padding = int(bottom_space_height * 0.2)
-        
-        # Доступная высота для фотографий
-        available_height = target_height - bottom_space_height - top_padding
-        
-        # Рассчитываем ширину столбца (с учетом отступов)
-        column_width = (target_width - edge_spacing * 2 - center_spacing) // 2
-        
-        # Количество фотографий в столбце (зависит от num_photos)
-        photos_per_column = num_photos // 2
-        
-        # Высота одной фотографии
-        photo_height = (available_height - (photos_per_column - 1) * spacing_vertical) // photos_per_column
-        
-        # Размещаем фотографии в двух столбцах
-        for i, photo in enumerate(photos):
-            # Обрезаем верхние 10% фотографии
-            h, w = photo.shape[:2]
-            crop_h = int(h * 0.1)
-            photo = photo[crop_h:, :]
-            
-            # Масштабируем фото, сохраняя пропорции
-            orig_h, orig_w = photo.shape[:2]
-            scale = min(column_width / orig_w, photo_height / orig_h)
-            new_width = int(orig_w * scale)
-            new_height = int(orig_h * scale)
-            resized = cv2.resize(photo, (new_width, new_height))
-            
-            # Определяем столбец и позицию в столбце
-            column = i // photos_per_column
-            pos_in_column = i % photos_per_column
-            
-            # Координаты для размещения фото
-            x_start = int(edge_spacing + column * (column_width + center_spacing))
-            y_start = int(top_padding + pos_in_column * (photo_height + spacing_vertical))
-            
-            # Центрируем фото в ячейке
-            x_offset = int((column_width - new_width) // 2)
-            y_offset = int((photo_height - new_height) // 2)
-            
-            # Убедимся, что все индексы целочисленные
-            y_start_pos = int(y_start + y_offset)
-            y_end_pos = int(y_start_pos + new_height)
-            x_start_pos = int(x_start + x_offset)
-            x_end_pos = int(x_start_pos + new_width)
-            
-            # Проверяем, что индексы в пределах размеров коллажа
-            if (y_end_pos <= target_height and x_end_pos <= target_width and
-                y_start_pos >= 0 and x_start_pos >= 0):
-                # Размещаем фото в коллаже
-                collage[y_start_pos:y_end_pos, x_start_pos:x_end_pos] = resized
-        
-        return collage
-    
-    # Если не формат А, используем обычный режим
-    # Базовый отступ между фотографиями
-    base_spacing = 2  # Очень маленький базовый отступ
-    
-    # Отступ между фотографиями (увеличенный в 3 раза)
-    spacing = base_spacing * 3
-    
-    # Отступ от краев (очень маленький)
-    edge_spacing = 1
-
-    # Отступ сверху (равен 4 отступам между фото)
-    top_padding = spacing * 4
-
-    # Определяем размеры коллажа и фотографии с учётом целевого размера 1200x1800
-    if num_photos == 4:
-        rows, cols = 2, 2
-        # Вычисляем размер фото
-        photo_width = (target_width - (edge_spacing * 2) - spacing) // cols
-        photo_height = (target_height - top_padding - spacing) // rows
-    else:  # num_photos == 6
-        rows, cols = 3, 2
-        # Вычисляем размер фото
-        photo_width = (target_width - (edge_spacing * 2) - spacing) // cols
-        photo_height = (target_height - top_padding - (spacing * 2)) // rows
-
-    for i, photo in enumerate(photos):
-        # Обрезаем верхние 10% фотографии
-        h, w = photo.shape[:2]
-        crop_h = int(h * 0.1)  # 10% от высоты
-        photo = photo[crop_h:, :]  # Удаляем верхнюю часть
-
-        # Масштабируем фото, сохраняя пропорции, без обрезки
-        orig_h, orig_w = photo.shape[:2]
-        scale = min(photo_width / orig_w, photo_height / orig_h)
-        new_width = int(orig_w * scale)
-        new_height = int(orig_h * scale)
-        resized = cv2.resize(photo, (new_width, new_height))
-
-        # Наложение рамки на каждую фотографию (режим 1), только если не формат А
-        if overlay_image_cv is not None and not use_format_a and selected_frame_mode.get() == "Наложить рамку на каждую фотку отдельно":
-            ov = cv2.resize(overlay_image_cv, (new_width, new_height))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                resized = (resized * (1 - alpha) + rgb * alpha).astype(np.uint8)
-
-        # Размещаем фото в коллаже с учётом пробелов
-        row = i // cols
-        col = i % cols
-        
-        # Координаты для размещения фото
-        x_start = int(edge_spacing + col * (photo_width + spacing))
-        y_start = int(top_padding + row * (photo_height + spacing))
-
-        # Центрируем фото в ячейке
-        x_offset = int((photo_width - new_width) // 2)
-        y_offset = int((photo_height - new_height) // 2)
-        
-        # Убедимся, что все индексы целочисленные
-        y_start_pos = int(y_start + y_offset)
-        y_end_pos = int(y_start_pos + new_height)
-        x_start_pos = int(x_start + x_offset)
-        x_end_pos = int(x_start_pos + new_width)
-            
-        # Проверяем, что индексы в пределах размеров коллажа
-        if (y_end_pos <= target_height and x_end_pos <= target_width and
-            y_start_pos >= 0 and x_start_pos >= 0):
-            # Размещаем фото в коллаже
-            collage[y_start_pos:y_end_pos, x_start_pos:x_end_pos] = resized
-
-    # Наложение рамки на каждый столбец (режим 3), только если не формат А
-    if overlay_image_cv is not None and not use_format_a and selected_frame_mode.get() == "Наложить рамку на каждый столбец":
-        column_height = target_height - top_padding
-        for col_idx in range(cols):
-            x_start = int(edge_spacing + col_idx * (photo_width + spacing))
-            ov = cv2.resize(overlay_image_cv, (photo_width, column_height))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                y_start_pos = int(top_padding)
-                y_end_pos = int(target_height)
-                x_start_pos = int(x_start)
-                x_end_pos = int(x_start + photo_width)
-                
-                if (y_end_pos <= target_height and x_end_pos <= target_width and
-                    y_start_pos >= 0 and x_start_pos >= 0):
-                    collage[y_start_pos:y_end_pos, x_start_pos:x_end_pos] = (
-                        collage[y_start_pos:y_end_pos, x_start_pos:x_end_pos] * (1 - alpha) +
-                        rgb * alpha
-                    ).astype(np.uint8)
-
-    # Наложение рамки на итоговую картинку (режим 2), только если не формат А
-    if overlay_image_cv is not None and not use_format_a and selected_frame_mode.get() == "Наложить рамку на итоговую картинку":
-        ov = cv2.resize(overlay_image_cv, (target_width, target_height))
-        if ov.shape[2] == 4:
-            alpha = ov[:, :, 3:] / 255.0
-            rgb = ov[:, :, :3]
-            collage = (collage * (1 - alpha) + rgb * alpha).astype(np.uint8)
-        else:
-            collage = cv2.addWeighted(collage, 0.7, ov, 0.3, 0)
+        # Формат А — две полоски по столбцам; снизу 25% пустого места для имитации
+        # 4 фото, сверху 20% от него; рамка не накладывается
+        bottom = int(size[1] * 0.25)
+        cells = grid_cells(num_photos, 2, size, edge=5, top=int(bottom * 0.2), bottom=bottom,
+                           spacing_x=10, spacing_y=20, column_major=True)
+        return LayoutSpec(size, cells, "contain", 0.1, "black", None, False)
+    # Сетка 2x2 или 3x2: маленькие отступы, сверху — 4 промежутка между фото;
+    # у каждого фото срезаются верхние 10%
+    cells = grid_cells(num_photos, 2, size, edge=1, top=24, bottom=0, spacing_x=6, spacing_y=6)
+    return LayoutSpec(size, cells, "contain", 0.1, "black", scope, True)
+
+def get_collage_layout(num_photos, snapshot):
+    spec = collage_layout_spec(num_photos, snapshot.format_a, snapshot.frame_mode)
+    return get_compiled_layout(spec, snapshot.overlay, snapshot.overlay_hash)
+
+def make_collage_cell(photo, index, num_photos, snapshot):
+    return get_collage_layout(num_photos, snapshot).render_cell(index, photo)
 
-    return collage
+def assemble_collage(cells, num_photos, snapshot):
+    return get_collage_layout(num_photos, snapshot).compose(cells)
+
+def create_collage(photos, num_photos, snapshot=None):
+    snapshot = snapshot or settings
+    cells = [make_collage_cell(photo, i, num_photos, snapshot) for i, photo in enumerate(photos)]
+    return assemble_collage(cells, num_photos, snapshot)
 
 def start_capture():
-    global capturing, cap
+    global capturing
     btn_start.config(state=tk.DISABLED)
-    num_photos = int(selected_photos.get())
+    snapshot = settings  # настройки фиксируются на всю сессию
+    num_photos = snapshot.photos
     capturing = True
     photos = []
+    cells = []
+    last_shot_at = None
 
-    cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    if not cap.isOpened():
+    # Снимки берутся из той же сессии камеры, что и превью, без повторного открытия
+    if not camera.open(30, 1200, 1800, settings.rotation):
         print("Failed to open camera for capture.")
         btn_start.config(state=tk.NORMAL)
         capturing = False
         show_main_page()
         return
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1200)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1800)
 
     def capture_next(i):
-        global capturing, cap
+        global capturing
         if i >= num_photos or not capturing:
-            if cap is not None:
-                cap.release()
-                cap = None
             capturing = False
             if photos:
-                finalize_photos(photos, num_photos)
+                finalize_photos(cells, num_photos, snapshot, last_shot_at)
             else:
                 btn_start.config(state=tk.NORMAL)
                 show_main_page()
@@ -496,13 +1521,21 @@ def start_capture():
         global capturing
         if not capturing:
             return
-        photo = capture_photo()
-        if photo is not None:
-            photos.append(photo)
-            print(f"Photo {i+1}/{num_photos} captured.")
+        def store(photo):
+            nonlocal last_shot_at
+            if photo is not None:
+                last_shot_at = time.monotonic()
+                photos.append(photo)
+                # Ячейка коллажа готовится в фоне, пока идёт следующий отсчёт
+                cells.append(collage_executor.submit(make_collage_cell, photo, len(photos) - 1, num_photos, snapshot))
+                print(f"Photo {i+1}/{num_photos} captured.")
+            else:
+                print(f"Failed to capture photo {i+1}.")
+            next_callback(i + 1)
+        if snapshot.burst:
+            capture_burst(store, snapshot)
         else:
-            print(f"Failed to capture photo {i+1}.")
-        next_callback(i + 1)
+            store(capture_photo(snapshot))
 
     capture_next(0)
 
@@ -511,29 +1544,166 @@ def stop_capture():
     capturing = False
     btn_start.config(state=tk.NORMAL)
 
-def finalize_photos(photos, num_photos):
-    global last_uni_folder_id
+# Артефакт сессии несёт декодированный массив, закодированные байты и путь к
+# файлу. Недостающее представление получается лениво из того, что уже есть,
+# поэтому каждый артефакт пишется на диск и читается с него не больше одного
+# раза. SessionIO считает прочитанные и записанные байты за сессию
+class SessionIO:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def read(self, path):
+        with open(path, "rb") as fh:
+            data = fh.read()
+        self.count(read=len(data))
+        return data
+
+    def write(self, path, data):
+        with open(path, "wb") as fh:
+            fh.write(data)
+        self.count(written=len(data))
+
+    def count(self, read=0, written=0):
+        with self.lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def summary(self):
+        return f"read {self.bytes_read // 1024} KB, written {self.bytes_written // 1024} KB"
+
+class SessionArtifact:
+    def __init__(self, session_io, path=None, image=None, data=None, profile=None):
+        self.session_io = session_io
+        self.path = path
+        self.profile = profile
+        self._image = image
+        self._data = data
+        self._on_disk = image is None and data is None and path is not None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            if self._image is not None:
+                ok, buf = cv2.imencode(self.profile.ext, self._image, self.profile.params)
+                if not ok:
+                    raise RuntimeError(f"{self.profile.ext} encoding failed")
+                self._data = buf.tobytes()
+            else:
+                self._data = self.session_io.read(self.path)
+        return self._data
+
+    def image(self):
+        with self.lock:
+            if self._image is None:
+                self._image = cv2.imdecode(np.frombuffer(self._load(), np.uint8), cv2.IMREAD_UNCHANGED)
+            return self._image
+
+    def data(self):
+        with self.lock:
+            return self._load()
+
+    def materialize(self):
+        # Путь к файлу на диске; файл пишется при первом обращении
+        with self.lock:
+            if not self._on_disk:
+                self.session_io.write(self.path, self._load())
+                self._on_disk = True
+            return self.path
+
+# Рендишены результата: из коллажа в памяти за один проход получаются печатный
+# мастер в полном разрешении, уменьшенная копия для ссылки по QR и миниатюра
+# для экрана результата. Масштабирование и кодирование идут в encode_executor,
+# каждый потребитель получает только свой рендишен — файлы повторно не читаются
+EncoderProfile = namedtuple("EncoderProfile", ["ext", "mimetype", "params"])
+ENCODER_PROFILES = {
+    "png": EncoderProfile(".png", "image/png", [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+    "jpeg": EncoderProfile(".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 92, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+    "webp": EncoderProfile(".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 90]),
+}
+# profile — имя в ENCODER_PROFILES (None — рендишен только в памяти),
+# width — ширина (None — полное разрешение), suffix — добавка к имени файла,
+# save — записать файл сразу (иначе только по materialize())
+Rendition = namedtuple("Rendition", ["profile", "width", "suffix", "save"])
+RENDITIONS = {
+    "print": Rendition("png", None, "", True),
+    "share": Rendition("jpeg", 800, "_share", False),
+    "thumbnail": Rendition(None, 900, None, False),  # Экран результата показывает фото шириной 900
+}
+encode_executor = ThreadPoolExecutor(max_workers=2)
+
+def resize_to_width(image, width):
+    h, w = image.shape[:2]
+    if width is None or w <= width:
+        return image
+    return cv2.resize(image, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+
+def render_output(image, base_path, rendition, session_io):
+    image = resize_to_width(image, rendition.width)
+    if rendition.profile is None:
+        return SessionArtifact(session_io, image=image)
+    profile = ENCODER_PROFILES[rendition.profile]
+    artifact = SessionArtifact(session_io, base_path + rendition.suffix + profile.ext, image, profile=profile)
+    artifact.data()  # Кодирование — здесь, в рабочем потоке
+    if rendition.save:
+        artifact.materialize()
+    return artifact
+
+def render_outputs(image, base_path, session_io, done):
+    # Одинаковые рендишены считаются один раз, даже если нужны нескольким назначениям;
+    # done({назначение: SessionArtifact}) или done(None) вызывается в потоке Tk
+    started = time.monotonic()
+    jobs = {}
+    for rendition in RENDITIONS.values():
+        if rendition not in jobs:
+            jobs[rendition] = encode_executor.submit(render_output, image, base_path, rendition, session_io)
+    def wait():
+        if not all(job.done() for job in jobs.values()):
+            window.after(10, wait)
+            return
+        try:
+            outputs = {purpose: jobs[rendition].result() for purpose, rendition in RENDITIONS.items()}
+        except Exception as e:
+            print(f"Failed to save result: {e}")
+            done(None)
+            return
+        sizes = ", ".join(f"{os.path.basename(job.result().path)} {len(job.result().data()) // 1024} KB"
+                          for job in jobs.values() if job.result().path)
+        print(f"Rendered {sizes} in {(time.monotonic() - started) * 1000:.0f} ms")
+        done(outputs)
+    wait()
+
+def finalize_photos(cells, num_photos, snapshot, last_shot_at):
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"photo_{ts}.png"
-    path = os.path.join(SAVE_DIR, filename)
+    name = f"photo_{ts}"
+    collage = assemble_collage([cell.result() for cell in cells], num_photos, snapshot)
+    session_io = SessionIO()
+    render_outputs(collage, os.path.join(SAVE_DIR, name), session_io,
+                   lambda outputs: publish_photos(outputs, name, last_shot_at, session_io))
 
-    collage = create_collage(photos, num_photos)
-    cv2.imwrite(path, collage)
-    print(f"Photo(s) saved to {path}")
+def publish_photos(outputs, name, last_shot_at, session_io):
+    if outputs is None:
+        btn_start.config(state=tk.NORMAL)
+        show_main_page()
+        return
+    path = outputs["print"].path
+    print(f"Photo(s) saved to {path} {(time.monotonic() - last_shot_at) * 1000:.0f} ms after the last shot")
 
     ev_id = event_ids.get(selected_event.get())
     if ev_id:
-        qr, url, uni_id = upload_to_drive(
-            path, os.path.splitext(filename)[0],
-            ev_id, reuse_last=reuse_var.get(), last_folder_id=last_uni_folder_id
-        )
-        if qr is not None:
-            last_uni_folder_id = uni_id
-            show_result_page(path, qr)
-        else:
-            print("Failed to upload to Google Drive.")
-            btn_start.config(state=tk.NORMAL)
-            show_main_page()
+        folder_id, claim_name = claim_share_folder(reuse_var.get())
+        def uploaded(job):
+            print(f"Session I/O: {session_io.summary()}")
+            if job.state != "done":
+                print("Failed to upload to Google Drive.")
+            if folder_id is None and result_path == path and result_page.winfo_ismapped():
+                show_result_qr(job.result[0])
+        upload_service.submit(name, path, name, ev_id, reuse_var.get(), uploaded,
+                              encoded=outputs["print"], share=outputs["share"],
+                              folder_id=folder_id, claim_name=claim_name)
+        show_result_page(path, folder_qr(folder_id) if folder_id else None, outputs["thumbnail"].image())
+        print(f"Result shown {(time.monotonic() - last_shot_at) * 1000:.0f} ms after the last shot")
     else:
         print("Event not selected or unavailable.")
         btn_start.config(state=tk.NORMAL)
@@ -550,13 +1720,13 @@ def show_settings_page():
     global preview_running
     preview_running = False
     stop_preview()
+    stop_camera()
     main_page.pack_forget()
     settings_page.pack(fill=tk.BOTH, expand=True)
 
 def stop_camera():
-    global cap, preview_running
-    if cap and cap.isOpened():
-        cap.release()
+    global preview_running
+    camera.close()
     preview_running = False
 
 def show_main_page():
@@ -564,27 +1734,33 @@ def show_main_page():
     result_page.pack_forget()
     settings_page.pack_forget()
     main_page.pack(fill=tk.BOTH, expand=True)
-    stop_camera()
+    stop_preview()
     preview_running = True
     update_preview()
     btn_start.config(state=tk.NORMAL)
     window.update()
 
-def show_result_page(path, qr_img):
+def show_result_page(path, qr_img, img=None):
+    global result_path
+    stop_preview()
     settings_page.pack_forget()
     main_page.pack_forget()
     result_page.pack(fill=tk.BOTH, expand=True)
-    img = cv2.imread(path)
+    for widget in result_page.winfo_children():
+        widget.destroy()
+    result_path = path
+    if img is None:
+        img = cv2.imread(path)
     if img is None:
         print(f"Failed to load image from {path} for display.")
         btn_start.config(state=tk.NORMAL)
         show_main_page()
         return
     h, w = img.shape[:2]
-    scale = 900 / w
-    nh = int(h * scale)
-    resized = cv2.resize(img, (900, nh))
-    rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    if w != 900:
+        # Рендишен thumbnail уже уменьшен из мастера; масштабируется только файл с диска
+        img = cv2.resize(img, (900, int(h * 900 / w)), interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     imgtk = ImageTk.PhotoImage(Image.fromarray(rgb))
     photo_label = tk.Label(result_page, image=imgtk, bg="#000000")
     photo_label.image = imgtk
@@ -594,22 +1770,30 @@ def show_result_page(path, qr_img):
     print_button = ttk.Button(result_page, text="🖨 Печать", style="SemiTransparent.TButton", command=lambda: print_image(path))
     print_button.place(relx=0.5, rely=0.95, anchor="center")
     if qr_img:
-        qr_img_resized = qr_img.resize((200, 200))
-        qr_array = np.array(qr_img_resized)
-        if qr_array.dtype == bool:
-            qr_array = qr_array.astype(np.uint8) * 255
-        if qr_array.ndim == 2 or qr_array.shape[-1] == 1:
-            qr_array = cv2.cvtColor(qr_array, cv2.COLOR_GRAY2RGBA) if qr_array.ndim == 2 else cv2.cvtColor(qr_array, cv2.COLOR_RGB2RGBA)
-        if qr_array.shape[-1] == 3:
-            alpha = np.full((200, 200, 1), 0, dtype=np.uint8)
-            qr_array = np.dstack((qr_array, alpha))
-        elif qr_array.shape[-1] == 4:
-            qr_array[:, :, 3] = np.where(qr_array[:, :, :3].sum(axis=2) > 600, 255, 0)
-        qr_img_with_alpha = Image.fromarray(qr_array)
-        qr_tk = ImageTk.PhotoImage(qr_img_with_alpha)
-        qr_label = tk.Label(result_page, image=qr_tk, bg="#000000")
-        qr_label.image = qr_tk
-        qr_label.place(relx=0.95, rely=0.95, anchor="se")
+        show_result_qr(qr_img)
+
+def show_result_qr(qr_img):
+    # QR добавляется, когда закончилась фоновая загрузка; None — загрузка не удалась
+    if qr_img is None:
+        tk.Label(result_page, text="QR-код недоступен", fg="#FFFFFF", bg="#000000",
+                 font=("Arial", 16)).place(relx=0.95, rely=0.95, anchor="se")
+        return
+    qr_img_resized = qr_img.resize((200, 200))
+    qr_array = np.array(qr_img_resized)
+    if qr_array.dtype == bool:
+        qr_array = qr_array.astype(np.uint8) * 255
+    if qr_array.ndim == 2 or qr_array.shape[-1] == 1:
+        qr_array = cv2.cvtColor(qr_array, cv2.COLOR_GRAY2RGBA) if qr_array.ndim == 2 else cv2.cvtColor(qr_array, cv2.COLOR_RGB2RGBA)
+    if qr_array.shape[-1] == 3:
+        alpha = np.full((200, 200, 1), 0, dtype=np.uint8)
+        qr_array = np.dstack((qr_array, alpha))
+    elif qr_array.shape[-1] == 4:
+        qr_array[:, :, 3] = np.where(qr_array[:, :, :3].sum(axis=2) > 600, 255, 0)
+    qr_img_with_alpha = Image.fromarray(qr_array)
+    qr_tk = ImageTk.PhotoImage(qr_img_with_alpha)
+    qr_label = tk.Label(result_page, image=qr_tk, bg="#000000")
+    qr_label.image = qr_tk
+    qr_label.place(relx=0.95, rely=0.95, anchor="se")
 
 def toggle_fullscreen():
     window.attributes('-fullscreen', True)
@@ -631,6 +1815,11 @@ event_ids = {}
 reuse_var = tk.BooleanVar(window, value=False)
 selected_frame_mode = tk.StringVar(window, value="Наложить рамку на каждую фотку отдельно")
 format_a_var = tk.BooleanVar(window, value=False)
+burst_var = tk.BooleanVar(window, value=False)
+
+for var in (selected_rotation, selected_photos, format_a_var, selected_frame_mode, burst_var):
+    var.trace_add("write", on_settings_var_changed)
+on_settings_var_changed()
 
 settings_page = tk.Frame(window, bg="#000000")
 main_page = tk.Frame(window, bg="#000000")
@@ -688,7 +1877,10 @@ combo_frame_mode.pack(pady=25)
 ttk.Button(settings_page, text="Добавить рамку", style="Custom.TButton", command=load_overlay).pack(pady=25)
 ttk.Button(settings_page, text="Убрать рамку", style="Custom.TButton", command=clear_overlay).pack(pady=25)
 tk.Checkbutton(settings_page, text="Сделать по формату А", variable=format_a_var, font=("Helvetica", 28), fg="white", bg="#000000", selectcolor="#000000").pack(pady=25)
+tk.Checkbutton(settings_page, text="Серия кадров (выбрать лучший)", variable=burst_var, font=("Helvetica", 28), fg="white", bg="#000000", selectcolor="#000000").pack(pady=25)
 ttk.Button(settings_page, text="Открыть на весь экран", style="Custom.TButton", command=toggle_fullscreen).pack(pady=25)
+outbox_label = tk.Label(settings_page, text="", font=("Helvetica", 20), fg="white", bg="#000000")
+outbox_label.pack(pady=15)
 ttk.Button(settings_page, text="▶ Запустить", style="Custom.TButton", command=lambda: [settings_page.pack_forget(), show_main_page()]).pack(pady=50)
 
 main_page.pack(fill=tk.BOTH, expand=True)
@@ -725,6 +1917,8 @@ om["menu"].config(
 om.pack(pady=10, ipady=5)
 
 preview_label = tk.Label(main_page, bg="#000000")
+preview_surface = DisplaySurface(preview_label)
+preview_label.bind("<Configure>", on_preview_configure)
 preview_label.place(relx=0.5, rely=0.5, anchor="center", relwidth=0.95, relheight=0.7)
 btn_start = ttk.Button(main_page, text="▶", style="Custom.TButton", command=start_capture)
 btn_start.place(relx=0.5, rely=0.95, anchor="center")
@@ -746,5 +1940,112 @@ def on_new_event():
         if event_id:
             refresh_events()
 
-refresh_events()
-window.mainloop()
\ No newline at end of file
+# Замеры производительности: python photo-soft16.py --benchmark [имя ...]
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__[len("benchmark_"):]] = func
+    return func
+
+def time_ms(func, repeat=50):
+    func()  # прогрев
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+@benchmark
+def benchmark_display():
+    # Работа главного потока на кадр превью 600x900
+    frame = np.random.randint(0, 256, (900, 600, 3), dtype=np.uint8)
+    label = tk.Label(main_page)
+    def before():
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        imgtk = ImageTk.PhotoImage(Image.fromarray(rgb))
+        label.imgtk = imgtk
+        label.config(image=imgtk)
+        window.update_idletasks()
+    surface = DisplaySurface(label)
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))  # готовится в рабочем потоке
+    def after():
+        surface.show(image)
+        window.update_idletasks()
+    print(f"display: new PhotoImage {time_ms(before):.2f} ms/frame, "
+          f"persistent surface {time_ms(after):.2f} ms/frame (main thread)")
+
+@benchmark
+def benchmark_countdown():
+    # Цифра отсчёта на кадре превью: cv2.putText на каждом кадре против готового спрайта
+    for width, height in ((600, 900), (1200, 1800)):
+        base = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        frame = base.copy()
+        k = height / 900
+        org = (width//2 - int(60 * k), height//2 + int(60 * k))
+        def before():
+            cv2.putText(frame, "3", org, cv2.FONT_HERSHEY_SIMPLEX, 5 * k,
+                        (255,255,255), max(1, int(10 * k)), cv2.LINE_AA)
+        def after():
+            draw_countdown(frame, "3", k)
+        reference, sprite = base.copy(), base.copy()
+        cv2.putText(reference, "3", org, cv2.FONT_HERSHEY_SIMPLEX, 5 * k,
+                    (255,255,255), max(1, int(10 * k)), cv2.LINE_AA)
+        draw_countdown(sprite, "3", k)
+        diff = np.abs(reference.astype(np.int16) - sprite).max()
+        print(f"countdown {width}x{height}: putText {time_ms(before, 200):.3f} ms/frame, "
+              f"sprite {time_ms(after, 200):.3f} ms/frame (max diff {diff})")
+
+@benchmark
+def benchmark_burst():
+    # Оценка серии из BURST_FRAMES кадров 1200x1800 без ограничения по времени
+    frames = [(np.random.randint(0, 256, (1800, 1200, 3), dtype=np.uint8), i / 30) for i in range(BURST_FRAMES)]
+    get_burst_cascades()  # загрузка каскадов в замер не входит
+    cost = time_ms(lambda: select_best_frame(frames, 0.0, None, budget=float("inf")), repeat=10)
+    print(f"burst: {cost:.1f} ms per burst of {BURST_FRAMES} frames at 1200x1800 "
+          f"({cost / BURST_FRAMES:.1f} ms/frame, budget {BURST_SCORE_BUDGET * 1000:.0f} ms)")
+
+@benchmark
+def benchmark_blend():
+    # Все места смешивания с рамкой: прежняя float-формула против blend_into
+    grid4 = collage_layout_spec(4, False, None).cells
+    grid6 = collage_layout_spec(6, False, None).cells
+    top_padding = grid4[0][1]
+    sites = [("preview", 600, 900), ("single photo", 1200, 1800),
+             ("4-photo cell", grid4[0][2], grid4[0][3]), ("6-photo cell", grid6[0][2], grid6[0][3]),
+             ("column", grid4[0][2], 1800 - top_padding), ("whole collage", 1200, 1800)]
+    for name, width, height in sites:
+        photo = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        ov = np.random.randint(0, 256, (height, width, 4), dtype=np.uint8)
+        prepared = premultiply(ov)
+        def legacy():
+            alpha = ov[:, :, 3:] / 255.0
+            rgb = ov[:, :, :3]
+            return (photo * (1 - alpha) + rgb * alpha).astype(np.uint8)
+        def fixed():
+            # Превью берёт рамку из кэша, остальные места готовят её на месте
+            return blend_into(photo.copy(), *(prepared if name == "preview" else premultiply(ov)))
+        diff = np.abs(legacy().astype(np.int16) - fixed()).max()
+        print(f"blend {name} {width}x{height}: float {time_ms(legacy, 20):.2f} ms, "
+              f"fixed point {time_ms(fixed, 20):.2f} ms (max diff {diff} LSB)")
+
+@benchmark
+def benchmark_encode():
+    # Кодирование коллажа 1200x1800 каждым профилем; на шумном кадре размеры
+    # завышены, но соотношение времени между профилями сохраняется
+    image = cv2.GaussianBlur(np.random.randint(0, 256, (1800, 1200, 3), dtype=np.uint8), (0, 0), 3)
+    for name, profile in ENCODER_PROFILES.items():
+        size = len(cv2.imencode(profile.ext, image, profile.params)[1])
+        elapsed = time_ms(lambda: cv2.imencode(profile.ext, image, profile.params), 5)
+        print(f"encode {name}: {elapsed:.1f} ms, {size // 1024} KB")
+
+def run_benchmarks(names):
+    for name in names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+if "--benchmark" in sys.argv:
+    run_benchmarks(sys.argv[sys.argv.index("--benchmark") + 1:])
+else:
+    refresh_events()
+    outbox.start()  # до пула: пул сверяет выданные папки с журналом
+    folder_pool.start()
+    update_outbox_status()
+    window.mainloop()
\ No newline at end of file
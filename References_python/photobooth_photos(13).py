@@ -9,13 +9,19 @@ import numpy as np
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+import io
 import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple, deque
 import threading
 import time
+import sys
 import sounddevice as sd
 import soundfile as sf
 import json
+import sqlite3
 import platform
 import subprocess
 
@@ -33,6 +39,19 @@ except Exception as e:
     drive_service = None
     print(f"Failed to initialize Google Drive service: {e}")
 
+# Клиент Drive держит один httplib2.Http, который нельзя делить между потоками.
+# Поток Tk пользуется drive_service, каждый фоновый поток (загрузки, пул папок,
+# журнал) — собственным клиентом на тех же учётных данных
+drive_local = threading.local()
+
+def drive():
+    if threading.current_thread() is threading.main_thread():
+        return drive_service
+    client = getattr(drive_local, "service", None)
+    if client is None:
+        client = drive_local.service = build('drive', 'v3', credentials=credentials, cache_discovery=False)
+    return client
+
 SAVE_DIR = os.path.abspath("photos")
 os.makedirs(SAVE_DIR, exist_ok=True)
 
@@ -40,14 +59,16 @@ DEVICE_NAME = "EOS Webcam Utility"
 camera_index = 0
 frame_template_path = None
 frame_template_cv = None
+frame_template_hash = None
 photo_positions = []  # Позиции для вставки фотографий (x, y, width, height)
-cap = None
 preview_running = False
+preview_generation = 0
 current_photo = 0
 captured_photos = []
 countdown_value = None
 photo_session_active = False
-last_uni_folder_id = None
+session_settings = None  # Снимок настроек, с которым началась фотосессия
+result_path = None  # Файл, который сейчас показан на экране результата
 mirror_mode = False  # Переменная для режима зеркального отображения
 
 FRAME_WIDTH = 1200
@@ -60,12 +81,28 @@ ROTATION_OPTIONS = {
     "180°": cv2.ROTATE_180
 }
 
+# Неизменяемый снимок настроек с номером версии. Tk-переменные читаются только
+# в главном потоке (trace на запись), рабочие потоки берут готовый объект settings,
+# а кэши, привязанные к версии, сбрасываются сами при её смене
+Settings = namedtuple("Settings", ["version", "rotation", "mirror", "burst"])
+settings = Settings(0, ROTATION_OPTIONS["90° вправо (вертикально)"], False, False)
+settings_lock = threading.Lock()
+
+def publish_settings(**changes):
+    global settings
+    with settings_lock:
+        settings = settings._replace(version=settings.version + 1, **changes)
+    return settings
+
+def on_settings_var_changed(*_):
+    publish_settings(rotation=ROTATION_OPTIONS[selected_rotation.get()], burst=burst_var.get())
+
 def list_events():
     if drive_service is None:
         print("Google Drive service not initialized.")
         return [], {}
     try:
-        res = drive_service.files().list(
+        res = drive().files().list(
             q=f"'{EVENTS_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
             spaces='drive', fields='files(id,name)', pageSize=1000
         ).execute()
@@ -81,38 +118,76 @@ def create_event(name):
         return None
     try:
         meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [EVENTS_FOLDER_ID]}
-        folder = drive_service.files().create(body=meta, fields='id').execute()
+        folder = drive().files().create(body=meta, fields='id').execute()
         return folder['id']
     except Exception as e:
         print(f"Failed to create event: {e}")
         return None
 
-def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_folder_id=None):
+def upload_media(path, encoded):
+    if encoded is not None:
+        return MediaIoBaseUpload(io.BytesIO(encoded.data()), mimetype=encoded.profile.mimetype)
+    return MediaFileUpload(path, mimetype='image/jpeg')
+
+def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_folder_id=None,
+                    encoded=None, share=None, folder_id=None, claim_name=False, on_sent=None, outbox_id=None):
+    # encoded — артефакт печатного мастера для папки события, share — копия
+    # для папки по QR; если их нет, с диска читается path
     if drive_service is None:
         print("Google Drive service not initialized.")
         return None, None, None
-    if not os.path.exists(path):
+    if encoded is None and not os.path.exists(path):
         print(f"File {path} not found.")
         return None, None, None
+    share = share or encoded
+    share_path = share.path if share is not None else path
+    
+    # Сделанные шаги запоминаются в строке журнала (outbox_id), и повтор их
+    # пропускает: файл в папке события, новая папка гостя и копия в ней
+    # создаются по одному разу, сколько бы попыток ни понадобилось
+    steps = outbox.steps(outbox_id) if outbox_id is not None else {}
+    def done_step(column, value):
+        steps[column] = value
+        if outbox_id is not None:
+            outbox.record_step(outbox_id, column, value)
     
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            media = MediaFileUpload(path, mimetype='image/jpeg')
-            drive_service.files().create(
-                body={'name': os.path.basename(path), 'parents': [event_folder_id]},
-                media_body=media
-            ).execute()
-            if reuse_last and last_folder_id:
+            if not steps.get("event_file_id"):
+                media = upload_media(path, encoded)
+                uploaded = drive().files().create(
+                    body={'name': os.path.basename(path), 'parents': [event_folder_id]},
+                    media_body=media, fields='id'
+                ).execute()
+                if on_sent:
+                    on_sent(media.size())
+                done_step("event_file_id", uploaded['id'])
+            if folder_id is not None:
+                # Папка из пула или уже показанная в QR; из пула — получает имя сессии
+                uni_id = folder_id
+                if claim_name:
+                    drive().files().update(fileId=folder_id, body={'name': folder_name}).execute()
+            elif reuse_last and last_folder_id:
                 uni_id = last_folder_id
+            elif steps.get("folder_id"):
+                uni_id = steps["folder_id"]
             else:
                 uni_meta = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [UNIVERSAL_FOLDER_ID]}
-                uni_folder = drive_service.files().create(body=uni_meta, fields='id').execute()
+                uni_folder = drive().files().create(body=uni_meta, fields='id').execute()
                 uni_id = uni_folder['id']
-            drive_service.files().create(
-                body={'name': os.path.basename(path), 'parents': [uni_id]},
-                media_body=media
-            ).execute()
+                done_step("folder_id", uni_id)
+            if not steps.get("share_file_id"):
+                # В папку по QR идёт отдельный уменьшенный рендишен, а не второй раз мастер
+                share_media = upload_media(share_path, share)
+                shared = drive().files().create(
+                    body={'name': os.path.basename(share_path), 'parents': [uni_id]},
+                    media_body=share_media, fields='id'
+                ).execute()
+                if on_sent:
+                    on_sent(share_media.size())
+                done_step("share_file_id", shared['id'])
+            folder_pool.filled(uni_id)
             uni_url = f'https://drive.google.com/drive/folders/{uni_id}'
             qr = qrcode.make(uni_url)
             return qr, uni_url, uni_id
@@ -123,8 +198,413 @@ def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_f
                 print(f"Failed to upload file to Google Drive after {max_retries} attempts: {e}")
                 return None, None, None
 
+# Загрузка на Google Drive идёт в фоне: задание ставится в очередь пула, у
+# каждого своё состояние и тайминги, а колбэк завершения вызывается в потоке Tk
+# через window.after — экран результата и следующий гость не ждут сеть и паузы
+# между повторами. Задания с reuse_last идут по одному, чтобы попасть в одну папку
+class UploadJob:
+    def __init__(self, name, args, kwargs, reuse_last, done):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.reuse_last = reuse_last
+        self.done = done
+        self.state = "queued"  # queued -> uploading -> done / failed
+        self.bytes_sent = 0
+        self.result = (None, None, None)  # (qr, url, uni_id) из upload_to_drive
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    def add_sent(self, size):
+        self.bytes_sent += size
+
+class UploadService:
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.completed = queue.Queue()
+        self.lock = threading.Lock()
+        self.folder_lock = threading.Lock()
+        self.pending = 0
+        self.polling = False
+        self.last_folder_id = None
+
+    def submit(self, name, path, folder_name, event_folder_id, reuse_last, done, **kwargs):
+        # Вызывается в потоке Tk; done(job) тоже будет вызван в нём. Папка,
+        # заданная заранее (folder_id), сразу становится последней
+        job = UploadJob(name, (path, folder_name, event_folder_id), kwargs, reuse_last, done)
+        share = kwargs.get("share") or kwargs.get("encoded")
+        job.outbox_id = outbox.enqueue(name, path, share.path if share is not None else path, folder_name,
+                                       event_folder_id, kwargs.get("folder_id"), kwargs.get("claim_name", False))
+        if kwargs.get("folder_id") is not None:
+            self.last_folder_id = kwargs["folder_id"]
+        with self.lock:
+            self.pending += 1
+            depth = self.pending
+        print(f"Upload {name} queued ({depth} in queue)")
+        self.executor.submit(self._run, job)
+        if not self.polling:
+            self.polling = True
+            window.after(50, self._poll)
+        return job
+
+    def queue_depth(self):
+        with self.lock:
+            return self.pending
+
+    def _run(self, job):
+        job.state = "uploading"
+        job.started_at = time.monotonic()
+        try:
+            for artifact in (job.kwargs.get("encoded"), job.kwargs.get("share")):
+                if artifact is not None:
+                    artifact.materialize()  # Журнал дозагружает файлы с диска
+            if job.reuse_last:
+                with self.folder_lock:
+                    job.result = upload_to_drive(*job.args, reuse_last=True, last_folder_id=self.last_folder_id,
+                                                 on_sent=job.add_sent, outbox_id=job.outbox_id, **job.kwargs)
+                    if job.result[2] is not None:
+                        self.last_folder_id = job.result[2]
+            else:
+                job.result = upload_to_drive(*job.args, on_sent=job.add_sent, outbox_id=job.outbox_id, **job.kwargs)
+                if job.result[2] is not None:
+                    self.last_folder_id = job.result[2]
+        except Exception as e:
+            print(f"Upload {job.name} failed: {e}")
+        job.state = "done" if job.result[0] is not None else "failed"
+        if job.state == "done":
+            outbox.finish(job.outbox_id, job.result[2])
+        else:
+            outbox.retry_later(job.outbox_id, "upload failed")
+        job.finished_at = time.monotonic()
+        self.completed.put(job)
+
+    def _poll(self):
+        while True:
+            try:
+                job = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.pending -= 1
+                depth = self.pending
+            print(f"Upload {job.name} {job.state}: waited {(job.started_at - job.submitted_at) * 1000:.0f} ms, "
+                  f"took {(job.finished_at - job.started_at) * 1000:.0f} ms, sent {job.bytes_sent // 1024} KB "
+                  f"({depth} in queue)")
+            try:
+                job.done(job)
+            except Exception as e:
+                print(f"Upload callback failed: {e}")
+        if self.queue_depth() > 0:
+            window.after(50, self._poll)
+        else:
+            self.polling = False
+
+upload_service = UploadService()
+
+# Пул заранее созданных пустых папок под UNIVERSAL_FOLDER_ID: сессия сразу берёт
+# ID папки, и QR показывается до первого загруженного байта, а файл доезжает
+# позже. Пул пополняется в фоне и хранится на диске между запусками; папки
+# старше FOLDER_POOL_MAX_AGE удаляются при старте. Выданные папки помнятся, пока
+# в них не дойдёт файл: брошенная сессия (загрузка так и не завершилась и не ждёт
+# в журнале) оставила бы пустую папку, её QR уже видел гость — такая папка
+# удаляется при старте, а не возвращается в пул
+FOLDER_POOL_FILE = os.path.abspath("folder_pool.json")
+FOLDER_POOL_SIZE = 3
+FOLDER_POOL_MAX_AGE = 7 * 24 * 3600
+
+class FolderPool:
+    def __init__(self, size=FOLDER_POOL_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.folders = []  # [{"id": ..., "created": время создания}]
+        self.claimed = []  # [{"id": ..., "claimed": время выдачи}] — файл ещё не дошёл
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.refilling = False
+
+    def start(self):
+        with self.lock:
+            self.refilling = True
+        self.executor.submit(self._start)
+
+    def claim(self):
+        # ID свободной папки или None, если пул пуст (тогда папку создаст загрузка)
+        with self.lock:
+            folder = self.folders.pop(0) if self.folders else None
+            if folder is not None:
+                self.claimed.append({"id": folder["id"], "claimed": time.time()})
+            self._save()
+        self.refill()
+        return folder["id"] if folder else None
+
+    def filled(self, folder_id):
+        # Загрузка дошла до папки: она больше не считается брошенной
+        with self.lock:
+            before = len(self.claimed)
+            self.claimed = [f for f in self.claimed if f["id"] != folder_id]
+            if len(self.claimed) != before:
+                self._save()
+
+    def refill(self):
+        with self.lock:
+            if self.refilling or len(self.folders) >= self.size:
+                return
+            self.refilling = True
+        self.executor.submit(self._refill)
+
+    def _save(self):
+        try:
+            with open(FOLDER_POOL_FILE, "w", encoding="utf-8") as fh:
+                json.dump({"folders": self.folders, "claimed": self.claimed}, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save folder pool: {e}")
+
+    def _start(self):
+        try:
+            with open(FOLDER_POOL_FILE, encoding="utf-8") as fh:
+                saved = json.load(fh)
+            folders, claimed = saved.get("folders", []), saved.get("claimed", [])
+        except (OSError, ValueError):
+            folders, claimed = [], []
+        kept, abandoned = self._check_claimed(claimed)
+        now = time.time()
+        fresh = [f for f in folders if now - f["created"] < FOLDER_POOL_MAX_AGE]
+        for folder in folders:
+            if folder in fresh or drive_service is None:
+                continue
+            try:
+                drive().files().delete(fileId=folder["id"]).execute()
+            except Exception as e:
+                print(f"Failed to delete stale pool folder {folder['id']}: {e}")
+        with self.lock:
+            self.folders = fresh + self.folders
+            self.claimed = kept + self.claimed
+            self._save()
+        print(f"Folder pool: {len(fresh)} reused, {len(folders) - len(fresh)} stale removed, "
+              f"{abandoned} abandoned removed")
+        self._refill()
+
+    def _check_claimed(self, claimed):
+        # Выданная папка остаётся за сессией, пока её загрузка ждёт в журнале;
+        # пустая и никем не ожидаемая удаляется, непустая просто забывается
+        kept, abandoned = [], 0
+        for folder in claimed:
+            if drive_service is None or outbox.waits_for_folder(folder["id"]):
+                kept.append(folder)
+                continue
+            try:
+                children = drive().files().list(q=f"'{folder['id']}' in parents and trashed=false",
+                                                fields='files(id)', pageSize=1).execute().get('files', [])
+                if not children:
+                    drive().files().delete(fileId=folder["id"]).execute()
+                    abandoned += 1
+            except Exception as e:
+                print(f"Failed to check claimed pool folder {folder['id']}: {e}")
+                kept.append(folder)
+        return kept, abandoned
+
+    def _refill(self):
+        try:
+            while drive_service is not None:
+                with self.lock:
+                    if len(self.folders) >= self.size:
+                        break
+                name = f"pool_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [UNIVERSAL_FOLDER_ID]}
+                folder = drive().files().create(body=meta, fields='id').execute()
+                with self.lock:
+                    self.folders.append({"id": folder['id'], "created": time.time()})
+                    self._save()
+        except Exception as e:
+            print(f"Failed to refill folder pool: {e}")
+        finally:
+            with self.lock:
+                self.refilling = False
+
+folder_pool = FolderPool()
+
+def claim_share_folder(reuse_last):
+    # Папка для QR известна сразу: последняя (при reuse_last) или свободная из пула.
+    # Возвращает (ID или None, нужно ли переименовать папку под сессию)
+    if reuse_last and upload_service.last_folder_id:
+        return upload_service.last_folder_id, False
+    return folder_pool.claim(), True
+
+def folder_qr(folder_id):
+    return qrcode.make(f'https://drive.google.com/drive/folders/{folder_id}')
+
+# Журнал загрузок в SQLite: сессия записывается до начала загрузки (файлы,
+# событие, папка гостя, статус), поэтому загрузка, сорвавшаяся без сети, не
+# теряется. Фоновый разборщик повторяет отложенные записи с растущей паузой и
+# после перезапуска продолжает с того места, где остановился. После
+# OUTBOX_MAX_ATTEMPTS неудач запись помечается 'failed' и ждёт оператора;
+# загруженные записи удаляются через OUTBOX_KEEP_DAYS
+OUTBOX_DB = os.path.abspath("outbox.sqlite3")
+OUTBOX_POLL_S = 5
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 30 * 60
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_KEEP_DAYS = 7
+OUTBOX_PRUNE_S = 60 * 60
+OUTBOX_STEPS = ("event_file_id", "folder_id", "share_file_id")  # ID, созданные шагами загрузки
+
+class Outbox:
+    def __init__(self, db_path=OUTBOX_DB):
+        self.db_path = db_path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY, name TEXT, path TEXT, share_path TEXT, folder_name TEXT,
+                event_id TEXT, folder_id TEXT, claim_name INTEGER, status TEXT,
+                attempts INTEGER DEFAULT 0, created REAL, next_try REAL, last_error TEXT, uni_id TEXT,
+                event_file_id TEXT, share_file_id TEXT)""")
+            # Журналы, созданные до записи шагов, получают недостающие столбцы
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(outbox)")}
+            for column in ("event_file_id", "share_file_id"):
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+            # Загрузки, прерванные закрытием программы, снова ждут своей очереди
+            self.db.execute("UPDATE outbox SET status = 'pending' WHERE status = 'uploading'")
+        self.prune()
+        count, oldest, failed = self.status()
+        print(f"Outbox: {count} pending" + (f", oldest {oldest / 60:.0f} min" if oldest is not None else "")
+              + (f", {failed} failed" if failed else ""))
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def enqueue(self, name, path, share_path, folder_name, event_id, folder_id, claim_name):
+        # Запись принадлежит живому заданию UploadService, пока оно не отчитается
+        now = time.time()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO outbox (name, path, share_path, folder_name, event_id, folder_id, claim_name, "
+                "status, created, next_try) VALUES (?, ?, ?, ?, ?, ?, ?, 'uploading', ?, ?)",
+                (name, path, share_path, folder_name, event_id, folder_id, int(claim_name), now, now))
+            return cursor.lastrowid
+
+    def steps(self, row_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(OUTBOX_STEPS)} FROM outbox WHERE id = ?", (row_id,)).fetchone()
+        return {column: row[column] for column in OUTBOX_STEPS if row[column]} if row else {}
+
+    def record_step(self, row_id, column, value):
+        if column not in OUTBOX_STEPS:
+            raise ValueError(f"Unknown outbox step {column}")
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE outbox SET {column} = ? WHERE id = ?", (value, row_id))
+
+    def finish(self, row_id, uni_id):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET status = 'done', uni_id = ?, last_error = NULL WHERE id = ?",
+                            (uni_id, row_id))
+
+    def fail(self, row_id, error):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, row_id))
+
+    def retry_later(self, row_id, error):
+        with self.lock, self.db:
+            attempts = self.db.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()[0] + 1
+            status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+            delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+            self.db.execute("UPDATE outbox SET status = ?, attempts = ?, next_try = ?, last_error = ? "
+                            "WHERE id = ?", (status, attempts, time.time() + delay, error, row_id))
+        if status == "failed":
+            print(f"Outbox: giving up on row {row_id} after {attempts} attempts: {error}")
+
+    def prune(self):
+        with self.lock, self.db:
+            deleted = self.db.execute("DELETE FROM outbox WHERE status = 'done' AND created < ?",
+                                      (time.time() - OUTBOX_KEEP_DAYS * 24 * 60 * 60,)).rowcount
+        if deleted:
+            print(f"Outbox: pruned {deleted} uploaded rows")
+
+    def waits_for_folder(self, folder_id):
+        # Есть ли незавершённая загрузка в эту папку (в том числе брошенная после попыток)
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM outbox WHERE folder_id = ? AND status != 'done' LIMIT 1",
+                                   (folder_id,)).fetchone() is not None
+
+    def status(self):
+        # (сколько ещё не на Drive, возраст самой старой записи в секундах или None,
+        #  сколько записей брошено после OUTBOX_MAX_ATTEMPTS попыток)
+        with self.lock:
+            count, oldest = self.db.execute(
+                "SELECT COUNT(*), MIN(created) FROM outbox WHERE status IN ('pending', 'uploading')").fetchone()
+            failed = self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+        return count, time.time() - oldest if oldest is not None else None, failed
+
+    def _claim_due(self):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT * FROM outbox WHERE status = 'pending' AND next_try <= ? "
+                                  "ORDER BY created LIMIT 1", (time.time(),)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE outbox SET status = 'uploading' WHERE id = ?", (row["id"],))
+        return row
+
+    def _drain(self):
+        pruned_at = time.monotonic()
+        while True:
+            if time.monotonic() - pruned_at > OUTBOX_PRUNE_S:
+                self.prune()
+                pruned_at = time.monotonic()
+            if drive_service is None:
+                # Без Drive попытки только копили бы неудачи: записи ждут перезапуска
+                time.sleep(OUTBOX_POLL_S)
+                continue
+            row = self._claim_due()
+            if row is None:
+                time.sleep(OUTBOX_POLL_S)
+                continue
+            if not os.path.exists(row["path"]):
+                print(f"Outbox: {row['path']} is gone, dropping {row['name']}")
+                self.fail(row["id"], "file missing")
+                continue
+            print(f"Outbox: uploading {row['name']} (attempt {row['attempts'] + 1})")
+            try:
+                qr, url, uni_id = outbox_upload(row)
+                error = "upload failed"
+            except Exception as e:
+                qr, uni_id, error = None, None, str(e)
+            if qr is not None:
+                self.finish(row["id"], uni_id)
+                print(f"Outbox: {row['name']} uploaded")
+            else:
+                self.retry_later(row["id"], error)
+
+outbox = Outbox()
+
+def file_artifact(path, session_io):
+    ext = os.path.splitext(path)[1]
+    profile = next(p for p in ENCODER_PROFILES.values() if p.ext == ext)
+    return SessionArtifact(session_io, path, profile=profile)
+
+def outbox_upload(row):
+    # Повтор из журнала: файлы уже на диске, папка гостя — та, что была в QR
+    session_io = SessionIO()
+    share_path = row["share_path"] if os.path.exists(row["share_path"]) else row["path"]
+    return upload_to_drive(row["path"], row["folder_name"], row["event_id"], folder_id=row["folder_id"],
+                           outbox_id=row["id"],
+                           claim_name=bool(row["claim_name"]), encoded=file_artifact(row["path"], session_io),
+                           share=file_artifact(share_path, session_io))
+
+def update_outbox_status():
+    count, oldest, failed = outbox.status()
+    if count:
+        text = f"Ждут загрузки: {count}, самая старая — {oldest / 60:.0f} мин"
+    else:
+        text = "Все загрузки завершены"
+    if failed:
+        text += f"\nНе загрузились после {OUTBOX_MAX_ATTEMPTS} попыток: {failed}"
+    outbox_label.config(text=text, fg="#ff6666" if failed else "white")
+    window.after(5000, update_outbox_status)
+
 def load_frame_template():
-    global frame_template_path, frame_template_cv, photo_positions
+    global frame_template_path, frame_template_cv, frame_template_hash, photo_positions
     file = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
     if not file:
         return
@@ -136,23 +616,174 @@ def load_frame_template():
     
     frame_template_path = file
     frame_template_cv = cv2.resize(img, (FRAME_WIDTH, FRAME_HEIGHT))
+    frame_template_hash = image_hash(frame_template_cv)
     
     auto_detect_photo_positions()
     print("Frame template loaded successfully.")
 
+# Окна под фото ищутся в самом шаблоне: прозрачные области по альфе, а у шаблонов
+# без альфы — области ключевого цвета. Связные компоненты ищутся на уменьшенной
+# маске, края уточняются в полном разрешении. Результат кэшируется на диске по
+# хэшу содержимого файла шаблона, так что шаблон анализируется один раз
+TEMPLATE_WINDOWS_FILE = os.path.abspath("template_windows.json")
+TEMPLATE_KEY_COLOR = (0, 255, 0)  # BGR, зелёный хромакей
+TEMPLATE_KEY_TOLERANCE = 40
+TEMPLATE_ALPHA_THRESHOLD = 128
+WINDOW_DETECT_SCALE = 4
+WINDOW_DETECT_VERSION = 2
+WINDOW_MIN_AREA = 0.01  # Доля площади шаблона
+WINDOW_MIN_FILL = 0.6  # Доля заполнения рамки компоненты — отсекает узоры и надписи
+DEFAULT_PHOTO_POSITIONS = [
+    (50, 50, 280, 210),
+    (870, 50, 280, 210),
+    (50, 1540, 280, 210),
+    (870, 1540, 280, 210)
+]
+
+def template_window_mask(template):
+    if template.shape[2] == 4:
+        return np.where(template[:, :, 3] < TEMPLATE_ALPHA_THRESHOLD, 255, 0).astype(np.uint8)
+    key = np.array(TEMPLATE_KEY_COLOR, dtype=np.int16)
+    lower = np.clip(key - TEMPLATE_KEY_TOLERANCE, 0, 255).astype(np.uint8)
+    upper = np.clip(key + TEMPLATE_KEY_TOLERANCE, 0, 255).astype(np.uint8)
+    return cv2.inRange(template[:, :, :3], lower, upper)
+
+def refine_window(mask, x, y, w, h):
+    # Уточнение в полном разрешении: край окна — первая/последняя строка и
+    # столбец, где окно занимает хотя бы половину своей ширины/высоты
+    margin = WINDOW_DETECT_SCALE * 2
+    x0, y0 = max(x - margin, 0), max(y - margin, 0)
+    x1, y1 = min(x + w + margin, mask.shape[1]), min(y + h + margin, mask.shape[0])
+    roi = mask[y0:y1, x0:x1] > 0
+    rows = np.flatnonzero(roi.sum(axis=1) >= w // 2)
+    cols = np.flatnonzero(roi.sum(axis=0) >= h // 2)
+    if len(rows) == 0 or len(cols) == 0:
+        return x, y, w, h
+    return (x0 + int(cols[0]), y0 + int(rows[0]),
+            int(cols[-1] - cols[0]) + 1, int(rows[-1] - rows[0]) + 1)
+
+def detect_template_windows(template, count=4):
+    mask = template_window_mask(template)
+    height, width = mask.shape
+    scale = WINDOW_DETECT_SCALE
+    small = cv2.resize(mask, (width // scale, height // scale), interpolation=cv2.INTER_AREA)
+    _, small = cv2.threshold(small, 127, 255, cv2.THRESH_BINARY)
+    num, _, stats, _ = cv2.connectedComponentsWithStats(small, connectivity=8)
+    min_area = WINDOW_MIN_AREA * small.shape[0] * small.shape[1]
+    windows = []
+    for i in range(1, num):
+        x, y, w, h, area = (int(v) for v in stats[i])
+        if area < min_area or area < WINDOW_MIN_FILL * w * h:
+            continue
+        windows.append((area, refine_window(mask, x * scale, y * scale, w * scale, h * scale)))
+    # Самые крупные окна, по порядку чтения: строками сверху вниз, в строке
+    # слева направо. Окно входит в строку, если его верх выше её низа, поэтому
+    # окна одной строки с чуть разным верхом не разъезжаются по разным строкам
+    windows = [window for _, window in sorted(windows, reverse=True)[:count]]
+    rows = []
+    for window in sorted(windows, key=lambda p: p[1]):
+        if rows and window[1] < rows[-1][0]:
+            rows[-1][0] = max(rows[-1][0], window[1] + window[3])
+            rows[-1][1].append(window)
+        else:
+            rows.append([window[1] + window[3], [window]])
+    return [window for _, row in rows for window in sorted(row, key=lambda p: p[0])]
+
+def template_file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    # Версия в ключе сбрасывает окна, сохранённые со старым порядком строк
+    return f"{digest.hexdigest()}:{FRAME_WIDTH}x{FRAME_HEIGHT}:{WINDOW_DETECT_VERSION}"
+
+def load_template_windows(path, template):
+    try:
+        key = template_file_hash(path)
+    except (OSError, TypeError):
+        return detect_template_windows(template)
+    try:
+        with open(TEMPLATE_WINDOWS_FILE, encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        cached = {}
+    if key in cached:
+        return [tuple(p) for p in cached[key]]
+    started = time.perf_counter()
+    windows = detect_template_windows(template)
+    print(f"Template analysed in {(time.perf_counter() - started) * 1000:.0f} ms: {len(windows)} windows")
+    cached[key] = windows
+    try:
+        with open(TEMPLATE_WINDOWS_FILE, "w", encoding="utf-8") as fh:
+            json.dump(cached, fh, indent=2)
+    except OSError as e:
+        print(f"Failed to save template windows: {e}")
+    return windows
+
 def auto_detect_photo_positions():
     global photo_positions, frame_template_cv
     if frame_template_cv is None:
         return
     
-    photo_width, photo_height = 280, 210
-    photo_positions = [
-        (50, 50, photo_width, photo_height),
-        (870, 50, photo_width, photo_height),
-        (50, 1540, photo_width, photo_height),
-        (870, 1540, photo_width, photo_height)
-    ]
-    print(f"Auto-detected photo positions: {photo_positions}")
+    windows = load_template_windows(frame_template_path, frame_template_cv)
+    if len(windows) == 4:
+        photo_positions = windows
+        print(f"Auto-detected photo positions: {photo_positions}")
+    else:
+        # Окна не нашлись — стандартные позиции, дальше правятся вручную
+        photo_positions = list(DEFAULT_PHOTO_POSITIONS)
+        print(f"Found {len(windows)} template windows, using default photo positions: {photo_positions}")
+
+# Редактор позиций рисует на уменьшенной до экрана копии шаблона (альфа уже
+# сведена на серый фон). События мыши только меняют photo_positions, а
+# перерисовка идёт не чаще раза за обновление экрана и только в областях,
+# где прямоугольник был или стал
+EDITOR_MAX_HEIGHT = 900
+EDITOR_FRAME_MS = 16
+EDITOR_PAD = 8  # Запас на толщину рамки и маркеры углов
+EDITOR_BACKGROUND = 128
+
+def editor_proxy(template):
+    scale = min(1.0, EDITOR_MAX_HEIGHT / template.shape[0])
+    size = (int(template.shape[1] * scale), int(template.shape[0] * scale))
+    proxy = cv2.resize(template, size, interpolation=cv2.INTER_AREA)
+    if proxy.shape[2] == 4:
+        background = np.full((size[1], size[0], 3), EDITOR_BACKGROUND, dtype=np.uint8)
+        proxy = blend_into(background, *premultiply(proxy))
+    return proxy, scale
+
+def draw_position(image, index, rect):
+    x, y, w, h = rect
+    cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    cv2.putText(image, f"{index+1}", (x + 10, y + 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    cv2.circle(image, (x, y), 5, (0, 0, 255), -1)
+    cv2.circle(image, (x + w, y + h), 5, (0, 0, 255), -1)
+
+def redraw_editor(canvas, proxy, drawn, rects):
+    # Восстанавливает фон в старых и новых местах изменившихся прямоугольников и
+    # дорисовывает все, что задевают эти области; True, если что-то изменилось
+    height, width = canvas.shape[:2]
+    dirty = []
+    for i in range(max(len(drawn), len(rects))):
+        old = drawn[i] if i < len(drawn) else None
+        new = rects[i] if i < len(rects) else None
+        if old != new:
+            dirty.extend(r for r in (old, new) if r is not None)
+    if not dirty:
+        return False
+    regions = []
+    for x, y, w, h in dirty:
+        x0, y0 = max(x - EDITOR_PAD, 0), max(y - EDITOR_PAD, 0)
+        x1, y1 = min(x + w + EDITOR_PAD, width), min(y + h + EDITOR_PAD, height)
+        if x0 < x1 and y0 < y1:
+            canvas[y0:y1, x0:x1] = proxy[y0:y1, x0:x1]
+            regions.append((x0, y0, x1, y1))
+    for i, (x, y, w, h) in enumerate(rects):
+        if any(x - EDITOR_PAD < x1 and x + w + EDITOR_PAD > x0 and y - EDITOR_PAD < y1 and y + h + EDITOR_PAD > y0
+               for x0, y0, x1, y1 in regions):
+            draw_position(canvas, i, (x, y, w, h))
+    drawn[:] = rects
+    return True
 
 def setup_photo_positions():
     global photo_positions, frame_template_cv
@@ -163,6 +794,10 @@ def setup_photo_positions():
     if not photo_positions:
         auto_detect_photo_positions()
     
+    proxy, scale = editor_proxy(frame_template_cv)
+    canvas = proxy.copy()
+    drawn = []
+    grab = 10 / scale  # Зона захвата края — 10 экранных пикселей
     dragging = False
     resizing = False
     resize_mode = None
@@ -172,6 +807,8 @@ def setup_photo_positions():
 
     def on_mouse(event, x, y, flags, param):
         nonlocal dragging, resizing, resize_mode, selected_idx, start_x, start_y, initial_pos
+        # Координаты окна редактора -> координаты шаблона
+        x, y = int(x / scale), int(y / scale)
         
         if event == cv2.EVENT_LBUTTONDOWN:
             for i, (px, py, pw, ph) in enumerate(photo_positions):
@@ -179,16 +816,16 @@ def setup_photo_positions():
                     selected_idx = i
                     start_x, start_y = x, y
                     initial_pos = (px, py, pw, ph)
-                    if abs(x - px) < 10 and abs(y - py) < 10:
+                    if abs(x - px) < grab and abs(y - py) < grab:
                         resize_mode = 'corner'
                         resizing = True
-                    elif abs(x - (px + pw)) < 10 and abs(y - (py + ph)) < 10:
+                    elif abs(x - (px + pw)) < grab and abs(y - (py + ph)) < grab:
                         resize_mode = 'corner'
                         resizing = True
-                    elif abs(x - px) < 10 or abs(x - (px + pw)) < 10:
+                    elif abs(x - px) < grab or abs(x - (px + pw)) < grab:
                         resize_mode = 'width'
                         resizing = True
-                    elif abs(y - py) < 10 or abs(y - (py + ph)) < 10:
+                    elif abs(y - py) < grab or abs(y - (py + ph)) < grab:
                         resize_mode = 'height'
                         resizing = True
                     else:
@@ -222,15 +859,6 @@ def setup_photo_positions():
                 new_y = max(0, min(py + dy, FRAME_HEIGHT - ph))
                 photo_positions[selected_idx] = (new_x, new_y, pw, ph)
 
-            temp_img = frame_template_cv.copy()
-            for i, (px, py, pw, ph) in enumerate(photo_positions):
-                cv2.rectangle(temp_img, (px, py), (px + pw, py + ph), (0, 255, 0), 2)
-                cv2.putText(temp_img, f"{i+1}", (px + 10, py + 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                cv2.circle(temp_img, (px, py), 5, (0, 0, 255), -1)
-                cv2.circle(temp_img, (px + pw, py + ph), 5, (0, 0, 255), -1)
-            cv2.imshow('Setup Positions', temp_img)
-
         elif event == cv2.EVENT_LBUTTONUP:
             dragging = False
             resizing = False
@@ -247,154 +875,700 @@ def setup_photo_positions():
                 if width and height:
                     px, py, _, _ = photo_positions[selected_idx]
                     photo_positions[selected_idx] = (px, py, width, height)
-            temp_img = frame_template_cv.copy()
-            for i, (px, py, pw, ph) in enumerate(photo_positions):
-                cv2.rectangle(temp_img, (px, py), (px + pw, py + ph), (0, 255, 0), 2)
-                cv2.putText(temp_img, f"{i+1}", (px + 10, py + 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            cv2.imshow('Setup Positions', temp_img)
 
-    temp_img = frame_template_cv.copy()
-    cv2.imshow('Setup Positions', temp_img)
+    def display_rects():
+        return [tuple(int(v * scale) for v in position) for position in photo_positions]
+
+    redraw_editor(canvas, proxy, drawn, display_rects())
+    cv2.imshow('Setup Positions', canvas)
     cv2.setMouseCallback('Setup Positions', on_mouse)
     
     print("ЛКМ: установка/перемещение позиции или изменение размера (углы/стороны).")
     print("ПКМ: изменить размеры вручную. Нажмите любую клавишу для завершения.")
-    cv2.waitKey(0)
+    # Все события мыши между кадрами сливаются в одну перерисовку
+    while cv2.waitKey(EDITOR_FRAME_MS) == -1:
+        if cv2.getWindowProperty('Setup Positions', cv2.WND_PROP_VISIBLE) < 1:
+            break
+        if redraw_editor(canvas, proxy, drawn, display_rects()):
+            cv2.imshow('Setup Positions', canvas)
     cv2.destroyAllWindows()
     
     if len(photo_positions) != 4:
         messagebox.showwarning("Внимание", f"Установлено только {len(photo_positions)} позиций из 4")
 
 def clear_frame_template():
-    global frame_template_path, frame_template_cv, photo_positions
+    global frame_template_path, frame_template_cv, frame_template_hash, photo_positions
     frame_template_path = None
     frame_template_cv = None
+    frame_template_hash = None
     photo_positions = []
     print("Frame template cleared.")
 
 def toggle_mirror_mode():
     global mirror_mode
     mirror_mode = not mirror_mode
+    publish_settings(mirror=mirror_mode)
     mirror_button.config(text="🔄 Отзеркалить (Вкл)" if mirror_mode else "🔄 Отзеркалить (Выкл)")
     print(f"Mirror mode {'enabled' if mirror_mode else 'disabled'}")
 
-preview_queue = queue.Queue(maxsize=10)
-
-def process_frames():
-    global cap, countdown_value, mirror_mode
-    while preview_running:
-        if not (cap and cap.isOpened()):
-            time.sleep(0.01)
-            continue
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.01)
-            continue
-        
-        rot = ROTATION_OPTIONS[selected_rotation.get()]
-        if rot is not None:
-            frame = cv2.rotate(frame, rot)
-        
-        h, w = frame.shape[:2]
-        scale = 1350 / w
-        nh = int(h * scale)
-        frame = cv2.resize(frame, (1350, nh))
-        
-        # Применяем зеркальное отображение для превью
-        if mirror_mode:
-            frame = cv2.flip(frame, 1)
-        
-        if countdown_value is not None:
-            txt = str(countdown_value)
-            org = (frame.shape[1]//2 - 60, frame.shape[0]//2 + 60)
-            cv2.putText(frame, txt, org,
-                        cv2.FONT_HERSHEY_SIMPLEX, 5,
-                        (255, 255, 255), 10, cv2.LINE_AA)
-        
+# Согласование режима камеры: реально поддерживаемые режимы (разрешение, fps,
+# fourcc) определяются один раз и кэшируются на диске по имени устройства
+CAMERA_MODES_FILE = os.path.abspath("camera_modes.json")
+CAMERA_CANDIDATE_SIZES = [(640, 480), (1280, 720), (1024, 768), (1600, 1200), (1920, 1080),
+                          (2048, 1536), (2592, 1944), (3840, 2160)]
+CAMERA_FOURCCS = ["MJPG", "YUY2"]
+camera_mode_logged = False
+
+def fourcc_to_str(value):
+    code = int(value)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00")
+
+def probe_camera_modes(index):
+    # OpenCV не перечисляет режимы сам, поэтому каждый кандидат запрашивается
+    # и сверяется с тем, что драйвер выставил на самом деле
+    probe = cv2.VideoCapture(index, cv2.CAP_DSHOW)
+    if not probe.isOpened():
+        print("Failed to open camera for mode probing.")
+        return []
+    modes = []
+    try:
+        for fourcc in CAMERA_FOURCCS:
+            for width, height in CAMERA_CANDIDATE_SIZES:
+                probe.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+                probe.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                probe.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                probe.set(cv2.CAP_PROP_FPS, 30)
+                actual = (int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                actual_fourcc = fourcc_to_str(probe.get(cv2.CAP_PROP_FOURCC))
+                if actual != (width, height) or actual_fourcc != fourcc:
+                    continue
+                mode = {"width": width, "height": height,
+                        "fps": round(probe.get(cv2.CAP_PROP_FPS), 2), "fourcc": fourcc}
+                if mode not in modes:
+                    modes.append(mode)
+    finally:
+        probe.release()
+    return modes
+
+def load_camera_modes(index):
+    try:
+        with open(CAMERA_MODES_FILE, encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        cached = {}
+    if cached.get(DEVICE_NAME):
+        return cached[DEVICE_NAME]
+    modes = probe_camera_modes(index)
+    print(f"Probed {len(modes)} camera modes for {DEVICE_NAME}: {modes}")
+    if modes:
+        cached[DEVICE_NAME] = modes
         try:
-            preview_queue.put_nowait(frame)
-        except queue.Full:
-            pass
-        time.sleep(0.01)
+            with open(CAMERA_MODES_FILE, "w", encoding="utf-8") as fh:
+                json.dump(cached, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save camera modes: {e}")
+    return modes
+
+def select_camera_mode(modes, width, fps, rotation):
+    # Кадр масштабируется по ширине, поэтому матрица должна покрывать ширину
+    # после поворота; из подходящих берётся самый дешёвый по числу пикселей,
+    # для больших разрешений предпочитается сжатый MJPG
+    rotated = rotation in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    def cost(mode):
+        pixels = mode["width"] * mode["height"]
+        prefer_mjpg = pixels > 640 * 480
+        return (pixels, 0 if (mode["fourcc"] == "MJPG") == prefer_mjpg else 1)
+    # Многие драйверы DirectShow отдают CAP_PROP_FPS = 0: такая частота
+    # неизвестна и режим не отсеивается, иначе всегда брался бы самый большой
+    suitable = [m for m in modes
+                if (m["height"] if rotated else m["width"]) >= width and (m["fps"] <= 0 or m["fps"] >= fps)]
+    if suitable:
+        return min(suitable, key=cost)
+    if modes:
+        return max(modes, key=lambda m: (m["width"] * m["height"], m["fourcc"] == "MJPG", m["fps"]))
+    return None
+
+def measure_camera_fps(camera, frames=20):
+    camera.read()  # первый кадр включает прогрев камеры
+    start = time.monotonic()
+    received = 0
+    for _ in range(frames):
+        ret, _ = camera.read()
+        if ret:
+            received += 1
+    elapsed = time.monotonic() - start
+    return received / elapsed if elapsed > 0 else 0.0
+
+def open_camera(fps, width, height, rotation):
+    global camera_mode_logged
+    mode = select_camera_mode(load_camera_modes(camera_index), width, fps, rotation)
+    camera = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
+    if not camera.isOpened():
+        return camera
+    if mode is not None:
+        # FOURCC нужно выставлять до размера кадра, иначе DirectShow его игнорирует
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode["fourcc"]))
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, mode["width"])
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, mode["height"])
+    else:
+        if rotation in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+            width, height = height, width
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    camera.set(cv2.CAP_PROP_FPS, fps)
+    if not camera_mode_logged:
+        camera_mode_logged = True
+        actual = (int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)), int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        actual_fourcc = fourcc_to_str(camera.get(cv2.CAP_PROP_FOURCC))
+        print(f"Camera mode for {DEVICE_NAME}: chosen {mode}, driver reports "
+              f"{actual[0]}x{actual[1]} {actual_fourcc}, measured {measure_camera_fps(camera):.1f} fps")
+    return camera
+
+# План геометрии: поворот, масштаб, обрезка/поля и зеркало сводятся в одну
+# аффинную матрицу на (размер входа, настройки) и применяются за один проход
+geometry_cache = {}
+geometry_cache_version = 0  # версия снимка настроек, для которой собран кэш
+
+def get_geometry_plan(src_w, src_h, rotation, target_w=None, target_h=None, mirror=False):
+    global geometry_cache_version
+    version = settings.version
+    if version != geometry_cache_version:
+        geometry_cache.clear()  # планы старых настроек больше не понадобятся
+        geometry_cache_version = version
+    key = (src_w, src_h, rotation, target_w, target_h, mirror)
+    plan = geometry_cache.get(key)
+    if plan is not None:
+        return plan
+    # Поворот в непрерывных координатах (границы пикселей — целые числа)
+    if rotation == cv2.ROTATE_90_CLOCKWISE:
+        m = np.array([[0, -1, src_h], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_h, src_w
+    elif rotation == cv2.ROTATE_90_COUNTERCLOCKWISE:
+        m = np.array([[0, 1, 0], [-1, 0, src_w], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_h, src_w
+    elif rotation == cv2.ROTATE_180:
+        m = np.array([[-1, 0, src_w], [0, -1, src_h], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_w, src_h
+    else:
+        m = np.eye(3)
+        rw, rh = src_w, src_h
+    # Масштаб по ширине target_w, по высоте — центрированная обрезка или чёрные поля до target_h
+    out_w = target_w or rw
+    nh = int(rh * out_w / rw) if target_w else rh
+    out_h = target_h or nh
+    offset_y = -((nh - out_h) // 2) if nh > out_h else (out_h - nh) // 2
+    m = np.array([[out_w / rw, 0, 0], [0, nh / rh, offset_y], [0, 0, 1]]) @ m
+    if mirror:
+        m = np.array([[-1, 0, out_w], [0, 1, 0], [0, 0, 1]]) @ m
+    # Переход к индексам пикселей (центр пикселя i находится в i + 0.5), как в cv2.resize
+    m = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]]) @ m @ np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+    if (out_w, out_h) == (src_w, src_h) and np.allclose(m, np.eye(3)):
+        matrix = None
+    else:
+        matrix = m[:2]
+    # Без масштабирования матрица переставляет пиксели целиком, интерполяция не нужна
+    interpolation = cv2.INTER_NEAREST if (out_w, nh) == (rw, rh) else cv2.INTER_LINEAR
+    # Строки чёрных полей сверху и снизу; края кадра продолжаются своими пикселями, как в cv2.resize
+    pad = (offset_y, offset_y + nh) if nh < out_h else None
+    plan = (matrix, (out_w, out_h), interpolation, pad)
+    geometry_cache[key] = plan
+    return plan
+
+def apply_geometry(frame, rotation, target_w=None, target_h=None, mirror=False):
+    h, w = frame.shape[:2]
+    matrix, size, interpolation, pad = get_geometry_plan(w, h, rotation, target_w, target_h, mirror)
+    if matrix is None:
+        return frame
+    out = cv2.warpAffine(frame, matrix, size, flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
+    if pad is not None:
+        out[:pad[0]] = 0
+        out[pad[1]:] = 0
+    return out
+
+class LatestFrameSlot:
+    # Одноместный обмен кадрами между потоками: новый кадр вытесняет
+    # непрочитанный старый, поэтому превью всегда показывает самый свежий кадр
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, frame, ts):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = (frame, ts)
+            self._cond.notify_all()
+
+    def take(self, timeout=None):
+        with self._cond:
+            if self._item is None and timeout:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def clear(self):
+        with self._cond:
+            self._item = None
+
+class DisplaySurface:
+    # Один PhotoImage на размер виджета: новый кадр вставляется в него на месте
+    # через paste(), вместо создания нового PhotoImage на каждом тике
+    def __init__(self, label):
+        self.label = label
+        self.photo = None
+
+    def show(self, image):
+        if self.photo is None or (self.photo.width(), self.photo.height()) != image.size:
+            self.photo = ImageTk.PhotoImage(image)
+            self.label.imgtk = self.photo
+            self.label.config(image=self.photo)
+        else:
+            self.photo.paste(image)
+
+    def clear(self):
+        self.photo = None
+        self.label.imgtk = None
+        self.label.config(image='')
+
+preview_slot = LatestFrameSlot()
+PREVIEW_STATS_INTERVAL = 5.0
+preview_stats = {"displayed": 0, "dropped": 0, "age_ms": 0.0, "avg_age_ms": 0.0, "fps": 0.0}
+preview_stats_window = {"start": time.monotonic(), "frames": 0, "age_sum": 0.0, "dropped": 0}
+
+def record_preview_frame(capture_ts):
+    # Возраст кадра от захвата до показа, потерянные кадры и фактический fps
+    now = time.monotonic()
+    age_ms = (now - capture_ts) * 1000
+    preview_stats["displayed"] += 1
+    preview_stats["dropped"] = preview_slot.dropped
+    preview_stats["age_ms"] = age_ms
+    window_stats = preview_stats_window
+    window_stats["frames"] += 1
+    window_stats["age_sum"] += age_ms
+    elapsed = now - window_stats["start"]
+    if elapsed >= PREVIEW_STATS_INTERVAL:
+        preview_stats["fps"] = window_stats["frames"] / elapsed
+        preview_stats["avg_age_ms"] = window_stats["age_sum"] / window_stats["frames"]
+        dropped = preview_slot.dropped - window_stats["dropped"]
+        print(f"Preview: {preview_stats['fps']:.1f} fps, frame age {preview_stats['avg_age_ms']:.0f} ms avg / "
+              f"{age_ms:.0f} ms last, dropped {dropped} (total {preview_slot.dropped})")
+        window_stats.update(start=now, frames=0, age_sum=0.0, dropped=preview_slot.dropped)
+
+def get_preview_stats():
+    return dict(preview_stats)
+
+# Снимок без задержки затвора: сессия держит несколько последних полноразмерных
+# кадров с monotonic-метками, снимок берётся из них по моменту конца отсчёта
+ZSL_RING_FRAMES = 8
+shutter_lags = []  # на каждый снимок: (опоздание таймера, отклонение кадра от цели), мс
+
+def record_shutter_lag(target_ts, captured_at, fired_at=None):
+    timer_late_ms = ((fired_at or time.monotonic()) - target_ts) * 1000
+    lag_ms = (captured_at - target_ts) * 1000
+    shutter_lags.append((timer_late_ms, lag_ms))
+    print(f"Shutter lag {lag_ms:+.0f} ms (timer fired {timer_late_ms:.0f} ms late, "
+          f"ring {camera.ring_span_ms():.0f} ms)")
+
+class CameraSession:
+    # Долгоживущая сессия камеры: владеет устройством, читает кадры в своём
+    # потоке и раздаёт их подписчикам (превью, снимок, запись). Режим меняется
+    # без закрытия и повторного открытия устройства.
+    def __init__(self, index):
+        self.index = index
+        self.capture = None
+        self.fps = None
+        self.last_switch_ms = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._latest = None
+        self._running = False
+        self._thread = None
+        self._switch_started = None
+        self._ring = deque(maxlen=ZSL_RING_FRAMES)
+
+    def is_open(self):
+        return self.capture is not None
+
+    def open(self, fps, width, height, rotation):
+        if self.is_open():
+            self.switch_mode(fps)
+            return True
+        capture = open_camera(fps, width, height, rotation)
+        if not capture.isOpened():
+            return False
+        self.capture = capture
+        self.fps = fps
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def _read_loop(self):
+        while self._running:
+            with self._lock:
+                if self.capture is None:
+                    break
+                ret, frame = self.capture.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            captured_at = time.monotonic()
+            self._latest = (frame, captured_at)
+            self._ring.append(self._latest)
+            if self._switch_started is not None:
+                self.last_switch_ms = (captured_at - self._switch_started) * 1000
+                self._switch_started = None
+                print(f"Camera switched to {self.fps} fps in {self.last_switch_ms:.0f} ms")
+            for slot in list(self._subscribers):
+                slot.put(frame, captured_at)
+
+    def subscribe(self):
+        slot = LatestFrameSlot()
+        self._subscribers.append(slot)
+        return slot
+
+    def unsubscribe(self, slot):
+        if slot in self._subscribers:
+            self._subscribers.remove(slot)
+
+    def latest(self):
+        return self._latest
+
+    def frame_at(self, target_ts):
+        # Кадр из кольца последних кадров, ближайший по времени захвата к target_ts
+        frames = list(self._ring)
+        if not frames:
+            return self._latest
+        return min(frames, key=lambda item: abs(item[1] - target_ts))
+
+    def frames_around(self, target_ts, count):
+        # count кадров кольца, ближайших к target_ts, в порядке захвата
+        frames = sorted(self._ring, key=lambda item: abs(item[1] - target_ts))[:count]
+        return sorted(frames, key=lambda item: item[1])
+
+    def ring_span_ms(self):
+        frames = list(self._ring)
+        return (frames[-1][1] - frames[0][1]) * 1000 if len(frames) > 1 else 0.0
+
+    def switch_mode(self, fps):
+        # Задержка переключения — от запроса до первого кадра в новом режиме
+        if not self.is_open() or fps == self.fps:
+            return
+        started = time.monotonic()
+        with self._lock:
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+        self.fps = fps
+        self._switch_started = started
+
+    def close(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        with self._lock:
+            if self.capture is not None:
+                self.capture.release()
+            self.capture = None
+        self._thread = None
+        self._latest = None
+        self._ring.clear()
+        self.fps = None
+        self._subscribers.clear()
+
+camera = CameraSession(camera_index)
+
+# Превью рендерится ровно в размер метки на экране: кадр вписывается в её
+# внутреннюю область, кэш геометрии перестраивается только при смене размера
+preview_size = (1350, 2400)
+
+def on_preview_configure(event):
+    global preview_size
+    border = 2 * (int(preview_label.cget("bd")) + int(preview_label.cget("highlightthickness")))
+    size = (event.width - border, event.height - border)
+    if size[0] >= 2 and size[1] >= 2 and size != preview_size:
+        preview_size = size
+        print(f"Preview size: {size[0]}x{size[1]}")
+
+# Смешивание в фиксированной точке, общее для превью, отсчёта, коллажей и шаблонов:
+# рамка один раз переводится в предумноженный вид (цвет * вес, вес 0..256 в uint16),
+# а результат пишется прямо в кадр или его ROI, без float-массивов. Отличие от
+# float-формулы photo * (1 - a) + rgb * a — не больше 1 LSB
+def premultiply(ov):
+    if ov.shape[2] == 4:
+        # Альфа 0..255 переводится в вес 0..256, чтобы результат делился сдвигом на 8
+        a = ov[:, :, 3:].astype(np.uint16)
+        a += a >> 7
+        return ov[:, :, :3] * a, 256 - a
+    # Аналог cv2.addWeighted(frame, 0.7, ov, 0.3, 0)
+    return ov.astype(np.uint16) * np.uint16(77), np.uint16(179)
+
+def blend_into(dst, premul, inv):
+    # (dst * inv + premul + 128) >> 8 на месте; dst — uint8-кадр или его ROI
+    acc = dst.astype(np.uint16)
+    acc *= inv
+    acc += premul
+    acc += 128
+    acc >>= 8
+    dst[...] = acc
+    return dst
+
+# Спрайты цифр отсчёта: каждая цифра растеризуется один раз на (масштаб превью,
+# шрифт, кадр анимации) и смешивается с кадром только внутри своего прямоугольника
+COUNTDOWN_FONT = cv2.FONT_HERSHEY_SIMPLEX
+COUNTDOWN_ANIMATION_FRAMES = 1  # больше 1 — цифра появляется крупнее и гаснет к концу секунды
+COUNTDOWN_SPRITES_MAX = 64
+countdown_sprites = {}
+countdown_changed_at = time.monotonic()
+countdown_target = None  # момент, когда отсчёт доходит до снимка
+
+def get_countdown_sprite(text, k, step=0):
+    key = (text, round(k, 3), COUNTDOWN_FONT, step)
+    sprite = countdown_sprites.get(key)
+    if sprite is not None:
+        return sprite
+    thickness = max(1, int(10 * k))
+    (bw, bh), _ = cv2.getTextSize(text, COUNTDOWN_FONT, 5 * k, thickness)
+    grow, fade = 1.0, 1.0
+    if COUNTDOWN_ANIMATION_FRAMES > 1:
+        t = step / COUNTDOWN_ANIMATION_FRAMES
+        grow = 1.0 + 0.25 * (1 - t) ** 2
+        fade = min(1.0, 2 * (1 - t))
+    (tw, th), baseline = cv2.getTextSize(text, COUNTDOWN_FONT, 5 * k * grow, thickness)
+    pad = thickness
+    mask = np.zeros((th + baseline + 2 * pad, tw + 2 * pad), dtype=np.uint8)
+    cv2.putText(mask, text, (pad, pad + th), COUNTDOWN_FONT, 5 * k * grow, 255, thickness, cv2.LINE_AA)
+    # Вес 0..256, как у рамки: белая цифра даёт premul = 255 * a
+    a = np.round(mask.astype(np.float32) * (256 / 255 * fade)).astype(np.uint16)[:, :, None]
+    premul = a * np.uint16(255)
+    inv = np.uint16(256) - a
+    # Центр цифры совпадает с тем, что рисовал cv2.putText с org = (W/2 - 60k, H/2 + 60k)
+    cx = -int(60 * k) + bw / 2
+    cy = int(60 * k) - bh / 2
+    sprite = (premul, inv, int(round(cx - pad - tw / 2)), int(round(cy - pad - th / 2)))
+    if len(countdown_sprites) >= COUNTDOWN_SPRITES_MAX:
+        countdown_sprites.clear()
+    countdown_sprites[key] = sprite
+    return sprite
+
+def countdown_step():
+    # Кадр анимации — по времени, прошедшему с показа текущей цифры
+    if COUNTDOWN_ANIMATION_FRAMES == 1:
+        return 0
+    elapsed = time.monotonic() - countdown_changed_at
+    return min(COUNTDOWN_ANIMATION_FRAMES - 1, int(elapsed * COUNTDOWN_ANIMATION_FRAMES))
+
+def draw_countdown(frame, text, k, step=0):
+    premul, inv, dx, dy = get_countdown_sprite(text, k, step)
+    h, w = frame.shape[:2]
+    x0, y0 = w // 2 + dx, h // 2 + dy
+    sh, sw = inv.shape[:2]
+    fx0, fy0 = max(x0, 0), max(y0, 0)
+    fx1, fy1 = min(x0 + sw, w), min(y0 + sh, h)
+    if fx0 >= fx1 or fy0 >= fy1:
+        return
+    cut = (slice(fy0 - y0, fy1 - y0), slice(fx0 - x0, fx1 - x0))
+    blend_into(frame[fy0:fy1, fx0:fx1], premul[cut], inv[cut])
+
+def process_frames(generation):
+    frames = camera.subscribe()
+    try:
+        while preview_running and generation == preview_generation:
+            item = frames.take(timeout=0.1)
+            if item is None:
+                continue
+            compose_preview_frame(*item)
+    finally:
+        camera.unsubscribe(frames)
+
+def compose_preview_frame(frame, captured_at):
+    # Поворот, масштаб под размер метки и зеркало для превью — одним проходом
+    s = settings
+    source = frame
+    rot = s.rotation
+    h, w = frame.shape[:2]
+    if rot in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+        w, h = h, w
+    avail_w, avail_h = preview_size
+    frame = apply_geometry(frame, rot, min(avail_w, avail_h * w // h), mirror=s.mirror)
+    
+    if countdown_value is not None:
+        if frame is source:
+            frame = frame.copy()  # не рисуем поверх кадра, общего с другими подписчиками
+        k = frame.shape[1] / 1350  # размер цифр — как раньше на превью шириной 1350
+        draw_countdown(frame, str(countdown_value), k, countdown_step())
+    
+    # Перевод в RGB и подготовка PIL-изображения — в рабочем потоке, а не в Tk
+    preview_slot.put(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), captured_at)
 
 def update_preview():
-    global cap, preview_running
-    if cap and cap.isOpened():
-        cap.release()
-    cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    if not cap.isOpened():
+    global preview_running, preview_generation
+    rot = settings.rotation
+    # Камера 1920x1080: после поворота на 90° ширина кадра — 1080
+    if rot in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+        opened = camera.open(30, 1080, 1920, rot)
+    else:
+        opened = camera.open(30, 1920, 1080, rot)
+    if not opened:
         print("Failed to open camera for preview.")
         return
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
     preview_running = True
-    threading.Thread(target=process_frames, daemon=True).start()
+    preview_generation += 1
+    generation = preview_generation
+    preview_slot.clear()
+    preview_stats_window.update(start=time.monotonic(), frames=0, age_sum=0.0, dropped=preview_slot.dropped)
+    threading.Thread(target=process_frames, args=(generation,), daemon=True).start()
     
     def loop():
-        if not preview_running:
+        if not preview_running or generation != preview_generation:
             return
-        try:
-            frame = preview_queue.get_nowait()
-            preview_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            imgtk = ImageTk.PhotoImage(Image.fromarray(preview_rgb))
-            preview_label.imgtk = imgtk
-            preview_label.config(image=imgtk)
+        item = preview_slot.take()
+        if item is not None:
+            image, captured_at = item
+            preview_surface.show(image)
             if photo_session_active:
                 photo_counter_label.config(text=f"{current_photo + 1}/4")
             else:
                 photo_counter_label.config(text="")
-        except queue.Empty:
-            pass
-        preview_label.after(33, loop)
+            record_preview_frame(captured_at)
+        preview_label.after(15, loop)
     loop()
 
 def stop_preview():
-    global cap, preview_running
+    global preview_running
     preview_running = False
-    if cap and cap.isOpened():
-        cap.release()
-        cap = None
-    preview_label.config(image='')
+    preview_surface.clear()
     photo_counter_label.config(text="")
 
 def start_countdown(sec, callback):
-    global countdown_value
+    global countdown_value, countdown_target
     print(f"Starting countdown for photo {current_photo + 1}")
     def tick(n):
-        global countdown_value
+        global countdown_value, countdown_changed_at
         countdown_value = n
+        countdown_changed_at = time.monotonic()
         print(f"Countdown: {countdown_value}")
         if n > 0:
             window.after(1000, lambda: tick(n-1))
         else:
-            countdown_value = None
             callback()
     
+    # Снимок — в момент появления «0»; «0» остаётся на экране, пока снимок не
+    # сделан, и убирается finish_still()
     countdown_value = sec
+    countdown_target = time.monotonic() + sec
     tick(sec)
 
-def capture_photo():
-    global cap, mirror_mode
-    if not (cap and cap.isOpened()):
+def finish_still():
+    # Снимок сделан: «0» убирается с экрана, цель сбрасывается до следующего отсчёта
+    global countdown_value, countdown_target
+    countdown_value = None
+    countdown_target = None
+
+def capture_photo(snapshot):
+    if not camera.is_open():
         print("Camera not available")
         return None
     
-    ret, frame = cap.read()
-    if not ret:
+    target = countdown_target if countdown_target is not None else time.monotonic()
+    latest = camera.frame_at(target)
+    finish_still()
+    if latest is None:
         print("Failed to capture photo")
         return None
-    
-    rot = ROTATION_OPTIONS[selected_rotation.get()]
-    if rot is not None:
-        frame = cv2.rotate(frame, rot)
-    
-    # Применяем зеркальное отображение к захваченному фото
-    if mirror_mode:
-        frame = cv2.flip(frame, 1)
-    
-    return frame
+    frame, captured_at = latest
+    record_shutter_lag(target, captured_at)
+    return prepare_still(frame, snapshot)
+
+def prepare_still(frame, snapshot):
+    # Поворот и зеркальное отображение захваченного фото одним проходом; геометрия —
+    # из снимка настроек сессии, чтобы все кадры коллажа были одинаковыми
+    return apply_geometry(frame, snapshot.rotation, mirror=snapshot.mirror)
+
+# Серийная съёмка: несколько кадров вокруг момента снимка оцениваются на уменьшенных
+# копиях (резкость — дисперсия лапласиана, открытые глаза — каскады Хаара) в фоновом
+# потоке с ограничением по времени, в снимок идёт лучший
+BURST_FRAMES = 5
+BURST_SCORE_WIDTH = 320
+BURST_SCORE_BUDGET = 0.25  # секунд на оценку одной серии
+burst_executor = ThreadPoolExecutor(max_workers=1)
+burst_cascades = {}
+
+def get_burst_cascades():
+    # Каскады грузятся один раз и используются только потоком burst_executor
+    if not burst_cascades:
+        base = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        face = cv2.CascadeClassifier(os.path.join(base, "haarcascade_frontalface_default.xml"))
+        eye = cv2.CascadeClassifier(os.path.join(base, "haarcascade_eye_tree_eyeglasses.xml"))
+        if face.empty() or eye.empty():
+            print("Haar cascades not found, burst frames are scored by sharpness only.")
+            face = eye = None
+        burst_cascades.update(face=face, eye=eye)
+    return burst_cascades["face"], burst_cascades["eye"]
+
+def score_burst_frame(frame, rotation):
+    small = apply_geometry(frame, rotation, BURST_SCORE_WIDTH)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    face_cascade, eye_cascade = get_burst_cascades()
+    eyes_open = 0
+    if face_cascade is not None:
+        for x, y, w, h in face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(32, 32)):
+            # Глаза ищутся только в верхней половине лица
+            eyes = eye_cascade.detectMultiScale(gray[y:y + h // 2, x:x + w], 1.1, 3)
+            eyes_open += min(len(eyes), 2)
+    return eyes_open, sharpness
+
+def select_best_frame(frames, target_ts, rotation, budget=BURST_SCORE_BUDGET):
+    # Кадры оцениваются от ближайшего к моменту снимка; когда бюджет исчерпан,
+    # остальные пропускаются и лучший выбирается из уже оценённых
+    started = time.monotonic()
+    best, best_score, scored = None, None, 0
+    for item in sorted(frames, key=lambda item: abs(item[1] - target_ts)):
+        if scored and time.monotonic() - started > budget:
+            break
+        score = score_burst_frame(item[0], rotation)
+        scored += 1
+        if best_score is None or score > best_score:
+            best, best_score = item, score
+    return best, best_score, scored, (time.monotonic() - started) * 1000
+
+def capture_burst(done, snapshot):
+    # Кадры после момента снимка дожидаются через window.after, оценка идёт
+    # в burst_executor, done(photo) вызывается в потоке Tk
+    fired_at = time.monotonic()
+    target = countdown_target if countdown_target is not None else fired_at
+    rotation = snapshot.rotation
+    def finish(photo):
+        finish_still()
+        done(photo)
+    deadline = target + (BURST_FRAMES // 2 + 1) / (camera.fps or 30) + 0.2
+    def collect():
+        frames = camera.frames_around(target, BURST_FRAMES)
+        later = sum(1 for _, ts in frames if ts > target)
+        if later < BURST_FRAMES // 2 and time.monotonic() < deadline:
+            window.after(10, collect)
+            return
+        if not frames:
+            print("Failed to capture burst.")
+            finish(None)
+            return
+        wait(burst_executor.submit(select_best_frame, frames, target, rotation), len(frames))
+    def wait(future, count):
+        if not future.done():
+            window.after(10, lambda: wait(future, count))
+            return
+        try:
+            (frame, captured_at), (eyes, sharpness), scored, elapsed_ms = future.result()
+        except Exception as e:
+            print(f"Burst scoring failed: {e}")
+            finish(None)
+            return
+        print(f"Burst: scored {scored}/{count} frames in {elapsed_ms:.0f} ms, best at "
+              f"{(captured_at - target) * 1000:+.0f} ms (eyes {eyes}, sharpness {sharpness:.0f})")
+        record_shutter_lag(target, captured_at, fired_at)
+        finish(prepare_still(frame, snapshot))
+    collect()
+
 
 def take_next_photo():
     global current_photo, captured_photos, photo_session_active
@@ -407,11 +1581,15 @@ def take_next_photo():
     
     print(f"Taking photo {current_photo + 1}/4")
     
-    def capture_callback():
-        global current_photo, captured_photos
-        photo = capture_photo()
+    def store(photo):
+        global current_photo, captured_photos, last_shot_at
         if photo is not None:
+            last_shot_at = time.monotonic()
             captured_photos.append(photo)
+            if len(photo_positions) == 4:
+                # Ячейка коллажа готовится в фоне, пока идёт следующий отсчёт
+                collage_cells.append(collage_executor.submit(make_collage_cell, photo, len(captured_photos) - 1,
+                                                             get_collage_layout()))
             current_photo += 1
             print(f"Captured photo {current_photo}/4")
             if current_photo < 4:
@@ -419,66 +1597,331 @@ def take_next_photo():
             else:
                 finalize_photo_session()
     
+    def capture_callback():
+        if session_settings.burst:
+            capture_burst(store, session_settings)
+        else:
+            store(capture_photo(session_settings))
+    
     start_countdown(3, capture_callback)
 
 def start_photo_session():
-    global current_photo, captured_photos, photo_session_active
+    global current_photo, captured_photos, photo_session_active, session_settings
     
+    session_settings = settings  # настройки фиксируются на всю сессию
     current_photo = 0
     captured_photos = []
+    collage_cells.clear()
     photo_session_active = True
     
     btn_start.config(state=tk.DISABLED)
     print("Starting photo session")
     take_next_photo()
 
-def create_final_collage():
+# Раскладка коллажа описывается декларативно (LayoutSpec) и компилируется один раз
+# в прямоугольники ячеек, цели масштабирования и готовые тайлы рамки/шаблона.
+# Скомпилированные раскладки кэшируются по (спецификация, хэш рамки): размер
+# результата входит в спецификацию. Сборка коллажа — только копирования и смешивания.
+#   size            — (ширина, высота) результата
+#   cells           — (x, y, ширина, высота) окна каждой фотографии
+#   fit             — "contain": фото целиком по центру окна; "cover": обрезка по пропорции окна
+#   crop_top        — доля высоты, срезаемая сверху перед вписыванием
+#   background      — "black", "white" или "template" (сама рамка-шаблон)
+#   overlay_scope   — None, "cell", "column", "canvas" или "template" (шаблон поверх фото в окне)
+#   weighted_overlay — рамку без альфы смешивать с весами 0.7/0.3, а не пропускать
+LayoutSpec = namedtuple("LayoutSpec", ["size", "cells", "fit", "crop_top", "background",
+                                       "overlay_scope", "weighted_overlay"])
+COMPILED_LAYOUTS_MAX = 16
+compiled_layouts = {}
+compiled_layouts_lock = threading.Lock()
+
+def image_hash(image):
+    if image is None:
+        return None
+    return hashlib.sha1(str(image.shape).encode() + image.tobytes()).hexdigest()
+
+def grid_cells(count, cols, size, edge, top, bottom, spacing_x, spacing_y, column_major=False):
+    # Равные окна сетки с отступами по краям, сверху, снизу и между окнами
+    width, height = size
+    rows = -(-count // cols)
+    cell_w = (width - edge * 2 - (cols - 1) * spacing_x) // cols
+    cell_h = (height - top - bottom - (rows - 1) * spacing_y) // rows
+    cells = []
+    for i in range(count):
+        row, col = (i % rows, i // rows) if column_major else (i // cols, i % cols)
+        cells.append((edge + col * (cell_w + spacing_x), top + row * (cell_h + spacing_y), cell_w, cell_h))
+    return tuple(cells)
+
+class CompiledLayout:
+    def __init__(self, spec, overlay):
+        self.spec = spec
+        self.overlay = overlay
+        width, height = spec.size
+        if spec.background == "template" and overlay is not None:
+            self.background = overlay.copy()
+        else:
+            self.background = np.full((height, width, 3), 255 if spec.background == "white" else 0, dtype=np.uint8)
+        self.rects = []  # (x, y, ширина, высота, premul, inv) — рамка поверх готового коллажа
+        self._cells = {}
+        if overlay is None:
+            return
+        alpha = overlay.shape[2] == 4
+        if spec.overlay_scope == "canvas" and (alpha or spec.weighted_overlay):
+            self.rects.append((0, 0, width, height) + premultiply(cv2.resize(overlay, (width, height))))
+        elif spec.overlay_scope == "column" and alpha:
+            # Столбец — от верхнего окна до низа коллажа
+            top = min(y for _, y, _, _ in spec.cells)
+            for x, w in sorted({(x, w) for x, _, w, _ in spec.cells}):
+                if x + w <= width:
+                    self.rects.append((x, top, w, height - top) +
+                                      premultiply(cv2.resize(overlay, (w, height - top))))
+
+    def _plan_cell(self, index, src_w, src_h):
+        spec = self.spec
+        width, height = spec.size
+        x, y, w, h = spec.cells[index]
+        if spec.fit == "cover":
+            target_aspect = w / h
+            if src_w / src_h > target_aspect:
+                new_width = int(src_h * target_aspect)
+                offset = (src_w - new_width) // 2
+                crop = (0, src_h, offset, offset + new_width)
+            else:
+                new_height = int(src_w / target_aspect)
+                offset = (src_h - new_height) // 2
+                crop = (offset, offset + new_height, 0, src_w)
+            size, dest = (w, h), (x, y)
+        else:
+            top = int(src_h * spec.crop_top)
+            crop = (top, src_h, 0, src_w)
+            scale = min(w / src_w, h / (src_h - top))
+            size = (int(src_w * scale), int((src_h - top) * scale))
+            dest = (x + (w - size[0]) // 2, y + (h - size[1]) // 2)
+        dx, dy = dest
+        if dx < 0 or dy < 0 or dx + size[0] > width or dy + size[1] > height:
+            return None
+        blend = None
+        if self.overlay is not None and self.overlay.shape[2] == 4:
+            if spec.overlay_scope == "cell":
+                blend = premultiply(cv2.resize(self.overlay, size))
+            elif spec.overlay_scope == "template":
+                blend = premultiply(self.overlay[dy:dy + size[1], dx:dx + size[0]])
+        return crop, size, dest, blend
+
+    def render_cell(self, index, photo):
+        # Одна фотография в своё окно; (тайл, x, y) или None, если окно вне коллажа
+        key = (index,) + photo.shape[:2]
+        if key not in self._cells:
+            self._cells[key] = self._plan_cell(index, photo.shape[1], photo.shape[0])
+        plan = self._cells[key]
+        if plan is None:
+            return None
+        (y0, y1, x0, x1), size, (x, y), blend = plan
+        crop = photo[y0:y1, x0:x1]
+        tile = cv2.resize(crop, size) if (x1 - x0, y1 - y0) != size else crop.copy()
+        if blend is not None:
+            blend_into(tile, *blend)
+        return tile, x, y
+
+    def compose(self, cells):
+        image = self.background.copy()
+        for cell in cells:
+            if cell is not None:
+                tile, x, y = cell
+                h, w = tile.shape[:2]
+                image[y:y + h, x:x + w, :3] = tile
+        for x, y, w, h, premul, inv in self.rects:
+            blend_into(image[y:y + h, x:x + w], premul, inv)
+        return image
+
+def get_compiled_layout(spec, overlay, overlay_hash):
+    key = (spec, overlay_hash)
+    with compiled_layouts_lock:
+        layout = compiled_layouts.get(key)
+    if layout is None:
+        started = time.perf_counter()
+        layout = CompiledLayout(spec, overlay)
+        with compiled_layouts_lock:
+            if len(compiled_layouts) >= COMPILED_LAYOUTS_MAX:
+                compiled_layouts.pop(next(iter(compiled_layouts)))
+            compiled_layouts[key] = layout
+        print(f"Collage layout compiled in {(time.perf_counter() - started) * 1000:.0f} ms "
+              f"({len(spec.cells)} cells, {spec.size[0]}x{spec.size[1]})")
+    return layout
+
+# Коллаж собирается по ячейкам: каждая фотография обрезается, масштабируется и
+# смешивается с окном шаблона в фоне сразу после снимка, пока идёт следующий
+# отсчёт; в конце остаются только копирование ячеек в шаблон и запись файла
+collage_executor = ThreadPoolExecutor(max_workers=2)
+collage_cells = []  # Future на каждую снятую фотографию текущей сессии
+last_shot_at = None
+
+def collage_layout_spec():
+    # Окна шаблона: фото обрезается по пропорции окна, шаблон с альфой лежит поверх
+    cells = tuple(tuple(int(v) for v in position) for position in photo_positions)
+    if frame_template_cv is None:
+        return LayoutSpec((FRAME_WIDTH, FRAME_HEIGHT), cells, "cover", 0.0, "white", None, False)
+    h, w = frame_template_cv.shape[:2]
+    return LayoutSpec((w, h), cells, "cover", 0.0, "template", "template", False)
+
+def get_collage_layout():
+    return get_compiled_layout(collage_layout_spec(), frame_template_cv, frame_template_hash)
+
+def make_collage_cell(photo, index, layout):
+    return layout.render_cell(index, photo)
+
+def create_final_collage(cells=None):
     global captured_photos, frame_template_cv, photo_positions, mirror_mode
     
     if len(captured_photos) != 4:
         print(f"Not enough photos: {len(captured_photos)}/4")
         return None
     
-    if frame_template_cv is None:
-        final_image = np.ones((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8) * 255
-    else:
-        final_image = frame_template_cv.copy()
-    
     if len(photo_positions) != 4:
         print("Photo positions not set properly")
         return None
     
-    for i, (photo, (x, y, w, h)) in enumerate(zip(captured_photos, photo_positions)):
-        ph, pw = photo.shape[:2]
-        target_aspect = w / h
-        current_aspect = pw / ph
-        
-        if current_aspect > target_aspect:
-            new_width = int(ph * target_aspect)
-            offset = (pw - new_width) // 2
-            cropped_photo = photo[:, offset:offset + new_width]
-        else:
-            new_height = int(pw / target_aspect)
-            offset = (ph - new_height) // 2
-            cropped_photo = photo[offset:offset + new_height, :]
-        
-        resized_photo = cv2.resize(cropped_photo, (w, h))
-        
-        if x + w <= final_image.shape[1] and y + h <= final_image.shape[0]:
-            if frame_template_cv is not None and frame_template_cv.shape[2] == 4:
-                alpha_region = frame_template_cv[y:y+h, x:x+w, 3] / 255.0
-                for c in range(3):
-                    final_image[y:y+h, x:x+w, c] = \
-                        (1 - alpha_region) * resized_photo[:, :, c] + \
-                        alpha_region * final_image[y:y+h, x:x+w, c]
-            else:
-                final_image[y:y+h, x:x+w] = resized_photo
+    layout = get_collage_layout()
+    if cells is None:
+        cells = [layout.render_cell(i, photo) for i, photo in enumerate(captured_photos)]
     
     # Убрано зеркальное отображение итогового коллажа, так как фото уже отзеркалены на этапе захвата
-    return final_image
+    return layout.compose(cells)
+
+# Артефакт сессии несёт декодированный массив, закодированные байты и путь к
+# файлу. Недостающее представление получается лениво из того, что уже есть,
+# поэтому каждый артефакт пишется на диск и читается с него не больше одного
+# раза. SessionIO считает прочитанные и записанные байты за сессию
+class SessionIO:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def read(self, path):
+        with open(path, "rb") as fh:
+            data = fh.read()
+        self.count(read=len(data))
+        return data
+
+    def write(self, path, data):
+        with open(path, "wb") as fh:
+            fh.write(data)
+        self.count(written=len(data))
+
+    def count(self, read=0, written=0):
+        with self.lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def summary(self):
+        return f"read {self.bytes_read // 1024} KB, written {self.bytes_written // 1024} KB"
+
+class SessionArtifact:
+    def __init__(self, session_io, path=None, image=None, data=None, profile=None):
+        self.session_io = session_io
+        self.path = path
+        self.profile = profile
+        self._image = image
+        self._data = data
+        self._on_disk = image is None and data is None and path is not None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            if self._image is not None:
+                ok, buf = cv2.imencode(self.profile.ext, self._image, self.profile.params)
+                if not ok:
+                    raise RuntimeError(f"{self.profile.ext} encoding failed")
+                self._data = buf.tobytes()
+            else:
+                self._data = self.session_io.read(self.path)
+        return self._data
+
+    def image(self):
+        with self.lock:
+            if self._image is None:
+                self._image = cv2.imdecode(np.frombuffer(self._load(), np.uint8), cv2.IMREAD_UNCHANGED)
+            return self._image
+
+    def data(self):
+        with self.lock:
+            return self._load()
+
+    def materialize(self):
+        # Путь к файлу на диске; файл пишется при первом обращении
+        with self.lock:
+            if not self._on_disk:
+                self.session_io.write(self.path, self._load())
+                self._on_disk = True
+            return self.path
+
+# Рендишены результата: из коллажа в памяти за один проход получаются печатный
+# мастер в полном разрешении, уменьшенная копия для ссылки по QR и миниатюра
+# для экрана результата. Масштабирование и кодирование идут в encode_executor,
+# каждый потребитель получает только свой рендишен — файлы повторно не читаются
+EncoderProfile = namedtuple("EncoderProfile", ["ext", "mimetype", "params"])
+ENCODER_PROFILES = {
+    "jpeg": EncoderProfile(".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 95, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+    "jpeg_share": EncoderProfile(".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+    "png": EncoderProfile(".png", "image/png", [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+    "webp": EncoderProfile(".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 90]),
+}
+# profile — имя в ENCODER_PROFILES (None — рендишен только в памяти),
+# width — ширина (None — полное разрешение), suffix — добавка к имени файла,
+# save — записать файл сразу (иначе только по materialize())
+Rendition = namedtuple("Rendition", ["profile", "width", "suffix", "save"])
+RENDITIONS = {
+    "print": Rendition("jpeg", None, "", True),
+    "share": Rendition("jpeg_share", 800, "_share", False),
+    # Экран результата показывает коллаж высотой 1600
+    "thumbnail": Rendition(None, FRAME_WIDTH * 1600 // FRAME_HEIGHT, None, False),
+}
+encode_executor = ThreadPoolExecutor(max_workers=2)
+
+def resize_to_width(image, width):
+    h, w = image.shape[:2]
+    if width is None or w <= width:
+        return image
+    return cv2.resize(image, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+
+def render_output(image, base_path, rendition, session_io):
+    image = resize_to_width(image, rendition.width)
+    if rendition.profile is None:
+        return SessionArtifact(session_io, image=image)
+    profile = ENCODER_PROFILES[rendition.profile]
+    artifact = SessionArtifact(session_io, base_path + rendition.suffix + profile.ext, image, profile=profile)
+    artifact.data()  # Кодирование — здесь, в рабочем потоке
+    if rendition.save:
+        artifact.materialize()
+    return artifact
+
+def render_outputs(image, base_path, session_io, done):
+    # Одинаковые рендишены считаются один раз, даже если нужны нескольким назначениям;
+    # done({назначение: SessionArtifact}) или done(None) вызывается в потоке Tk
+    started = time.monotonic()
+    jobs = {}
+    for rendition in RENDITIONS.values():
+        if rendition not in jobs:
+            jobs[rendition] = encode_executor.submit(render_output, image, base_path, rendition, session_io)
+    def wait():
+        if not all(job.done() for job in jobs.values()):
+            window.after(10, wait)
+            return
+        try:
+            outputs = {purpose: jobs[rendition].result() for purpose, rendition in RENDITIONS.items()}
+        except Exception as e:
+            print(f"Failed to save result: {e}")
+            done(None)
+            return
+        sizes = ", ".join(f"{os.path.basename(job.result().path)} {len(job.result().data()) // 1024} KB"
+                          for job in jobs.values() if job.result().path)
+        print(f"Rendered {sizes} in {(time.monotonic() - started) * 1000:.0f} ms")
+        done(outputs)
+    wait()
 
 def finalize_photo_session():
-    global photo_session_active, last_uni_folder_id, current_photo, captured_photos
+    global photo_session_active, current_photo, captured_photos
     
     photo_session_active = False
     btn_start.config(state=tk.NORMAL)
@@ -489,31 +1932,39 @@ def finalize_photo_session():
         show_main_page()
         return
     
-    final_collage = create_final_collage()
+    final_collage = create_final_collage([cell.result() for cell in collage_cells])
     if final_collage is None:
         print("Failed to create collage")
         show_main_page()
         return
     
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"collage_{timestamp}.jpg"
-    filepath = os.path.join(SAVE_DIR, filename)
-    
-    cv2.imwrite(filepath, final_collage)
-    print(f"Collage saved: {filepath}")
+    name = f"collage_{timestamp}"
+    session_io = SessionIO()
+    render_outputs(final_collage, os.path.join(SAVE_DIR, name), session_io,
+                   lambda outputs: publish_collage(outputs, name, session_io))
+
+def publish_collage(outputs, name, session_io):
+    if outputs is None:
+        show_main_page()
+        return
+    filepath = outputs["print"].path
+    print(f"Collage saved: {filepath} {(time.monotonic() - last_shot_at) * 1000:.0f} ms after the last shot")
     
     ev_id = event_ids.get(selected_event.get())
     if ev_id:
-        qr, url, uni_id = upload_to_drive(
-            filepath, f"collage_{timestamp}",
-            ev_id, reuse_last=reuse_var.get(), last_folder_id=last_uni_folder_id
-        )
-        if qr is not None:
-            last_uni_folder_id = uni_id
-            show_result_page(filepath, qr)
-        else:
-            print("Failed to upload to Google Drive.")
-            show_main_page()
+        folder_id, claim_name = claim_share_folder(reuse_var.get())
+        def uploaded(job):
+            print(f"Session I/O: {session_io.summary()}")
+            if job.state != "done":
+                print("Failed to upload to Google Drive.")
+            if folder_id is None and result_path == filepath and result_page.winfo_ismapped():
+                show_result_qr(job.result[0])
+        upload_service.submit(name, filepath, name, ev_id, reuse_var.get(), uploaded,
+                              encoded=outputs["print"], share=outputs["share"],
+                              folder_id=folder_id, claim_name=claim_name)
+        show_result_page(filepath, folder_qr(folder_id) if folder_id else None, outputs["thumbnail"].image())
+        print(f"Result shown {(time.monotonic() - last_shot_at) * 1000:.0f} ms after the last shot")
     else:
         print("Event not selected.")
         show_main_page()
@@ -528,25 +1979,28 @@ def print_image(filepath):
     except Exception as e:
         messagebox.showerror("Ошибка печати", f"Не удалось отправить на печать: {e}")
 
-def show_result_page(image_path, qr_img):
+def show_result_page(image_path, qr_img, img=None):
+    global result_path
+    stop_preview()
     settings_page.pack_forget()
     main_page.pack_forget()
     result_page.pack(fill=tk.BOTH, expand=True)
     
     for widget in result_page.winfo_children():
         widget.destroy()
+    result_path = image_path
     
     try:
-        img = cv2.imread(image_path)
+        if img is None:
+            # Рендишен thumbnail уже уменьшен из мастера; масштабируется только файл с диска
+            img = cv2.imread(image_path)
+            if img is not None:
+                h, w = img.shape[:2]
+                max_height = 1600
+                img = cv2.resize(img, (int(w * max_height / h), max_height), interpolation=cv2.INTER_AREA)
         if img is not None:
-            h, w = img.shape[:2]
-            max_height = 1600
-            scale = max_height / h
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            
-            img_resized = cv2.resize(img, (new_w, new_h))
-            img_rgb = cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB)
+            img = img[:, :, :3]
+            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
             img_pil = Image.fromarray(img_rgb)
             img_tk = ImageTk.PhotoImage(img_pil)
             
@@ -565,19 +2019,28 @@ def show_result_page(image_path, qr_img):
     back_button.pack(pady=10)
     
     if qr_img:
-        try:
-            qr_img_resized = qr_img.resize((200, 200))
-            qr_tk = ImageTk.PhotoImage(qr_img_resized)
-            qr_label = tk.Label(result_page, image=qr_tk, bg="#000000")
-            qr_label.image = qr_tk
-            qr_label.pack(pady=10)
-        except Exception as e:
-            print(f"Error displaying QR code: {e}")
+        show_result_qr(qr_img)
+
+def show_result_qr(qr_img):
+    # QR добавляется, когда закончилась фоновая загрузка; None — загрузка не удалась
+    if qr_img is None:
+        tk.Label(result_page, text="QR-код недоступен", fg="#FFFFFF", bg="#000000",
+                 font=("Arial", 16)).pack(pady=10)
+        return
+    try:
+        qr_img_resized = qr_img.resize((200, 200))
+        qr_tk = ImageTk.PhotoImage(qr_img_resized)
+        qr_label = tk.Label(result_page, image=qr_tk, bg="#000000")
+        qr_label.image = qr_tk
+        qr_label.pack(pady=10)
+    except Exception as e:
+        print(f"Error displaying QR code: {e}")
 
 def show_settings_page():
     global preview_running
     preview_running = False
     stop_preview()
+    camera.close()
     main_page.pack_forget()
     result_page.pack_forget()
     settings_page.pack(fill=tk.BOTH, expand=True)
@@ -614,6 +2077,11 @@ selected_rotation = tk.StringVar(window, value="90° вправо (вертик
 selected_event = tk.StringVar(window)
 event_ids = {}
 reuse_var = tk.BooleanVar(window, value=False)
+burst_var = tk.BooleanVar(window, value=False)
+
+for var in (selected_rotation, burst_var):
+    var.trace_add("write", on_settings_var_changed)
+on_settings_var_changed()
 
 settings_page = tk.Frame(window, bg="#000000")
 main_page = tk.Frame(window, bg="#000000")
@@ -664,9 +2132,16 @@ mirror_button = ttk.Button(settings_page, text="🔄 Отзеркалить (В
                            style="Custom.TButton", command=toggle_mirror_mode)
 mirror_button.pack(pady=15)
 
+tk.Checkbutton(settings_page, text="Серия кадров (выбрать лучший)", 
+               variable=burst_var, font=("Helvetica", 24), 
+               fg="white", bg="#000000", selectcolor="#000000").pack(pady=15)
+
 ttk.Button(settings_page, text="Полный экран", 
            style="Custom.TButton", command=toggle_fullscreen).pack(pady=20)
 
+outbox_label = tk.Label(settings_page, text="", font=("Helvetica", 18), fg="white", bg="#000000")
+outbox_label.pack(pady=10)
+
 ttk.Button(settings_page, text="▶ ЗАПУСТИТЬ ФОТОБУДКУ", 
            style="Custom.TButton", command=show_main_page).pack(pady=40)
 
@@ -687,6 +2162,8 @@ photo_counter_label = tk.Label(main_page, text="", font=("Helvetica", 40),
 photo_counter_label.pack(pady=10)
 
 preview_label = tk.Label(main_page, bg="#000000")
+preview_surface = DisplaySurface(preview_label)
+preview_label.bind("<Configure>", on_preview_configure)
 preview_label.place(relx=0.5, rely=0.55, anchor="center", relwidth=1.0, relheight=0.75)
 
 btn_start = ttk.Button(main_page, text="📸 НАЧАТЬ ФОТОСЕССИЮ", 
@@ -712,5 +2189,106 @@ def on_new_event():
 
 refresh_events()
 
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__[len("benchmark_"):]] = func
+    return func
+
+def time_ms(func, repeat=50):
+    func()  # прогрев
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+@benchmark
+def benchmark_burst():
+    # Оценка серии из BURST_FRAMES кадров 1200x1800 без ограничения по времени
+    frames = [(np.random.randint(0, 256, (1800, 1200, 3), dtype=np.uint8), i / 30) for i in range(BURST_FRAMES)]
+    get_burst_cascades()  # загрузка каскадов в замер не входит
+    cost = time_ms(lambda: select_best_frame(frames, 0.0, None, budget=float("inf")), repeat=10)
+    print(f"burst: {cost:.1f} ms per burst of {BURST_FRAMES} frames at 1200x1800 "
+          f"({cost / BURST_FRAMES:.1f} ms/frame, budget {BURST_SCORE_BUDGET * 1000:.0f} ms)")
+
+@benchmark
+def benchmark_blend():
+    # Фото под окном шаблона: прежний поканальный float-цикл против blend_into
+    width, height = FRAME_WIDTH // 2, FRAME_HEIGHT // 2
+    photo = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    window_region = np.random.randint(0, 256, (height, width, 4), dtype=np.uint8)
+    def legacy():
+        result = window_region[:, :, :3].copy()
+        alpha_region = window_region[:, :, 3] / 255.0
+        for c in range(3):
+            result[:, :, c] = (1 - alpha_region) * photo[:, :, c] + alpha_region * result[:, :, c]
+        return result
+    def fixed():
+        return blend_into(photo.copy(), *premultiply(window_region))
+    diff = np.abs(legacy().astype(np.int16) - fixed()).max()
+    print(f"blend template window {width}x{height}: float loop {time_ms(legacy, 20):.2f} ms, "
+          f"fixed point {time_ms(fixed, 20):.2f} ms (max diff {diff} LSB)")
+
+@benchmark
+def benchmark_windows():
+    # Поиск окон в шаблоне с альфой: уменьшенная маска + уточнение против
+    # компонент в полном разрешении
+    template = np.full((FRAME_HEIGHT, FRAME_WIDTH, 4), 255, dtype=np.uint8)
+    expected = [(60, 80, 500, 700), (640, 80, 500, 700), (60, 900, 500, 700), (640, 900, 500, 700)]
+    for x, y, w, h in expected:
+        template[y:y+h, x:x+w, 3] = 0
+    def full_res():
+        mask = template_window_mask(template)
+        num, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        return [tuple(int(v) for v in stats[i][:4]) for i in range(1, num)]
+    found = detect_template_windows(template)
+    print(f"template windows {FRAME_WIDTH}x{FRAME_HEIGHT}: full res {time_ms(full_res, 10):.2f} ms, "
+          f"downscaled {time_ms(lambda: detect_template_windows(template), 10):.2f} ms "
+          f"(exact {found == expected})")
+
+@benchmark
+def benchmark_editor():
+    # Один шаг перетаскивания: прежняя полная перерисовка шаблона 1200x1800
+    # против перерисовки грязных областей на экранной копии
+    template = np.random.randint(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 4), dtype=np.uint8)
+    positions = [(60, 80, 500, 700), (640, 80, 500, 700), (60, 900, 500, 700), (640, 900, 500, 700)]
+    def full():
+        temp_img = template.copy()
+        for i, position in enumerate(positions):
+            draw_position(temp_img, i, position)
+        return temp_img
+    proxy, scale = editor_proxy(template)
+    canvas = proxy.copy()
+    drawn = []
+    step = [0]
+    def dirty():
+        step[0] = (step[0] + 1) % 20
+        x, y, w, h = positions[0]
+        rects = [tuple(int(v * scale) for v in (x + step[0], y + step[0], w, h))]
+        rects += [tuple(int(v * scale) for v in position) for position in positions[1:]]
+        redraw_editor(canvas, proxy, drawn, rects)
+    print(f"editor drag step: full redraw {time_ms(full, 20):.2f} ms, "
+          f"dirty rects on {proxy.shape[1]}x{proxy.shape[0]} proxy {time_ms(dirty, 20):.2f} ms")
+
+@benchmark
+def benchmark_encode():
+    # Кодирование коллажа 1200x1800 каждым профилем; на шумном кадре размеры
+    # завышены, но соотношение времени между профилями сохраняется
+    image = cv2.GaussianBlur(np.random.randint(0, 256, (1800, 1200, 3), dtype=np.uint8), (0, 0), 3)
+    for name, profile in ENCODER_PROFILES.items():
+        size = len(cv2.imencode(profile.ext, image, profile.params)[1])
+        elapsed = time_ms(lambda: cv2.imencode(profile.ext, image, profile.params), 5)
+        print(f"encode {name}: {elapsed:.1f} ms, {size // 1024} KB")
+
+def run_benchmarks(names):
+    for name in names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
 if __name__ == "__main__":
-    window.mainloop()
\ No newline at end of file
+    if "--benchmark" in sys.argv:
+        run_benchmarks(sys.argv[sys.argv.index("--benchmark") + 1:])
+    else:
+        outbox.start()  # до пула: пул сверяет выданные папки с журналом
+        folder_pool.start()
+        update_outbox_status()
+        window.mainloop()
\ No newline at end of file
@@ -9,14 +9,27 @@ import numpy as np
 from PIL import Image, ImageTk
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import queue
+from google.auth.transport.requests import AuthorizedSession
+import requests
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
 import threading
 import time
-import sounddevice as sd
-import soundfile as sf
+import json
+import sqlite3
+import sys
+import atexit
+from multiprocessing import shared_memory
 import subprocess
-import vlc
+
+# Процесс композитора (--compositor) исполняет этот же файл до своей ветки ниже.
+# Ему нужны только кадры и настройки превью, поэтому звук, VLC, Drive и
+# обработчики выхода интерфейса в нём не инициализируются
+COMPOSITOR_CHILD = "--compositor" in sys.argv
+if not COMPOSITOR_CHILD:
+    import sounddevice as sd
+    import soundfile as sf
+    import vlc
 
 # Google Drive config
 SERVICE_ACCOUNT_FILE = 'photoboothproject-459010-c725b2899f7f.json'
@@ -24,13 +37,41 @@ SCOPES = ['https://www.googleapis.com/auth/drive']
 EVENTS_FOLDER_ID = '1oHDqcrZnRcnNCDwGsifDSGVQZjYqtf1S'
 UNIVERSAL_FOLDER_ID = '1FR92J38OPdLZoCaKKZ6lW7EucdGtG624'
 
-try:
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    drive_service = build('drive', 'v3', credentials=credentials)
-except Exception as e:
-    drive_service = None
-    print(f"Failed to initialize Google Drive service: {e}")
+credentials = None
+drive_service = None
+drive_http = None
+if not COMPOSITOR_CHILD:
+    try:
+        credentials = service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+        drive_service = build('drive', 'v3', credentials=credentials)
+        drive_http = AuthorizedSession(credentials)  # Для возобновляемой загрузки
+    except Exception as e:
+        drive_service = None
+        drive_http = None
+        print(f"Failed to initialize Google Drive service: {e}")
+
+# Клиент Drive держит один httplib2.Http, который нельзя делить между потоками.
+# Поток Tk пользуется drive_service, каждый фоновый поток (загрузки, пул папок,
+# журнал) — собственным клиентом на тех же учётных данных
+drive_local = threading.local()
+
+def drive():
+    if threading.current_thread() is threading.main_thread():
+        return drive_service
+    client = getattr(drive_local, "service", None)
+    if client is None:
+        client = drive_local.service = build('drive', 'v3', credentials=credentials, cache_discovery=False)
+    return client
+
+def drive_session():
+    # То же для HTTP-сессии возобновляемой загрузки
+    if threading.current_thread() is threading.main_thread():
+        return drive_http
+    session = getattr(drive_local, "http", None)
+    if session is None:
+        session = drive_local.http = AuthorizedSession(credentials)
+    return session
 
 SAVE_DIR = os.path.abspath("recordings")
 os.makedirs(SAVE_DIR, exist_ok=True)
@@ -39,14 +80,14 @@ DEVICE_NAME = "EOS Webcam Utility"
 camera_index = 0
 overlay_image_path = None
 overlay_image_cv = None
-cap = None
 preview_running = False
+preview_generation = 0
 video_loop_active = False
 video_loop_cap = None
 recording = False
 out = None
 recording_filename = None
-last_uni_folder_id = None
+result_path = None  # Файл, который сейчас показан на экране результата
 countdown_value = None
 audio_path = None
 audio_thread = None
@@ -58,12 +99,34 @@ ROTATION_OPTIONS = {
     "180°": cv2.ROTATE_180
 }
 
+# Неизменяемый снимок настроек с номером версии. Tk-переменные читаются только
+# в главном потоке (trace на запись), рабочие потоки берут готовый объект settings,
+# а кэши, привязанные к версии, сбрасываются сами при её смене
+Settings = namedtuple("Settings", ["version", "rotation", "duration", "use_mic", "mic", "overlay"])
+settings = Settings(0, ROTATION_OPTIONS["90° вправо (вертикально)"], 5, False, "", None)
+settings_lock = threading.Lock()
+
+def publish_settings(**changes):
+    global settings
+    with settings_lock:
+        settings = settings._replace(version=settings.version + 1, **changes)
+    return settings
+
+def on_settings_var_changed(*_):
+    publish_settings(rotation=ROTATION_OPTIONS[selected_rotation.get()],
+                     duration=int(selected_duration.get()),
+                     use_mic=use_mic.get(),
+                     mic=selected_mic.get())
+# Конвейер превью: "threads" — композитинг в потоке этого процесса,
+# "processes" — в отдельном процессе через общую память (--process-pipeline)
+PIPELINE_MODE = "processes" if "--process-pipeline" in sys.argv else "threads"
+
 def list_events():
     if drive_service is None:
         print("Google Drive service not initialized.")
         return [], {}
     try:
-        res = drive_service.files().list(
+        res = drive().files().list(
             q=f"'{EVENTS_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
             spaces='drive', fields='files(id,name)', pageSize=1000
         ).execute()
@@ -79,13 +142,179 @@ def create_event(name):
         return None
     try:
         meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [EVENTS_FOLDER_ID]}
-        folder = drive_service.files().create(body=meta, fields='id').execute()
+        folder = drive().files().create(body=meta, fields='id').execute()
         return folder['id']
     except Exception as e:
         print(f"Failed to create event: {e}")
         return None
 
-def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_folder_id=None):
+# Как видео попадает во вторую папку (по QR): "copy" — загружается ещё раз,
+# "shortcut" — в папке создаётся ярлык на файл в папке события. Цель ярлыка
+# получает ровно те доступы, что у папки гостя, и никаких шире. Добавить файлу
+# вторую папку-родителя (addParents) Drive не даёт: у файла один родитель.
+# Если Drive отказывает, файл всё-таки загружается копией
+UPLOAD_MODE = "shortcut"  # видео — самый тяжёлый файл, второй раз его не грузим
+SHARED_ROLES = ("reader", "commenter", "writer")
+
+def share_like_folder(file_id, folder_id):
+    permissions = drive().permissions().list(
+        fileId=folder_id, fields='permissions(type,role,emailAddress,domain,allowFileDiscovery)'
+    ).execute().get('permissions', [])
+    for permission in permissions:
+        if permission['role'] not in SHARED_ROLES:
+            continue  # владелец у файла тот же, роли общих дисков к файлу не применимы
+        body = {key: permission[key] for key in ('type', 'role', 'emailAddress', 'domain', 'allowFileDiscovery')
+                if key in permission}
+        extra = {'sendNotificationEmail': False} if permission['type'] in ('user', 'group') else {}
+        drive().permissions().create(fileId=file_id, body=body, **extra).execute()
+
+def link_into_folder(file_id, name, folder_id):
+    # ID ярлыка или None, если видео нужно загрузить копией
+    if UPLOAD_MODE == "copy":
+        return None
+    try:
+        share_like_folder(file_id, folder_id)
+        shortcut = drive().files().create(
+            body={'name': name, 'mimeType': 'application/vnd.google-apps.shortcut',
+                  'shortcutDetails': {'targetId': file_id}, 'parents': [folder_id]},
+            fields='id'
+        ).execute()
+        return shortcut['id']
+    except Exception as e:
+        print(f"Failed to link {name} into the share folder ({UPLOAD_MODE}), uploading a copy: {e}")
+        return None
+
+# Возобновляемая загрузка видео по протоколу Drive: сессия открывается один раз,
+# файл уходит кусками по RESUMABLE_CHUNK_SIZE, а URI сессии и смещение хранятся
+# в UPLOAD_SESSIONS_FILE. После обрыва связи или перезапуска программы загрузка
+# продолжается с последнего байта, подтверждённого сервером, а не с нуля
+RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024  # Кратно 256 КБ, как требует Drive
+RESUMABLE_RETRIES = 5
+RESUMABLE_BACKOFF = 1.0
+UPLOAD_SESSIONS_FILE = os.path.abspath("upload_sessions.json")
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id"
+upload_sessions_lock = threading.Lock()
+
+def load_upload_sessions(sessions_file):
+    try:
+        with open(sessions_file, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def save_upload_session(key, value, sessions_file):
+    # value None — сессия завершена или недействительна
+    with upload_sessions_lock:
+        sessions = load_upload_sessions(sessions_file)
+        if value is None:
+            sessions.pop(key, None)
+        else:
+            sessions[key] = value
+        try:
+            with open(sessions_file, "w", encoding="utf-8") as fh:
+                json.dump(sessions, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save upload sessions: {e}")
+
+def uploaded_offset(response):
+    # Ответ 308 несёт Range: bytes=0-N с последним принятым байтом
+    received = response.headers.get("Range")
+    return int(received.rsplit("-", 1)[1]) + 1 if received else 0
+
+def query_upload_offset(http, uri, size):
+    # (смещение, None); (size, ресурс файла), если загрузка уже завершена;
+    # (None, None), если сессия истекла
+    response = http.put(uri, data=b"", headers={"Content-Range": f"bytes */{size}"})
+    if response.status_code in (200, 201):
+        return size, response.json()
+    if response.status_code == 308:
+        return uploaded_offset(response), None
+    if response.status_code in (404, 410):
+        return None, None
+    response.raise_for_status()
+    raise requests.HTTPError(f"Unexpected status {response.status_code}", response=response)
+
+def resumable_upload(http, path, metadata, mimetype, chunk_size=RESUMABLE_CHUNK_SIZE, on_sent=None,
+                     url=DRIVE_UPLOAD_URL, sessions_file=UPLOAD_SESSIONS_FILE, backoff=RESUMABLE_BACKOFF):
+    # Возвращает ресурс созданного файла ({'id': ...})
+    size = os.path.getsize(path)
+    name = os.path.basename(path)
+    key = json.dumps([os.path.abspath(path), size, metadata], sort_keys=True)
+    uri, offset = None, 0
+    saved = load_upload_sessions(sessions_file).get(key)
+    if saved:
+        offset, result = query_upload_offset(http, saved["uri"], size)
+        if result is not None:
+            save_upload_session(key, None, sessions_file)
+            return result
+        if offset is not None:
+            uri = saved["uri"]
+            print(f"Resuming upload of {name} at {offset}/{size} bytes")
+        else:
+            offset = 0
+    if uri is None:
+        response = http.post(url, json=metadata, headers={"X-Upload-Content-Type": mimetype,
+                                                           "X-Upload-Content-Length": str(size)})
+        response.raise_for_status()
+        uri = response.headers["Location"]
+    save_upload_session(key, {"uri": uri, "offset": offset}, sessions_file)
+
+    def acknowledge(acked):
+        # Отправленными считаются только байты, которые сервер подтвердил:
+        # кусок, отвергнутый с 5xx/429 или оборванный, не учитывается
+        nonlocal offset
+        if on_sent and acked > offset:
+            on_sent(acked - offset)
+        offset = acked
+
+    failures = 0
+    need_query = False
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                if need_query:
+                    queried, result = query_upload_offset(http, uri, size)
+                    if result is not None:
+                        acknowledge(size)
+                        save_upload_session(key, None, sessions_file)
+                        return result
+                    if queried is None:
+                        save_upload_session(key, None, sessions_file)
+                        raise RuntimeError(f"Upload session for {name} expired")
+                    acknowledge(queried)
+                    need_query = False
+                fh.seek(offset)
+                chunk = fh.read(chunk_size)
+                content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{size}" if chunk else f"bytes */{size}"
+                response = http.put(uri, data=chunk, headers={"Content-Range": content_range})
+            except OSError as e:
+                failure = e
+            else:
+                if response.status_code in (200, 201):
+                    acknowledge(size)
+                    save_upload_session(key, None, sessions_file)
+                    return response.json()
+                if response.status_code == 308:
+                    acknowledge(uploaded_offset(response))
+                    failures = 0
+                    save_upload_session(key, {"uri": uri, "offset": offset}, sessions_file)
+                    continue
+                if response.status_code in (404, 410):
+                    save_upload_session(key, None, sessions_file)
+                    raise RuntimeError(f"Upload session for {name} expired")
+                if response.status_code < 500 and response.status_code != 429:
+                    raise RuntimeError(f"Upload of {name} failed: HTTP {response.status_code}")
+                failure = f"HTTP {response.status_code}"
+            # Обрыв или ошибка сервера: пауза, затем сервер сообщает, сколько принял
+            failures += 1
+            if failures > RESUMABLE_RETRIES:
+                raise RuntimeError(f"Upload of {name} stalled at {offset}/{size} bytes: {failure}")
+            print(f"Upload of {name} interrupted at {offset}/{size} bytes ({failure}), resuming")
+            time.sleep(backoff * 2 ** (failures - 1))
+            need_query = True
+
+def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_folder_id=None,
+                    folder_id=None, claim_name=False, on_sent=None, outbox_id=None):
     if drive_service is None:
         print("Google Drive service not initialized.")
         return None, None, None
@@ -93,24 +322,44 @@ def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_f
         print(f"File {path} not found.")
         return None, None, None
     
+    # Сделанные шаги запоминаются в строке журнала (outbox_id), и повтор их
+    # пропускает: файл в папке события, новая папка гостя и копия в ней
+    # создаются по одному разу, сколько бы попыток ни понадобилось
+    steps = outbox.steps(outbox_id) if outbox_id is not None else {}
+    def done_step(column, value):
+        steps[column] = value
+        if outbox_id is not None:
+            outbox.record_step(outbox_id, column, value)
+    
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            media = MediaFileUpload(path, mimetype='video/mp4')
-            drive_service.files().create(
-                body={'name': os.path.basename(path), 'parents': [event_folder_id]},
-                media_body=media
-            ).execute()
-            if reuse_last and last_folder_id:
+            if not steps.get("event_file_id"):
+                # Повтор продолжает ту же сессию загрузки с подтверждённого смещения
+                uploaded = resumable_upload(drive_session(), path, {'name': os.path.basename(path), 'parents': [event_folder_id]},
+                                            'video/mp4', on_sent=on_sent)
+                done_step("event_file_id", uploaded['id'])
+            if folder_id is not None:
+                # Папка из пула или уже показанная в QR; из пула — получает имя сессии
+                uni_id = folder_id
+                if claim_name:
+                    drive().files().update(fileId=folder_id, body={'name': folder_name}).execute()
+            elif reuse_last and last_folder_id:
                 uni_id = last_folder_id
+            elif steps.get("folder_id"):
+                uni_id = steps["folder_id"]
             else:
                 uni_meta = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [UNIVERSAL_FOLDER_ID]}
-                uni_folder = drive_service.files().create(body=uni_meta, fields='id').execute()
+                uni_folder = drive().files().create(body=uni_meta, fields='id').execute()
                 uni_id = uni_folder['id']
-            drive_service.files().create(
-                body={'name': os.path.basename(path), 'parents': [uni_id]},
-                media_body=media
-            ).execute()
+                done_step("folder_id", uni_id)
+            if not steps.get("share_file_id"):
+                shared_id = link_into_folder(steps["event_file_id"], os.path.basename(path), uni_id)
+                if shared_id is None:
+                    shared_id = resumable_upload(drive_session(), path, {'name': os.path.basename(path), 'parents': [uni_id]},
+                                                 'video/mp4', on_sent=on_sent)['id']
+                done_step("share_file_id", shared_id)
+            folder_pool.filled(uni_id)
             uni_url = f'https://drive.google.com/drive/folders/{uni_id}'
             qr = qrcode.make(uni_url)
             return qr, uni_url, uni_id
@@ -121,6 +370,400 @@ def upload_to_drive(path, folder_name, event_folder_id, reuse_last=False, last_f
                 print(f"Failed to upload file to Google Drive after {max_retries} attempts: {e}")
                 return None, None, None
 
+# Загрузка на Google Drive идёт в фоне: задание ставится в очередь пула, у
+# каждого своё состояние и тайминги, а колбэк завершения вызывается в потоке Tk
+# через window.after — экран результата и следующий гость не ждут сеть и паузы
+# между повторами. Задания с reuse_last идут по одному, чтобы попасть в одну папку
+class UploadJob:
+    def __init__(self, name, args, kwargs, reuse_last, done):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.reuse_last = reuse_last
+        self.done = done
+        self.state = "queued"  # queued -> uploading -> done / failed
+        self.bytes_sent = 0
+        self.result = (None, None, None)  # (qr, url, uni_id) из upload_to_drive
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    def add_sent(self, size):
+        self.bytes_sent += size
+
+class UploadService:
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.completed = deque()  # append/popleft атомарны, замок не нужен
+        self.lock = threading.Lock()
+        self.folder_lock = threading.Lock()
+        self.pending = 0
+        self.polling = False
+        self.last_folder_id = None
+
+    def submit(self, name, path, folder_name, event_folder_id, reuse_last, done, **kwargs):
+        # Вызывается в потоке Tk; done(job) тоже будет вызван в нём. Папка,
+        # заданная заранее (folder_id), сразу становится последней
+        job = UploadJob(name, (path, folder_name, event_folder_id), kwargs, reuse_last, done)
+        share = kwargs.get("share") or kwargs.get("encoded")
+        job.outbox_id = outbox.enqueue(name, path, share.path if share is not None else path, folder_name,
+                                       event_folder_id, kwargs.get("folder_id"), kwargs.get("claim_name", False))
+        if kwargs.get("folder_id") is not None:
+            self.last_folder_id = kwargs["folder_id"]
+        with self.lock:
+            self.pending += 1
+            depth = self.pending
+        print(f"Upload {name} queued ({depth} in queue)")
+        self.executor.submit(self._run, job)
+        if not self.polling:
+            self.polling = True
+            window.after(50, self._poll)
+        return job
+
+    def queue_depth(self):
+        with self.lock:
+            return self.pending
+
+    def _run(self, job):
+        job.state = "uploading"
+        job.started_at = time.monotonic()
+        try:
+            for artifact in (job.kwargs.get("encoded"), job.kwargs.get("share")):
+                if artifact is not None:
+                    artifact.materialize()  # Журнал дозагружает файлы с диска
+            if job.reuse_last:
+                with self.folder_lock:
+                    job.result = upload_to_drive(*job.args, reuse_last=True, last_folder_id=self.last_folder_id,
+                                                 on_sent=job.add_sent, outbox_id=job.outbox_id, **job.kwargs)
+                    if job.result[2] is not None:
+                        self.last_folder_id = job.result[2]
+            else:
+                job.result = upload_to_drive(*job.args, on_sent=job.add_sent, outbox_id=job.outbox_id, **job.kwargs)
+                if job.result[2] is not None:
+                    self.last_folder_id = job.result[2]
+        except Exception as e:
+            print(f"Upload {job.name} failed: {e}")
+        job.state = "done" if job.result[0] is not None else "failed"
+        if job.state == "done":
+            outbox.finish(job.outbox_id, job.result[2])
+        else:
+            outbox.retry_later(job.outbox_id, "upload failed")
+        job.finished_at = time.monotonic()
+        self.completed.append(job)
+
+    def _poll(self):
+        while self.completed:
+            job = self.completed.popleft()
+            with self.lock:
+                self.pending -= 1
+                depth = self.pending
+            print(f"Upload {job.name} {job.state}: waited {(job.started_at - job.submitted_at) * 1000:.0f} ms, "
+                  f"took {(job.finished_at - job.started_at) * 1000:.0f} ms, sent {job.bytes_sent // 1024} KB "
+                  f"({depth} in queue)")
+            try:
+                job.done(job)
+            except Exception as e:
+                print(f"Upload callback failed: {e}")
+        if self.queue_depth() > 0:
+            window.after(50, self._poll)
+        else:
+            self.polling = False
+
+upload_service = UploadService()
+
+# Пул заранее созданных пустых папок под UNIVERSAL_FOLDER_ID: сессия сразу берёт
+# ID папки, и QR показывается до первого загруженного байта, а файл доезжает
+# позже. Пул пополняется в фоне и хранится на диске между запусками; папки
+# старше FOLDER_POOL_MAX_AGE удаляются при старте. Выданные папки помнятся, пока
+# в них не дойдёт файл: брошенная сессия (загрузка так и не завершилась и не ждёт
+# в журнале) оставила бы пустую папку, её QR уже видел гость — такая папка
+# удаляется при старте, а не возвращается в пул
+FOLDER_POOL_FILE = os.path.abspath("folder_pool.json")
+FOLDER_POOL_SIZE = 3
+FOLDER_POOL_MAX_AGE = 7 * 24 * 3600
+
+class FolderPool:
+    def __init__(self, size=FOLDER_POOL_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.folders = []  # [{"id": ..., "created": время создания}]
+        self.claimed = []  # [{"id": ..., "claimed": время выдачи}] — файл ещё не дошёл
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.refilling = False
+
+    def start(self):
+        with self.lock:
+            self.refilling = True
+        self.executor.submit(self._start)
+
+    def claim(self):
+        # ID свободной папки или None, если пул пуст (тогда папку создаст загрузка)
+        with self.lock:
+            folder = self.folders.pop(0) if self.folders else None
+            if folder is not None:
+                self.claimed.append({"id": folder["id"], "claimed": time.time()})
+            self._save()
+        self.refill()
+        return folder["id"] if folder else None
+
+    def filled(self, folder_id):
+        # Загрузка дошла до папки: она больше не считается брошенной
+        with self.lock:
+            before = len(self.claimed)
+            self.claimed = [f for f in self.claimed if f["id"] != folder_id]
+            if len(self.claimed) != before:
+                self._save()
+
+    def refill(self):
+        with self.lock:
+            if self.refilling or len(self.folders) >= self.size:
+                return
+            self.refilling = True
+        self.executor.submit(self._refill)
+
+    def _save(self):
+        try:
+            with open(FOLDER_POOL_FILE, "w", encoding="utf-8") as fh:
+                json.dump({"folders": self.folders, "claimed": self.claimed}, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save folder pool: {e}")
+
+    def _start(self):
+        try:
+            with open(FOLDER_POOL_FILE, encoding="utf-8") as fh:
+                saved = json.load(fh)
+            folders, claimed = saved.get("folders", []), saved.get("claimed", [])
+        except (OSError, ValueError):
+            folders, claimed = [], []
+        kept, abandoned = self._check_claimed(claimed)
+        now = time.time()
+        fresh = [f for f in folders if now - f["created"] < FOLDER_POOL_MAX_AGE]
+        for folder in folders:
+            if folder in fresh or drive_service is None:
+                continue
+            try:
+                drive().files().delete(fileId=folder["id"]).execute()
+            except Exception as e:
+                print(f"Failed to delete stale pool folder {folder['id']}: {e}")
+        with self.lock:
+            self.folders = fresh + self.folders
+            self.claimed = kept + self.claimed
+            self._save()
+        print(f"Folder pool: {len(fresh)} reused, {len(folders) - len(fresh)} stale removed, "
+              f"{abandoned} abandoned removed")
+        self._refill()
+
+    def _check_claimed(self, claimed):
+        # Выданная папка остаётся за сессией, пока её загрузка ждёт в журнале;
+        # пустая и никем не ожидаемая удаляется, непустая просто забывается
+        kept, abandoned = [], 0
+        for folder in claimed:
+            if drive_service is None or outbox.waits_for_folder(folder["id"]):
+                kept.append(folder)
+                continue
+            try:
+                children = drive().files().list(q=f"'{folder['id']}' in parents and trashed=false",
+                                                fields='files(id)', pageSize=1).execute().get('files', [])
+                if not children:
+                    drive().files().delete(fileId=folder["id"]).execute()
+                    abandoned += 1
+            except Exception as e:
+                print(f"Failed to check claimed pool folder {folder['id']}: {e}")
+                kept.append(folder)
+        return kept, abandoned
+
+    def _refill(self):
+        try:
+            while drive_service is not None:
+                with self.lock:
+                    if len(self.folders) >= self.size:
+                        break
+                name = f"pool_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [UNIVERSAL_FOLDER_ID]}
+                folder = drive().files().create(body=meta, fields='id').execute()
+                with self.lock:
+                    self.folders.append({"id": folder['id'], "created": time.time()})
+                    self._save()
+        except Exception as e:
+            print(f"Failed to refill folder pool: {e}")
+        finally:
+            with self.lock:
+                self.refilling = False
+
+folder_pool = FolderPool()
+
+def claim_share_folder(reuse_last):
+    # Папка для QR известна сразу: последняя (при reuse_last) или свободная из пула.
+    # Возвращает (ID или None, нужно ли переименовать папку под сессию)
+    if reuse_last and upload_service.last_folder_id:
+        return upload_service.last_folder_id, False
+    return folder_pool.claim(), True
+
+def folder_qr(folder_id):
+    return qrcode.make(f'https://drive.google.com/drive/folders/{folder_id}')
+
+# Журнал загрузок в SQLite: сессия записывается до начала загрузки (файлы,
+# событие, папка гостя, статус), поэтому загрузка, сорвавшаяся без сети, не
+# теряется. Фоновый разборщик повторяет отложенные записи с растущей паузой и
+# после перезапуска продолжает с того места, где остановился. После
+# OUTBOX_MAX_ATTEMPTS неудач запись помечается 'failed' и ждёт оператора;
+# загруженные записи удаляются через OUTBOX_KEEP_DAYS
+OUTBOX_DB = os.path.abspath("outbox.sqlite3")
+OUTBOX_POLL_S = 5
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 30 * 60
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_KEEP_DAYS = 7
+OUTBOX_PRUNE_S = 60 * 60
+OUTBOX_STEPS = ("event_file_id", "folder_id", "share_file_id")  # ID, созданные шагами загрузки
+
+class Outbox:
+    def __init__(self, db_path=OUTBOX_DB):
+        self.db_path = db_path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY, name TEXT, path TEXT, share_path TEXT, folder_name TEXT,
+                event_id TEXT, folder_id TEXT, claim_name INTEGER, status TEXT,
+                attempts INTEGER DEFAULT 0, created REAL, next_try REAL, last_error TEXT, uni_id TEXT,
+                event_file_id TEXT, share_file_id TEXT)""")
+            # Журналы, созданные до записи шагов, получают недостающие столбцы
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(outbox)")}
+            for column in ("event_file_id", "share_file_id"):
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+            # Загрузки, прерванные закрытием программы, снова ждут своей очереди
+            self.db.execute("UPDATE outbox SET status = 'pending' WHERE status = 'uploading'")
+        self.prune()
+        count, oldest, failed = self.status()
+        print(f"Outbox: {count} pending" + (f", oldest {oldest / 60:.0f} min" if oldest is not None else "")
+              + (f", {failed} failed" if failed else ""))
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def enqueue(self, name, path, share_path, folder_name, event_id, folder_id, claim_name):
+        # Запись принадлежит живому заданию UploadService, пока оно не отчитается
+        now = time.time()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO outbox (name, path, share_path, folder_name, event_id, folder_id, claim_name, "
+                "status, created, next_try) VALUES (?, ?, ?, ?, ?, ?, ?, 'uploading', ?, ?)",
+                (name, path, share_path, folder_name, event_id, folder_id, int(claim_name), now, now))
+            return cursor.lastrowid
+
+    def steps(self, row_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(OUTBOX_STEPS)} FROM outbox WHERE id = ?", (row_id,)).fetchone()
+        return {column: row[column] for column in OUTBOX_STEPS if row[column]} if row else {}
+
+    def record_step(self, row_id, column, value):
+        if column not in OUTBOX_STEPS:
+            raise ValueError(f"Unknown outbox step {column}")
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE outbox SET {column} = ? WHERE id = ?", (value, row_id))
+
+    def finish(self, row_id, uni_id):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET status = 'done', uni_id = ?, last_error = NULL WHERE id = ?",
+                            (uni_id, row_id))
+
+    def fail(self, row_id, error):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, row_id))
+
+    def retry_later(self, row_id, error):
+        with self.lock, self.db:
+            attempts = self.db.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()[0] + 1
+            status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+            delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+            self.db.execute("UPDATE outbox SET status = ?, attempts = ?, next_try = ?, last_error = ? "
+                            "WHERE id = ?", (status, attempts, time.time() + delay, error, row_id))
+        if status == "failed":
+            print(f"Outbox: giving up on row {row_id} after {attempts} attempts: {error}")
+
+    def prune(self):
+        with self.lock, self.db:
+            deleted = self.db.execute("DELETE FROM outbox WHERE status = 'done' AND created < ?",
+                                      (time.time() - OUTBOX_KEEP_DAYS * 24 * 60 * 60,)).rowcount
+        if deleted:
+            print(f"Outbox: pruned {deleted} uploaded rows")
+
+    def waits_for_folder(self, folder_id):
+        # Есть ли незавершённая загрузка в эту папку (в том числе брошенная после попыток)
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM outbox WHERE folder_id = ? AND status != 'done' LIMIT 1",
+                                   (folder_id,)).fetchone() is not None
+
+    def status(self):
+        # (сколько ещё не на Drive, возраст самой старой записи в секундах или None,
+        #  сколько записей брошено после OUTBOX_MAX_ATTEMPTS попыток)
+        with self.lock:
+            count, oldest = self.db.execute(
+                "SELECT COUNT(*), MIN(created) FROM outbox WHERE status IN ('pending', 'uploading')").fetchone()
+            failed = self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+        return count, time.time() - oldest if oldest is not None else None, failed
+
+    def _claim_due(self):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT * FROM outbox WHERE status = 'pending' AND next_try <= ? "
+                                  "ORDER BY created LIMIT 1", (time.time(),)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE outbox SET status = 'uploading' WHERE id = ?", (row["id"],))
+        return row
+
+    def _drain(self):
+        pruned_at = time.monotonic()
+        while True:
+            if time.monotonic() - pruned_at > OUTBOX_PRUNE_S:
+                self.prune()
+                pruned_at = time.monotonic()
+            if drive_service is None:
+                # Без Drive попытки только копили бы неудачи: записи ждут перезапуска
+                time.sleep(OUTBOX_POLL_S)
+                continue
+            row = self._claim_due()
+            if row is None:
+                time.sleep(OUTBOX_POLL_S)
+                continue
+            if not os.path.exists(row["path"]):
+                print(f"Outbox: {row['path']} is gone, dropping {row['name']}")
+                self.fail(row["id"], "file missing")
+                continue
+            print(f"Outbox: uploading {row['name']} (attempt {row['attempts'] + 1})")
+            try:
+                qr, url, uni_id = outbox_upload(row)
+                error = "upload failed"
+            except Exception as e:
+                qr, uni_id, error = None, None, str(e)
+            if qr is not None:
+                self.finish(row["id"], uni_id)
+                print(f"Outbox: {row['name']} uploaded")
+            else:
+                self.retry_later(row["id"], error)
+
+outbox = Outbox()
+
+def outbox_upload(row):
+    # Повтор из журнала: видео уже на диске, папка гостя — та, что была в QR
+    return upload_to_drive(row["path"], row["folder_name"], row["event_id"], folder_id=row["folder_id"],
+                           outbox_id=row["id"],
+                           claim_name=bool(row["claim_name"]))
+
+def update_outbox_status():
+    count, oldest, failed = outbox.status()
+    if count:
+        text = f"Ждут загрузки: {count}, самая старая — {oldest / 60:.0f} мин"
+    else:
+        text = "Все загрузки завершены"
+    if failed:
+        text += f"\nНе загрузились после {OUTBOX_MAX_ATTEMPTS} попыток: {failed}"
+    outbox_label.config(text=text, fg="#ff6666" if failed else "white")
+    window.after(5000, update_outbox_status)
+
 def record_audio(path, duration_s, mic_name):
     print(f"Starting audio recording to {path} for {duration_s} seconds with mic: {mic_name}")
     devs = sd.query_devices()
@@ -142,10 +785,13 @@ def record_audio(path, duration_s, mic_name):
         print(f"Error recording audio: {e}")
 
 def load_overlay():
-    global overlay_image_path, overlay_image_cv
     file = filedialog.askopenfilename(filetypes=[("Image Files", ".png;.jpg;*.jpeg")])
     if not file:
         return
+    set_overlay_from_file(file)
+
+def set_overlay_from_file(file):
+    global overlay_image_path, overlay_image_cv
     img = cv2.imread(file, cv2.IMREAD_UNCHANGED)
     if img is None:
         print("Failed to load overlay image.")
@@ -161,93 +807,761 @@ def load_overlay():
     else:
         pad = (1800 - nh) // 2
         overlay_image_cv = cv2.copyMakeBorder(resized, pad, 1800-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
+    publish_settings(overlay=overlay_image_cv)
     print("Overlay loaded successfully.")
 
 def clear_overlay():
     global overlay_image_path, overlay_image_cv
     overlay_image_path = None
     overlay_image_cv = None
+    publish_settings(overlay=None)
     print("Overlay cleared.")
 
-preview_queue = queue.Queue(maxsize=10)
+# Смешивание в фиксированной точке, общее для превью, отсчёта, коллажей и шаблонов:
+# рамка один раз переводится в предумноженный вид (цвет * вес, вес 0..256 в uint16),
+# а результат пишется прямо в кадр или его ROI, без float-массивов. Отличие от
+# float-формулы photo * (1 - a) + rgb * a — не больше 1 LSB
+def premultiply(ov):
+    if ov.shape[2] == 4:
+        # Альфа 0..255 переводится в вес 0..256, чтобы результат делился сдвигом на 8
+        a = ov[:, :, 3:].astype(np.uint16)
+        a += a >> 7
+        return ov[:, :, :3] * a, 256 - a
+    # Аналог cv2.addWeighted(frame, 0.7, ov, 0.3, 0)
+    return ov.astype(np.uint16) * np.uint16(77), np.uint16(179)
 
-def process_frames():
-    global cap, overlay_image_cv, countdown_value
-    while preview_running:
-        if not (cap and cap.isOpened()):
-            time.sleep(0.01)
-            continue
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.01)
-            continue
-        rot = ROTATION_OPTIONS[selected_rotation.get()]
-        if rot is not None:
-            frame = cv2.rotate(frame, rot)
-        h, w = frame.shape[:2]
-        scale = 600 / w
-        nh = int(h * scale)
-        frame = cv2.resize(frame, (600, nh))
-        if nh > 900:
-            off = (nh - 900) // 2
-            frame = frame[off:off+900, :]
-        else:
-            pad = (900 - nh) // 2
-            frame = cv2.copyMakeBorder(frame, pad, 900-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
-        if overlay_image_cv is not None:
-            ov = cv2.resize(overlay_image_cv, (600, 900))
-            if ov.shape[2] == 4:
-                alpha = ov[:, :, 3:] / 255.0
-                rgb = ov[:, :, :3]
-                frame = (frame * (1 - alpha) + rgb * alpha).astype(np.uint8)
-            else:
-                frame = cv2.addWeighted(frame, 0.7, ov, 0.3, 0)
-        if countdown_value is not None:
-            txt = str(countdown_value)
-            org = (frame.shape[1]//2 - 60, frame.shape[0]//2 + 60)
-            cv2.putText(frame, txt, org,
-                        cv2.FONT_HERSHEY_SIMPLEX, 5,
-                        (255,255,255), 10, cv2.LINE_AA)
+def blend_into(dst, premul, inv):
+    # (dst * inv + premul + 128) >> 8 на месте; dst — uint8-кадр или его ROI
+    acc = dst.astype(np.uint16)
+    acc *= inv
+    acc += premul
+    acc += 128
+    acc >>= 8
+    dst[...] = acc
+    return dst
+
+# Кэш подготовленной рамки: масштабирование, разделение на цвет/альфу и
+# предумножение выполняются один раз на (ширина, высота, режим смешивания)
+overlay_cache = {}
+OVERLAY_CACHE_MAX_ENTRIES = 8
+overlay_cache_stats = {"hits": 0, "misses": 0}
+overlay_cache_version = 0  # версия снимка настроек, для которой собран кэш
+overlay_cache_lock = threading.Lock()
+
+def sync_overlay_cache(version):
+    # Вызывается под overlay_cache_lock: более новый снимок настроек сбрасывает кэш
+    global overlay_cache_version
+    if version > overlay_cache_version:
+        if overlay_cache:
+            print(f"Overlay cache invalidated (hits={overlay_cache_stats['hits']}, misses={overlay_cache_stats['misses']})")
+        overlay_cache.clear()
+        overlay_cache_version = version
+
+def get_overlay_cache_stats():
+    with overlay_cache_lock:
+        return dict(overlay_cache_stats, entries=len(overlay_cache))
+
+def get_prepared_overlay(width, height, snapshot=None):
+    snapshot = snapshot or settings
+    src = snapshot.overlay
+    if src is None:
+        return None
+    mode = "alpha" if src.shape[2] == 4 else "weighted"
+    key = (width, height, mode)
+    with overlay_cache_lock:
+        sync_overlay_cache(snapshot.version)
+        prepared = overlay_cache.get(key) if snapshot.version == overlay_cache_version else None
+        if prepared is not None:
+            overlay_cache_stats["hits"] += 1
+            return prepared
+        overlay_cache_stats["misses"] += 1
+    premul, inv = premultiply(cv2.resize(src, (width, height)))
+    prepared = (mode, premul, inv)
+    with overlay_cache_lock:
+        if snapshot.version == overlay_cache_version:
+            if len(overlay_cache) >= OVERLAY_CACHE_MAX_ENTRIES:
+                overlay_cache.pop(next(iter(overlay_cache)))
+            overlay_cache[key] = prepared
+        print(f"Overlay cache miss for {width}x{height} {mode} (hits={overlay_cache_stats['hits']}, misses={overlay_cache_stats['misses']})")
+    return prepared
+
+def blend_prepared_overlay(frame, prepared):
+    # Смешивание на месте: кадр должен принадлежать вызывающему
+    _, premul, inv = prepared
+    return blend_into(frame, premul, inv)
+
+# Согласование режима камеры: реально поддерживаемые режимы (разрешение, fps,
+# fourcc) определяются один раз и кэшируются на диске по имени устройства
+CAMERA_MODES_FILE = os.path.abspath("camera_modes.json")
+CAMERA_CANDIDATE_SIZES = [(640, 480), (1280, 720), (1024, 768), (1600, 1200), (1920, 1080),
+                          (2048, 1536), (2592, 1944), (3840, 2160)]
+CAMERA_FOURCCS = ["MJPG", "YUY2"]
+camera_mode_logged = False
+
+def fourcc_to_str(value):
+    code = int(value)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00")
+
+def probe_camera_modes(index):
+    # OpenCV не перечисляет режимы сам, поэтому каждый кандидат запрашивается
+    # и сверяется с тем, что драйвер выставил на самом деле
+    probe = cv2.VideoCapture(index, cv2.CAP_DSHOW)
+    if not probe.isOpened():
+        print("Failed to open camera for mode probing.")
+        return []
+    modes = []
+    try:
+        for fourcc in CAMERA_FOURCCS:
+            for width, height in CAMERA_CANDIDATE_SIZES:
+                probe.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+                probe.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                probe.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                probe.set(cv2.CAP_PROP_FPS, 30)
+                actual = (int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                actual_fourcc = fourcc_to_str(probe.get(cv2.CAP_PROP_FOURCC))
+                if actual != (width, height) or actual_fourcc != fourcc:
+                    continue
+                mode = {"width": width, "height": height,
+                        "fps": round(probe.get(cv2.CAP_PROP_FPS), 2), "fourcc": fourcc}
+                if mode not in modes:
+                    modes.append(mode)
+    finally:
+        probe.release()
+    return modes
+
+def load_camera_modes(index):
+    try:
+        with open(CAMERA_MODES_FILE, encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        cached = {}
+    if cached.get(DEVICE_NAME):
+        return cached[DEVICE_NAME]
+    modes = probe_camera_modes(index)
+    print(f"Probed {len(modes)} camera modes for {DEVICE_NAME}: {modes}")
+    if modes:
+        cached[DEVICE_NAME] = modes
         try:
-            preview_queue.put_nowait(frame)
-        except queue.Full:
-            pass
-        time.sleep(0.01)
+            with open(CAMERA_MODES_FILE, "w", encoding="utf-8") as fh:
+                json.dump(cached, fh, indent=2)
+        except OSError as e:
+            print(f"Failed to save camera modes: {e}")
+    return modes
+
+def select_camera_mode(modes, width, fps, rotation):
+    # Кадр масштабируется по ширине, поэтому матрица должна покрывать ширину
+    # после поворота; из подходящих берётся самый дешёвый по числу пикселей,
+    # для больших разрешений предпочитается сжатый MJPG
+    rotated = rotation in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    def cost(mode):
+        pixels = mode["width"] * mode["height"]
+        prefer_mjpg = pixels > 640 * 480
+        return (pixels, 0 if (mode["fourcc"] == "MJPG") == prefer_mjpg else 1)
+    # Многие драйверы DirectShow отдают CAP_PROP_FPS = 0: такая частота
+    # неизвестна и режим не отсеивается, иначе всегда брался бы самый большой
+    suitable = [m for m in modes
+                if (m["height"] if rotated else m["width"]) >= width and (m["fps"] <= 0 or m["fps"] >= fps)]
+    if suitable:
+        return min(suitable, key=cost)
+    if modes:
+        return max(modes, key=lambda m: (m["width"] * m["height"], m["fourcc"] == "MJPG", m["fps"]))
+    return None
+
+def measure_camera_fps(camera, frames=20):
+    camera.read()  # первый кадр включает прогрев камеры
+    start = time.monotonic()
+    received = 0
+    for _ in range(frames):
+        ret, _ = camera.read()
+        if ret:
+            received += 1
+    elapsed = time.monotonic() - start
+    return received / elapsed if elapsed > 0 else 0.0
+
+def open_camera(fps, width, height, rotation):
+    global camera_mode_logged
+    mode = select_camera_mode(load_camera_modes(camera_index), width, fps, rotation)
+    camera = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
+    if not camera.isOpened():
+        return camera
+    if mode is not None:
+        # FOURCC нужно выставлять до размера кадра, иначе DirectShow его игнорирует
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode["fourcc"]))
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, mode["width"])
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, mode["height"])
+    else:
+        if rotation in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+            width, height = height, width
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    camera.set(cv2.CAP_PROP_FPS, fps)
+    if not camera_mode_logged:
+        camera_mode_logged = True
+        actual = (int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)), int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        actual_fourcc = fourcc_to_str(camera.get(cv2.CAP_PROP_FOURCC))
+        print(f"Camera mode for {DEVICE_NAME}: chosen {mode}, driver reports "
+              f"{actual[0]}x{actual[1]} {actual_fourcc}, measured {measure_camera_fps(camera):.1f} fps")
+    return camera
+
+# План геометрии: поворот, масштаб, обрезка/поля и зеркало сводятся в одну
+# аффинную матрицу на (размер входа, настройки) и применяются за один проход
+geometry_cache = {}
+geometry_cache_version = 0  # версия снимка настроек, для которой собран кэш
+
+def get_geometry_plan(src_w, src_h, rotation, target_w=None, target_h=None, mirror=False):
+    global geometry_cache_version
+    version = settings.version
+    if version != geometry_cache_version:
+        geometry_cache.clear()  # планы старых настроек больше не понадобятся
+        geometry_cache_version = version
+    key = (src_w, src_h, rotation, target_w, target_h, mirror)
+    plan = geometry_cache.get(key)
+    if plan is not None:
+        return plan
+    # Поворот в непрерывных координатах (границы пикселей — целые числа)
+    if rotation == cv2.ROTATE_90_CLOCKWISE:
+        m = np.array([[0, -1, src_h], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_h, src_w
+    elif rotation == cv2.ROTATE_90_COUNTERCLOCKWISE:
+        m = np.array([[0, 1, 0], [-1, 0, src_w], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_h, src_w
+    elif rotation == cv2.ROTATE_180:
+        m = np.array([[-1, 0, src_w], [0, -1, src_h], [0, 0, 1]], dtype=np.float64)
+        rw, rh = src_w, src_h
+    else:
+        m = np.eye(3)
+        rw, rh = src_w, src_h
+    # Масштаб по ширине target_w, по высоте — центрированная обрезка или чёрные поля до target_h
+    out_w = target_w or rw
+    nh = int(rh * out_w / rw) if target_w else rh
+    out_h = target_h or nh
+    offset_y = -((nh - out_h) // 2) if nh > out_h else (out_h - nh) // 2
+    m = np.array([[out_w / rw, 0, 0], [0, nh / rh, offset_y], [0, 0, 1]]) @ m
+    if mirror:
+        m = np.array([[-1, 0, out_w], [0, 1, 0], [0, 0, 1]]) @ m
+    # Переход к индексам пикселей (центр пикселя i находится в i + 0.5), как в cv2.resize
+    m = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]]) @ m @ np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+    if (out_w, out_h) == (src_w, src_h) and np.allclose(m, np.eye(3)):
+        matrix = None
+    else:
+        matrix = m[:2]
+    # Без масштабирования матрица переставляет пиксели целиком, интерполяция не нужна
+    interpolation = cv2.INTER_NEAREST if (out_w, nh) == (rw, rh) else cv2.INTER_LINEAR
+    # Строки чёрных полей сверху и снизу; края кадра продолжаются своими пикселями, как в cv2.resize
+    pad = (offset_y, offset_y + nh) if nh < out_h else None
+    plan = (matrix, (out_w, out_h), interpolation, pad)
+    geometry_cache[key] = plan
+    return plan
+
+def apply_geometry(frame, rotation, target_w=None, target_h=None, mirror=False):
+    h, w = frame.shape[:2]
+    matrix, size, interpolation, pad = get_geometry_plan(w, h, rotation, target_w, target_h, mirror)
+    if matrix is None:
+        return frame
+    out = cv2.warpAffine(frame, matrix, size, flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
+    if pad is not None:
+        out[:pad[0]] = 0
+        out[pad[1]:] = 0
+    return out
+
+class LatestFrameSlot:
+    # Одноместный обмен кадрами между потоками: новый кадр вытесняет
+    # непрочитанный старый, поэтому превью всегда показывает самый свежий кадр
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, frame, ts):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = (frame, ts)
+            self._cond.notify_all()
+
+    def take(self, timeout=None):
+        with self._cond:
+            if self._item is None and timeout:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def clear(self):
+        with self._cond:
+            self._item = None
+
+class DisplaySurface:
+    # Один PhotoImage на размер виджета: новый кадр вставляется в него на месте
+    # через paste(), вместо создания нового PhotoImage на каждом тике
+    def __init__(self, label):
+        self.label = label
+        self.photo = None
+
+    def show(self, image):
+        if self.photo is None or (self.photo.width(), self.photo.height()) != image.size:
+            self.photo = ImageTk.PhotoImage(image)
+            self.label.imgtk = self.photo
+            self.label.config(image=self.photo)
+        else:
+            self.photo.paste(image)
+
+    def clear(self):
+        self.photo = None
+        self.label.imgtk = None
+        self.label.config(image='')
+
+preview_slot = LatestFrameSlot()
+PREVIEW_STATS_INTERVAL = 5.0
+preview_stats = {"displayed": 0, "dropped": 0, "age_ms": 0.0, "avg_age_ms": 0.0, "fps": 0.0}
+preview_stats_window = {"start": time.monotonic(), "frames": 0, "age_sum": 0.0, "dropped": 0}
+
+def record_preview_frame(capture_ts):
+    # Возраст кадра от захвата до показа, потерянные кадры и фактический fps
+    now = time.monotonic()
+    age_ms = (now - capture_ts) * 1000
+    preview_stats["displayed"] += 1
+    preview_stats["dropped"] = preview_slot.dropped
+    preview_stats["age_ms"] = age_ms
+    window_stats = preview_stats_window
+    window_stats["frames"] += 1
+    window_stats["age_sum"] += age_ms
+    elapsed = now - window_stats["start"]
+    if elapsed >= PREVIEW_STATS_INTERVAL:
+        preview_stats["fps"] = window_stats["frames"] / elapsed
+        preview_stats["avg_age_ms"] = window_stats["age_sum"] / window_stats["frames"]
+        dropped = preview_slot.dropped - window_stats["dropped"]
+        print(f"Preview: {preview_stats['fps']:.1f} fps, frame age {preview_stats['avg_age_ms']:.0f} ms avg / "
+              f"{age_ms:.0f} ms last, dropped {dropped} (total {preview_slot.dropped})")
+        window_stats.update(start=now, frames=0, age_sum=0.0, dropped=preview_slot.dropped)
+
+def get_preview_stats():
+    return dict(preview_stats)
+
+class CameraSession:
+    # Долгоживущая сессия камеры: владеет устройством, читает кадры в своём
+    # потоке и раздаёт их подписчикам (превью, снимок, запись). Режим меняется
+    # без закрытия и повторного открытия устройства.
+    def __init__(self, index):
+        self.index = index
+        self.capture = None
+        self.fps = None
+        self.last_switch_ms = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._latest = None
+        self._running = False
+        self._thread = None
+        self._switch_started = None
+
+    def is_open(self):
+        return self.capture is not None
+
+    def open(self, fps, width, height, rotation):
+        if self.is_open():
+            self.switch_mode(fps)
+            return True
+        capture = open_camera(fps, width, height, rotation)
+        if not capture.isOpened():
+            return False
+        self.capture = capture
+        self.fps = fps
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def _read_loop(self):
+        while self._running:
+            with self._lock:
+                if self.capture is None:
+                    break
+                ret, frame = self.capture.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            captured_at = time.monotonic()
+            self._latest = (frame, captured_at)
+            if self._switch_started is not None:
+                self.last_switch_ms = (captured_at - self._switch_started) * 1000
+                self._switch_started = None
+                print(f"Camera switched to {self.fps} fps in {self.last_switch_ms:.0f} ms")
+            for slot in list(self._subscribers):
+                slot.put(frame, captured_at)
+
+    def subscribe(self):
+        slot = LatestFrameSlot()
+        self._subscribers.append(slot)
+        return slot
+
+    def unsubscribe(self, slot):
+        if slot in self._subscribers:
+            self._subscribers.remove(slot)
+
+    def latest(self):
+        return self._latest
+
+    def switch_mode(self, fps):
+        # Задержка переключения — от запроса до первого кадра в новом режиме
+        if not self.is_open() or fps == self.fps:
+            return
+        started = time.monotonic()
+        with self._lock:
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+        self.fps = fps
+        self._switch_started = started
+
+    def close(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        with self._lock:
+            if self.capture is not None:
+                self.capture.release()
+            self.capture = None
+        self._thread = None
+        self._latest = None
+        self.fps = None
+        self._subscribers.clear()
+
+camera = CameraSession(camera_index)
+
+# Превью рендерится ровно в размер метки на экране: кадр 2:3 вписывается в её
+# внутреннюю область, кэши геометрии и рамки перестраиваются только при смене размера
+preview_size = (600, 900)
+
+def on_preview_configure(event):
+    global preview_size
+    border = 2 * (int(preview_label.cget("bd")) + int(preview_label.cget("highlightthickness")))
+    avail_w, avail_h = event.width - border, event.height - border
+    width = min(avail_w, avail_h * 2 // 3) // 2 * 2
+    if width >= 2 and (width, width * 3 // 2) != preview_size:
+        preview_size = (width, width * 3 // 2)
+        print(f"Preview size: {preview_size[0]}x{preview_size[1]}")
+
+# Спрайты цифр отсчёта: каждая цифра растеризуется один раз на (масштаб превью,
+# шрифт, кадр анимации) и смешивается с кадром только внутри своего прямоугольника
+COUNTDOWN_FONT = cv2.FONT_HERSHEY_SIMPLEX
+COUNTDOWN_ANIMATION_FRAMES = 1  # больше 1 — цифра появляется крупнее и гаснет к концу секунды
+COUNTDOWN_SPRITES_MAX = 64
+countdown_sprites = {}
+countdown_changed_at = time.monotonic()
+
+def get_countdown_sprite(text, k, step=0):
+    key = (text, round(k, 3), COUNTDOWN_FONT, step)
+    sprite = countdown_sprites.get(key)
+    if sprite is not None:
+        return sprite
+    thickness = max(1, int(10 * k))
+    (bw, bh), _ = cv2.getTextSize(text, COUNTDOWN_FONT, 5 * k, thickness)
+    grow, fade = 1.0, 1.0
+    if COUNTDOWN_ANIMATION_FRAMES > 1:
+        t = step / COUNTDOWN_ANIMATION_FRAMES
+        grow = 1.0 + 0.25 * (1 - t) ** 2
+        fade = min(1.0, 2 * (1 - t))
+    (tw, th), baseline = cv2.getTextSize(text, COUNTDOWN_FONT, 5 * k * grow, thickness)
+    pad = thickness
+    mask = np.zeros((th + baseline + 2 * pad, tw + 2 * pad), dtype=np.uint8)
+    cv2.putText(mask, text, (pad, pad + th), COUNTDOWN_FONT, 5 * k * grow, 255, thickness, cv2.LINE_AA)
+    # Вес 0..256, как у рамки: белая цифра даёт premul = 255 * a
+    a = np.round(mask.astype(np.float32) * (256 / 255 * fade)).astype(np.uint16)[:, :, None]
+    premul = a * np.uint16(255)
+    inv = np.uint16(256) - a
+    # Центр цифры совпадает с тем, что рисовал cv2.putText с org = (W/2 - 60k, H/2 + 60k)
+    cx = -int(60 * k) + bw / 2
+    cy = int(60 * k) - bh / 2
+    sprite = (premul, inv, int(round(cx - pad - tw / 2)), int(round(cy - pad - th / 2)))
+    if len(countdown_sprites) >= COUNTDOWN_SPRITES_MAX:
+        countdown_sprites.clear()
+    countdown_sprites[key] = sprite
+    return sprite
+
+def countdown_step():
+    # Кадр анимации — по времени, прошедшему с показа текущей цифры
+    if COUNTDOWN_ANIMATION_FRAMES == 1:
+        return 0
+    elapsed = time.monotonic() - countdown_changed_at
+    return min(COUNTDOWN_ANIMATION_FRAMES - 1, int(elapsed * COUNTDOWN_ANIMATION_FRAMES))
+
+def draw_countdown(frame, text, k, step=0):
+    premul, inv, dx, dy = get_countdown_sprite(text, k, step)
+    h, w = frame.shape[:2]
+    x0, y0 = w // 2 + dx, h // 2 + dy
+    sh, sw = inv.shape[:2]
+    fx0, fy0 = max(x0, 0), max(y0, 0)
+    fx1, fy1 = min(x0 + sw, w), min(y0 + sh, h)
+    if fx0 >= fx1 or fy0 >= fy1:
+        return
+    cut = (slice(fy0 - y0, fy1 - y0), slice(fx0 - x0, fx1 - x0))
+    blend_into(frame[fy0:fy1, fx0:fx1], premul[cut], inv[cut])
+
+def process_frames(generation):
+    frames = camera.subscribe()
+    try:
+        while preview_running and generation == preview_generation:
+            item = frames.take(timeout=0.1)
+            if item is None:
+                continue
+            frame, captured_at = item
+            rgb = render_preview_frame(frame, settings)
+            # Подготовка PIL-изображения — в рабочем потоке, а не в Tk
+            preview_slot.put(Image.fromarray(rgb), captured_at)
+    finally:
+        camera.unsubscribe(frames)
+
+def render_preview_frame(frame, snapshot):
+    # Без обращений к Tk: вызывается и в потоке превью, и в процессе композитора
+    source = frame
+    width, height = preview_size
+    frame = apply_geometry(frame, snapshot.rotation, width, height)
+    if frame is source:
+        frame = frame.copy()  # дальше кадр меняется на месте; исходный — кадр камеры или общей памяти
+    if snapshot.overlay is not None:
+        prepared = get_prepared_overlay(width, height, snapshot)
+        if prepared is not None:
+            blend_prepared_overlay(frame, prepared)
+    if countdown_value is not None:
+        k = frame.shape[0] / 900  # размер цифр — как раньше на превью 600x900
+        draw_countdown(frame, str(countdown_value), k, countdown_step())
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+COMPOSITOR_SLOTS = 3
+
+class SharedFrameRing:
+    # Кольцо слотов фиксированного размера в multiprocessing.shared_memory.
+    # Заголовок слота: (seq, ts, ширина, высота); seq нечётный, пока слот пишется.
+    # Последняя строка заголовка: (последний слот, всего кадров, CPU писателя, 0)
+    def __init__(self, slots, width, height, name=None):
+        self.slots = slots
+        self.slot_bytes = width * height * 3
+        header_bytes = (slots + 1) * 4 * 8
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * self.slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.meta = np.ndarray((slots + 1, 4), dtype=np.float64, buffer=self.shm.buf)
+        self.data = np.ndarray((slots, self.slot_bytes), dtype=np.uint8, buffer=self.shm.buf, offset=header_bytes)
+        if self.owner:
+            self.meta[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, frame, captured_at):
+        h, w = frame.shape[:2]
+        if h * w * 3 > self.slot_bytes:
+            print(f"Frame {w}x{h} does not fit shared slot, skipped.")
+            return False
+        slot = (int(self.meta[-1, 0]) + 1) % self.slots
+        header = self.meta[slot]
+        header[0] += 1
+        self.data[slot, :h * w * 3].reshape(h, w, 3)[:] = frame
+        header[1:] = (captured_at, w, h)
+        header[0] += 1
+        self.meta[-1, 0] = slot
+        self.meta[-1, 1] += 1
+        return True
+
+    def read_latest(self, seen):
+        # Без копирования: вид на слот по его индексу; после использования
+        # вызывающий проверяет unchanged(), не перезаписан ли слот
+        written = int(self.meta[-1, 1])
+        if written == seen:
+            return None
+        slot = int(self.meta[-1, 0])
+        seq = self.meta[slot, 0]
+        if seq % 2:
+            return None
+        captured_at, w, h = self.meta[slot, 1:]
+        w, h = int(w), int(h)
+        return slot, seq, self.data[slot, :h * w * 3].reshape(h, w, 3), captured_at, written
+
+    def unchanged(self, slot, seq):
+        return self.meta[slot, 0] == seq
+
+    def close(self):
+        self.meta = None  # виды на буфер нужно отпустить до закрытия
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class CompositorProcess:
+    # Сторона интерфейса: кадры камеры пишутся во входное кольцо, готовые RGB-кадры
+    # превью читаются из выходного. Настройки уходят в процесс JSON-строками через stdin
+    def __init__(self):
+        self.proc = None
+        self.source = None
+        self.target = None
+        self.input_shape = None
+        self.max_output_size = (1080, 1920)
+        self.sent = None
+        self.seen = 0
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def _start(self, input_shape):
+        ih, iw = input_shape[:2]
+        ow, oh = self.max_output_size
+        self.source = SharedFrameRing(COMPOSITOR_SLOTS, iw, ih)
+        self.target = SharedFrameRing(COMPOSITOR_SLOTS, ow, oh)
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--compositor",
+             self.source.name, self.target.name, f"{iw}x{ih}", f"{ow}x{oh}"],
+            stdin=subprocess.PIPE, text=True)
+        self.input_shape = input_shape
+        self.sent = None
+        self.seen = 0
+        print(f"Compositor process started (pid {self.proc.pid}, input {iw}x{ih})")
+
+    def feed(self, frame, captured_at, settings):
+        with self._lock:
+            if self.proc is not None and (frame.shape != self.input_shape or not self.running()):
+                self._stop()
+            if self.proc is None:
+                self._start(frame.shape)
+            if settings != self.sent:
+                try:
+                    self.proc.stdin.write(json.dumps(settings) + "\n")
+                    self.proc.stdin.flush()
+                except OSError as e:
+                    print(f"Compositor process is gone: {e}")
+                    self._stop()
+                    return
+                self.sent = settings
+            self.source.write(frame, captured_at)
+
+    def take(self):
+        with self._lock:
+            if self.target is None:
+                return None
+            item = self.target.read_latest(self.seen)
+            if item is None:
+                return None
+            slot, seq, view, captured_at, self.seen = item
+            image = Image.fromarray(view)  # единственная копия — в PIL для Tk
+            if not self.target.unchanged(slot, seq):
+                return None
+            return image, captured_at
+
+    def child_cpu(self):
+        with self._lock:
+            return self.target.meta[-1, 2] if self.target is not None else 0.0
+
+    def _stop(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+            self.proc = None
+        for ring in (self.source, self.target):
+            if ring is not None:
+                ring.close()
+        self.source = self.target = None
+        self.input_shape = None
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+compositor = CompositorProcess()
+if not COMPOSITOR_CHILD:
+    atexit.register(compositor.stop)
+
+def feed_compositor(generation):
+    frames = camera.subscribe()
+    try:
+        while preview_running and generation == preview_generation:
+            item = frames.take(timeout=0.1)
+            if item is None:
+                continue
+            frame, captured_at = item
+            message = {"rotation": settings.rotation, "size": list(preview_size),
+                       "countdown": countdown_value, "countdown_at": countdown_changed_at,
+                       "overlay": overlay_image_path}
+            compositor.feed(frame, captured_at, message)
+    finally:
+        camera.unsubscribe(frames)
+
+def run_compositor_process(input_name, output_name, input_size, output_size):
+    # Процесс композитора: геометрия, рамка, отсчёт и RGB без GIL интерфейса.
+    # Закрытие stdin родителем означает завершение
+    global preview_size, countdown_value, countdown_changed_at
+    source = SharedFrameRing(COMPOSITOR_SLOTS, *input_size, name=input_name)
+    target = SharedFrameRing(COMPOSITOR_SLOTS, *output_size, name=output_name)
+    state = {"running": True}
+    def read_settings():
+        global preview_size, countdown_value, countdown_changed_at
+        for line in sys.stdin:
+            message = json.loads(line)
+            if message["rotation"] != settings.rotation:
+                publish_settings(rotation=message["rotation"])
+            preview_size = tuple(message["size"])
+            countdown_value = message["countdown"]
+            countdown_changed_at = message["countdown_at"]
+            if message["overlay"] != overlay_image_path:
+                if message["overlay"]:
+                    set_overlay_from_file(message["overlay"])
+                else:
+                    clear_overlay()
+        state["running"] = False
+    threading.Thread(target=read_settings, daemon=True).start()
+    seen = 0
+    while state["running"]:
+        item = source.read_latest(seen)
+        if item is None:
+            time.sleep(0.002)
+            continue
+        slot, seq, frame, captured_at, seen = item
+        rgb = render_preview_frame(frame, settings)
+        if not source.unchanged(slot, seq):
+            continue  # слот перезаписан камерой во время обработки
+        target.write(rgb, captured_at)
+        target.meta[-1, 2] = time.process_time()
+    source.close()
+    target.close()
 
 def update_preview():
-    global cap, preview_running
-    if cap and cap.isOpened():
-        cap.release()
-    cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    if not cap.isOpened():
+    global preview_running, preview_generation
+    # Сессия камеры не закрывается между превью и записью, только меняет режим
+    if not camera.open(30, 1200, 1800, settings.rotation):
         print("Failed to open camera for preview.")
         return
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1200)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1800)
     preview_running = True
-    threading.Thread(target=process_frames, daemon=True).start()
+    preview_generation += 1
+    generation = preview_generation
+    preview_slot.clear()
+    preview_stats_window.update(start=time.monotonic(), frames=0, age_sum=0.0, dropped=preview_slot.dropped)
+    if PIPELINE_MODE == "processes":
+        compositor.max_output_size = (window.winfo_screenwidth(), window.winfo_screenheight())
+        take = compositor.take
+        threading.Thread(target=feed_compositor, args=(generation,), daemon=True).start()
+    else:
+        take = preview_slot.take
+        threading.Thread(target=process_frames, args=(generation,), daemon=True).start()
     def loop():
-        if not preview_running:
+        if not preview_running or generation != preview_generation:
             return
-        try:
-            frame = preview_queue.get_nowait()
-            preview_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            imgtk = ImageTk.PhotoImage(Image.fromarray(preview_rgb))
-            preview_label.imgtk = imgtk
-            preview_label.config(image=imgtk)
-        except queue.Empty:
-            pass
-        preview_label.after(33, loop)
+        item = take()
+        if item is not None:
+            image, captured_at = item
+            preview_surface.show(image)
+            record_preview_frame(captured_at)
+        preview_label.after(15, loop)
     loop()
 
 def stop_preview():
-    global cap, preview_running
+    global preview_running
     preview_running = False
-    if cap and cap.isOpened():
-        cap.release()
-        cap = None
-    preview_label.config(image='')
+    preview_surface.clear()
 
 def start_countdown(sec, callback):
     global countdown_value, countdown_active
@@ -256,10 +1570,12 @@ def start_countdown(sec, callback):
         countdown_value = None
         callback()
     def tick(n):
-        global countdown_value, countdown_active
+        global countdown_value, countdown_active, countdown_changed_at
         if not countdown_active:
+            countdown_value = None
             return
         countdown_value = n
+        countdown_changed_at = time.monotonic()
         print(countdown_value)
         if n > 0:
             window.after(1000, lambda: tick(n-1))
@@ -269,21 +1585,9 @@ def start_countdown(sec, callback):
     tick(sec)
 
 def start_recording_countdown(sec, callback):
-    global countdown_active
-    countdown_label = tk.Label(main_page, text=str(sec), font=("Helvetica", 150), fg="white", bg="#000000")
-    countdown_label.place(relx=0.5, rely=0.5, anchor="center")
-    def tick(n):
-        global countdown_active
-        if not countdown_active:
-            countdown_label.place_forget()
-            return
-        countdown_label.config(text=str(n))
-        if n > 0:
-            window.after(1000, lambda: tick(n-1))
-        else:
-            window.after(1000, lambda: [countdown_label.place_forget(), callback()])
-    countdown_active = True
-    tick(sec)
+    # Отсчёт записи рисуется спрайтами на превью, как и отсчёт перед стартом,
+    # вместо отдельной Tk-метки поверх него
+    start_countdown(sec, callback)
 
 def start_recording():
     global countdown_active
@@ -291,37 +1595,37 @@ def start_recording():
     btn_start.config(state=tk.DISABLED)
     start_countdown(3, begin_recording)
 
+# Частота записываемого ролика. Драйвер может не принять её и продолжать
+# отдавать 30 fps, поэтому record_video() раскладывает кадры по слотам
+# 1/RECORD_FPS по времени захвата: лишние пропускаются, пропуски
+# заполняются повтором предыдущего кадра. Длительность ролика совпадает с
+# реальным временем и не расходится со звуком
+RECORD_FPS = 15
+
 def begin_recording():
-    global cap, recording, out, recording_filename, preview_running, audio_path, audio_thread
-    preview_running = False
-    stop_preview()
-    time.sleep(0.5)
+    global recording, out, recording_filename, audio_path, audio_thread
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     recording_filename = f"video_{ts}.mp4"
     out_path = os.path.join(SAVE_DIR, recording_filename)
 
-    cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    if not cap.isOpened():
+    # Камера уже открыта превью: переключаем режим на RECORD_FPS без переоткрытия
+    if not camera.open(RECORD_FPS, 1200, 1800, settings.rotation):
         print("Failed to open camera for recording.")
         btn_start.config(state=tk.NORMAL)
         show_main_page()
         return
-    cap.set(cv2.CAP_PROP_FPS, 15)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1200)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1800)
 
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     max_attempts = 5
     for attempt in range(max_attempts):
         print(f"Attempt {attempt + 1} to initialize VideoWriter for {out_path}")
-        out = cv2.VideoWriter(out_path, fourcc, 15, (1200, 1800))
+        out = cv2.VideoWriter(out_path, fourcc, RECORD_FPS, (1200, 1800))
         if out and out.isOpened():
             print("VideoWriter successfully initialized.")
             break
         time.sleep(1)
     if out is None or not out.isOpened():
         print("Failed to initialize video recording after several attempts.")
-        cap.release()
         btn_start.config(state=tk.NORMAL)
         show_main_page()
         return
@@ -330,26 +1634,30 @@ def begin_recording():
     threading.Thread(target=record_video, daemon=True).start()
     btn_stop.config(state=tk.NORMAL)
 
-    if use_mic.get() and selected_mic.get():
+    s = settings
+    if s.use_mic and s.mic:
         audio_path = os.path.join(SAVE_DIR, f"audio_{ts}.wav")
-        dur = int(selected_duration.get()) + 3  # Длительность аудио: выбранное время + 3 секунды предзаписи
-        audio_thread = threading.Thread(target=record_audio, args=(audio_path, dur, selected_mic.get()), daemon=True)
+        dur = s.duration + 3  # Длительность аудио: выбранное время + 3 секунды предзаписи
+        audio_thread = threading.Thread(target=record_audio, args=(audio_path, dur, s.mic), daemon=True)
         audio_thread.start()
     else:
         audio_path = None
         print("Microphone recording skipped: either not enabled or no mic selected.")
 
-    duration = int(selected_duration.get())
-    start_recording_countdown(duration, stop_recording)
+    start_recording_countdown(s.duration, stop_recording)
 
 def record_video():
-    global cap, recording, out
-    target_frame_time = 1.0 / 15
+    global recording, out
     frame_buffer = []
-    duration = int(selected_duration.get()) + 1  # Добавляем 1 секунду, чтобы учесть отображение 0
+    s = settings
+    duration = s.duration + 1  # Добавляем 1 секунду, чтобы учесть отображение 0
     start_time = time.time()
+    frames = camera.subscribe()
+    slot_time = 1.0 / RECORD_FPS
+    next_slot = None  # время захвата, с которого начинается следующий слот
+    last_frame = None
     
-    while recording and cap and cap.isOpened():
+    while recording and camera.is_open():
         if time.time() - start_time > duration:
             break
             
@@ -357,40 +1665,33 @@ def record_video():
             print("Error: VideoWriter is None or not opened. Stopping recording thread.")
             break
         
-        frame_start = time.time()
-        ret, frame = cap.read()
-        if not ret:
+        item = frames.take(timeout=1.0)
+        if item is None:
             print("Failed to read frame from camera. Stopping recording thread.")
             break
+        frame, captured_at = item
+        if next_slot is None:
+            next_slot = captured_at
+        if captured_at < next_slot:
+            continue  # камера быстрее RECORD_FPS: слот уже занят
         
-        rot = ROTATION_OPTIONS[selected_rotation.get()]
-        if rot is not None:
-            frame = cv2.rotate(frame, rot)
-        
-        h, w = frame.shape[:2]
-        scale = 1200 / w
-        nh = int(h * scale)
-        frame = cv2.resize(frame, (1200, nh))
-        if nh > 1800:
-            off = (nh - 1800) // 2
-            frame = frame[off:off+1800, :]
-        else:
-            pad = (1800 - nh) // 2
-            frame = cv2.copyMakeBorder(frame, pad, 1800-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
-        
+        # Слоты, пропущенные камерой, заполняются предыдущим кадром
+        missed = int((captured_at - next_slot) / slot_time)
+        next_slot += (missed + 1) * slot_time
+        frame = apply_geometry(frame, s.rotation, 1200, 1800)
+        if last_frame is not None:
+            frame_buffer.extend([last_frame] * missed)
         frame_buffer.append(frame)
+        last_frame = frame
         
-        if len(frame_buffer) >= 5:
-            try:
+        try:
+            while len(frame_buffer) >= 5:
                 out.write(frame_buffer.pop(0))
-            except Exception as e:
-                print(f"Error writing frame to video: {e}")
-                break
-        
-        elapsed = time.time() - frame_start
-        sleep_time = max(0, target_frame_time - elapsed)
-        time.sleep(sleep_time)
+        except Exception as e:
+            print(f"Error writing frame to video: {e}")
+            break
     
+    camera.unsubscribe(frames)
     while frame_buffer and out and out.isOpened():
         try:
             out.write(frame_buffer.pop(0))
@@ -403,55 +1704,118 @@ def record_video():
         print("VideoWriter released successfully.")
     print("Recording thread stopped.")
 
-def apply_overlay_to_video(input_path, output_path, overlay_img):
-    temp_overlay_path = os.path.join(SAVE_DIR, "temp_overlay.png")
-    cv2.imwrite(temp_overlay_path, overlay_img)
+# Артефакт сессии несёт декодированный массив, закодированные байты и путь к
+# файлу. Недостающее представление получается лениво из того, что уже есть,
+# поэтому каждый артефакт пишется на диск и читается с него не больше одного
+# раза; info — то, что стадия уже знает о нём (например, есть ли звук).
+# SessionIO считает прочитанные и записанные байты за сессию, включая файлы,
+# которые читает и пишет ffmpeg
+EncoderProfile = namedtuple("EncoderProfile", ["ext", "mimetype", "params"])
+OVERLAY_PNG = EncoderProfile(".png", "image/png", [cv2.IMWRITE_PNG_COMPRESSION, 1])
 
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        print("Failed to open video for post-processing.")
-        if os.path.exists(temp_overlay_path):
-            os.remove(temp_overlay_path)
-        return False
+class SessionIO:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def read(self, path):
+        with open(path, "rb") as fh:
+            data = fh.read()
+        self.count(read=len(data))
+        return data
+
+    def write(self, path, data):
+        with open(path, "wb") as fh:
+            fh.write(data)
+        self.count(written=len(data))
+
+    def count(self, read=0, written=0):
+        with self.lock:
+            self.bytes_read += read
+            self.bytes_written += written
 
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    def count_files(self, read=(), written=()):
+        def size(paths):
+            return sum(os.path.getsize(p) for p in paths if p and os.path.exists(p))
+        self.count(size(read), size(written))
 
-    cap.release()
+    def summary(self):
+        return f"read {self.bytes_read // 1024} KB, written {self.bytes_written // 1024} KB"
 
+class SessionArtifact:
+    def __init__(self, session_io, path=None, image=None, data=None, profile=None, info=None):
+        self.session_io = session_io
+        self.path = path
+        self.profile = profile
+        self.info = info or {}
+        self._image = image
+        self._data = data
+        self._on_disk = image is None and data is None and path is not None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            if self._image is not None:
+                ok, buf = cv2.imencode(self.profile.ext, self._image, self.profile.params)
+                if not ok:
+                    raise RuntimeError(f"{self.profile.ext} encoding failed")
+                self._data = buf.tobytes()
+            else:
+                self._data = self.session_io.read(self.path)
+        return self._data
+
+    def image(self):
+        with self.lock:
+            if self._image is None:
+                self._image = cv2.imdecode(np.frombuffer(self._load(), np.uint8), cv2.IMREAD_UNCHANGED)
+            return self._image
+
+    def data(self):
+        with self.lock:
+            return self._load()
+
+    def materialize(self):
+        # Путь к файлу на диске; файл пишется при первом обращении
+        with self.lock:
+            if not self._on_disk:
+                self.session_io.write(self.path, self._load())
+                self._on_disk = True
+            return self.path
+
+def apply_overlay_to_video(input_path, output_path, overlay, has_audio=True):
+    # Рамка (SessionArtifact) уходит в ffmpeg через stdin уже закодированной
+    # в PNG, без временного файла; звуковая дорожка берётся, только если она есть
     temp_output_path = os.path.join(SAVE_DIR, f"temp_output_{os.path.basename(output_path)}")
+    filter_complex = "[0:v][1:v]overlay=0:0[outv]"
+    audio_args = []
+    if has_audio:
+        filter_complex += ";[0:a]anull[outa]"
+        audio_args = ["-map", "[outa]", "-c:a", "aac"]
     try:
         result = subprocess.run([
             "ffmpeg", "-y",
             "-i", input_path,
-            "-i", temp_overlay_path,
-            "-filter_complex", f"[0:v][1:v]overlay=0:0[outv];[0:a]anull[outa]",
+            "-f", "png_pipe", "-i", "pipe:0",
+            "-filter_complex", filter_complex,
             "-map", "[outv]",
-            "-map", "[outa]",
+            *audio_args,
             "-c:v", "libx264",
-            "-c:a", "aac",
             "-shortest",
             temp_output_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        ], input=overlay.data(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         if result.returncode == 0:
             os.replace(temp_output_path, output_path)
-            print(f"Overlay applied to video with audio: {output_path}")
+            print(f"Overlay applied to video{' with audio' if has_audio else ''}: {output_path}")
             return True
         else:
-            print(f"FFmpeg error: {result.stderr}")
+            print(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
             return False
     except Exception as e:
-        print(f"Error applying overlay with audio: {e}")
+        print(f"Error applying overlay: {e}")
         return False
     finally:
-        if os.path.exists(temp_overlay_path):
-            try:
-                os.remove(temp_overlay_path)
-            except Exception as e:
-                print(f"Error deleting temporary overlay file {temp_overlay_path}: {e}")
-
         if os.path.exists(temp_output_path):
             max_attempts = 5
             for attempt in range(max_attempts):
@@ -466,22 +1830,21 @@ def apply_overlay_to_video(input_path, output_path, overlay_img):
                 print(f"Failed to delete temporary output file {temp_output_path} after {max_attempts} attempts.")
 
 def stop_recording():
-    global recording, out, cap, countdown_active
+    global recording, out, countdown_active
     countdown_active = False  # Останавливаем отсчёт
     recording = False
     if out and out.isOpened():
         out.release()
         print("VideoWriter released in stop_recording.")
     out = None
-    if cap and cap.isOpened():
-        cap.release()
-        cap = None
     stop_preview()
     btn_stop.config(state=tk.DISABLED)
     finalize_recording()
 
 def finalize_recording():
-    global last_uni_folder_id, preview_running, audio_path, audio_thread
+    global preview_running, audio_path, audio_thread
+    session_io = SessionIO()
+    has_audio = False
     try:
         path = os.path.join(SAVE_DIR, recording_filename)
         if not os.path.exists(path) or os.path.getsize(path) == 0:
@@ -489,13 +1852,15 @@ def finalize_recording():
             btn_start.config(state=tk.NORMAL)
             show_main_page()
             return
+        session_io.count_files(written=[path])
 
         if audio_thread is not None and audio_thread.is_alive():
             print("Waiting for audio recording to finish...")
             audio_thread.join()
 
-        if use_mic.get() and audio_path and os.path.exists(audio_path):
+        if settings.use_mic and audio_path and os.path.exists(audio_path):
             print(f"Merging audio from {audio_path} into video {path}")
+            session_io.count_files(read=[path, audio_path], written=[audio_path])
             merged = os.path.join(SAVE_DIR, f"final_{recording_filename}")
             try:
                 result = subprocess.run([
@@ -509,6 +1874,8 @@ def finalize_recording():
                 ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
                 if result.returncode == 0:
                     os.replace(merged, path)
+                    session_io.count_files(written=[path])
+                    has_audio = True
                     print(f"Audio merged successfully into {path}")
                 else:
                     print(f"FFmpeg error: {result.stderr}")
@@ -539,8 +1906,11 @@ def finalize_recording():
         if overlay_image_cv is not None:
             temp_path = os.path.join(SAVE_DIR, f"temp_{recording_filename}")
             os.rename(path, temp_path)
-            success = apply_overlay_to_video(temp_path, path, overlay_image_cv)
+            overlay = SessionArtifact(session_io, image=overlay_image_cv, profile=OVERLAY_PNG)
+            session_io.count_files(read=[temp_path])
+            success = apply_overlay_to_video(temp_path, path, overlay, has_audio)
             if success:
+                session_io.count_files(written=[path])
                 max_attempts = 5
                 for attempt in range(max_attempts):
                     try:
@@ -561,18 +1931,20 @@ def finalize_recording():
 
         ev_id = event_ids.get(selected_event.get())
         if ev_id:
-            qr, url, uni_id = upload_to_drive(
-                path, os.path.splitext(recording_filename)[0],
-                ev_id, reuse_last=reuse_var.get(), last_folder_id=last_uni_folder_id
-            )
-            if qr is not None:
-                last_uni_folder_id = uni_id
-                show_result_page(path, qr)
-            else:
-                print("Failed to upload to Google Drive.")
-                btn_start.config(state=tk.NORMAL)
-                show_main_page()
-                return
+            name = os.path.splitext(recording_filename)[0]
+            folder_id, claim_name = claim_share_folder(reuse_var.get())
+            def uploaded(job):
+                if job.state == "done":
+                    session_io.count(read=job.bytes_sent)
+                else:
+                    print("Failed to upload to Google Drive.")
+                print(f"Session I/O: {session_io.summary()}")
+                if folder_id is None and result_path == path and result_page.winfo_ismapped():
+                    show_result_qr(job.result[0])
+            upload_service.submit(name, path, name, ev_id, reuse_var.get(), uploaded,
+                                  folder_id=folder_id, claim_name=claim_name)
+            show_result_page(SessionArtifact(session_io, path, info={"audio": has_audio}),
+                             folder_qr(folder_id) if folder_id else None)
         else:
             print("Event not selected or unavailable.")
             btn_start.config(state=tk.NORMAL)
@@ -584,86 +1956,93 @@ def finalize_recording():
         btn_start.config(state=tk.NORMAL)
         show_main_page()
 
-def play_video(path, label):
+def play_video(artifact, label):
     global video_loop_cap, video_loop_active
+    path = artifact.path
     if not os.path.exists(path) or os.path.getsize(path) == 0:
         print("Video file not found or empty.")
         return
-    if video_loop_cap:
-        video_loop_cap.release()
+    # Предыдущий поток декодирования сам освобождает свой VideoCapture
     video_loop_cap = cv2.VideoCapture(path)
     if not video_loop_cap.isOpened():
         print("Failed to open video for playback.")
         return
 
-    instance = vlc.Instance()
-    player = instance.media_player_new()
-    media = instance.media_new(path)
-    player.set_media(media)
-    player.set_hwnd(label.winfo_id())
-    player.play()
-    print("Video and audio playback started with VLC.")
+    # Картинку декодирует только OpenCV; VLC играет лишь звук и без звуковой
+    # дорожки не открывает файл вовсе
+    player = None
+    if artifact.info.get("audio", True):
+        instance = vlc.Instance("--no-video")
+        player = instance.media_player_new()
+        player.set_media(instance.media_new(path))
+        player.play()
+        print("Audio playback started with VLC.")
 
     video_loop_active = True
-    def stream(player=player):
+    playback_slot = LatestFrameSlot()
+    playback_surface = DisplaySurface(label)
+    restarted = threading.Event()
+
+    def decode(video):
+        # Чтение, масштабирование и перевод в RGB — в рабочем потоке в темпе видео
         global video_loop_active, video_loop_cap
+        frame_time = 1.0 / (video.get(cv2.CAP_PROP_FPS) or 30)
+        next_due = time.monotonic()
+        just_restarted = False
+        while video_loop_active and video_loop_cap is video:
+            ret, frame = video.read()
+            if not ret:
+                if just_restarted:
+                    print("Failed to restart video playback.")
+                    video_loop_active = False
+                    break
+                # Перемотка в начало вместо повторного открытия файла
+                if not video.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                    video.release()
+                    video = video_loop_cap = cv2.VideoCapture(path)
+                just_restarted = True
+                restarted.set()
+                continue
+            just_restarted = False
+            resized = apply_geometry(frame, None, 800, 1200)
+            playback_slot.put(Image.fromarray(cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)), time.monotonic())
+            next_due = max(next_due + frame_time, time.monotonic() - frame_time)
+            time.sleep(max(0, next_due - time.monotonic()))
+        video.release()
+
+    def stream(player=player):
         if not video_loop_active:
-            player.stop()
-            print("Video and audio playback stopped.")
+            if player is not None:
+                player.stop()
+            print("Video playback stopped.")
             return
-        ret, frame = video_loop_cap.read()
-        if not ret:
-            video_loop_cap.release()
-            video_loop_cap = cv2.VideoCapture(path)
-            if not video_loop_cap.isOpened():
-                print("Failed to restart video playback.")
-                video_loop_active = False
+        if restarted.is_set():
+            restarted.clear()
+            if player is not None:
                 player.stop()
-                print("Video and audio playback stopped due to video restart failure.")
-                return
-            ret, frame = video_loop_cap.read()
-            player.set_media(instance.media_new(path))
-            player.play()
-            print("Video and audio playback restarted.")
-        if ret:
-            h, w = frame.shape[:2]
-            scale = 1200 / w
-            nh = int(h * scale)
-            fr = cv2.resize(frame, (1200, nh))
-            if nh > 1800:
-                off = (nh - 1800) // 2
-                crop = fr[off:off+1800, :]
-            else:
-                pad = (1800 - nh) // 2
-                crop = cv2.copyMakeBorder(fr, pad, 1800-nh-pad, 0, 0, cv2.BORDER_CONSTANT)
-            ch, cw = crop.shape[:2]
-            scale_w = 900 / cw
-            scale_h = 1200 / ch
-            s = min(scale_w, scale_h)
-            pw, ph = int(cw * s), int(ch * s)
-            resized = cv2.resize(crop, (pw, ph))
-            rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-            imgtk = ImageTk.PhotoImage(Image.fromarray(rgb))
-            label.imgtk = imgtk
-            label.config(image=imgtk)
-        label.after(30, stream)
+                player.play()
+            print("Video playback restarted.")
+        item = playback_slot.take()
+        if item is not None:
+            playback_surface.show(item[0])
+        label.after(15, stream)
+
+    threading.Thread(target=decode, args=(video_loop_cap,), daemon=True).start()
     stream()
 
 def show_settings_page():
     global preview_running, video_loop_active
     preview_running = False
     stop_preview()
+    compositor.stop()
+    camera.close()
     video_loop_active = False
     btn_stop.config(state=tk.DISABLED)
     main_page.pack_forget()
     settings_page.pack(fill=tk.BOTH, expand=True)
 
 def stop_video_capture():
-    global cap, video_loop_active, video_loop_cap
-    if cap and cap.isOpened():
-        cap.release()
-    if video_loop_cap and video_loop_cap.isOpened():
-        video_loop_cap.release()
+    global video_loop_active
     video_loop_active = False
 
 def show_main_page():
@@ -672,38 +2051,51 @@ def show_main_page():
     settings_page.pack_forget()
     main_page.pack(fill=tk.BOTH, expand=True)
     stop_video_capture()
+    stop_preview()
     preview_running = True
     update_preview()
     btn_start.config(state=tk.NORMAL)
     btn_stop.config(state=tk.DISABLED)
     window.update()
 
-def show_result_page(path, qr_img):
+def show_result_page(video, qr_img):
+    global result_path
     settings_page.pack_forget()
     main_page.pack_forget()
     result_page.pack(fill=tk.BOTH, expand=True)
+    for widget in result_page.winfo_children():
+        widget.destroy()
+    result_path = video.path
     video_label = tk.Label(result_page, bg="#000000")
     video_label.place(relx=0.5, rely=0.5, anchor="center", relwidth=1.0, relheight=1.0)
-    play_video(path, video_label)
+    play_video(video, video_label)
     back_button = ttk.Button(result_page, text="← Назад", style="SemiTransparent.TButton", command=show_main_page)
     back_button.place(relx=0.5, rely=0.05, anchor="center")
     if qr_img:
-        qr_img_resized = qr_img.resize((200, 200))
-        qr_array = np.array(qr_img_resized)
-        if qr_array.dtype == bool:
-            qr_array = qr_array.astype(np.uint8) * 255
-        if qr_array.ndim == 2 or qr_array.shape[-1] == 1:
-            qr_array = cv2.cvtColor(qr_array, cv2.COLOR_GRAY2RGBA) if qr_array.ndim == 2 else cv2.cvtColor(qr_array, cv2.COLOR_RGB2RGBA)
-        if qr_array.shape[-1] == 3:
-            alpha = np.full((200, 200, 1), 0, dtype=np.uint8)
-            qr_array = np.dstack((qr_array, alpha))
-        elif qr_array.shape[-1] == 4:
-            qr_array[:, :, 3] = np.where(qr_array[:, :, :3].sum(axis=2) > 600, 255, 0)
-        qr_img_with_alpha = Image.fromarray(qr_array)
-        qr_tk = ImageTk.PhotoImage(qr_img_with_alpha)
-        qr_label = tk.Label(result_page, image=qr_tk, bg="#000000")
-        qr_label.image = qr_tk
-        qr_label.place(relx=0.95, rely=0.95, anchor="se")
+        show_result_qr(qr_img)
+
+def show_result_qr(qr_img):
+    # QR добавляется, когда закончилась фоновая загрузка; None — загрузка не удалась
+    if qr_img is None:
+        tk.Label(result_page, text="QR-код недоступен", fg="#FFFFFF", bg="#000000",
+                 font=("Arial", 16)).place(relx=0.95, rely=0.95, anchor="se")
+        return
+    qr_img_resized = qr_img.resize((200, 200))
+    qr_array = np.array(qr_img_resized)
+    if qr_array.dtype == bool:
+        qr_array = qr_array.astype(np.uint8) * 255
+    if qr_array.ndim == 2 or qr_array.shape[-1] == 1:
+        qr_array = cv2.cvtColor(qr_array, cv2.COLOR_GRAY2RGBA) if qr_array.ndim == 2 else cv2.cvtColor(qr_array, cv2.COLOR_RGB2RGBA)
+    if qr_array.shape[-1] == 3:
+        alpha = np.full((200, 200, 1), 0, dtype=np.uint8)
+        qr_array = np.dstack((qr_array, alpha))
+    elif qr_array.shape[-1] == 4:
+        qr_array[:, :, 3] = np.where(qr_array[:, :, :3].sum(axis=2) > 600, 255, 0)
+    qr_img_with_alpha = Image.fromarray(qr_array)
+    qr_tk = ImageTk.PhotoImage(qr_img_with_alpha)
+    qr_label = tk.Label(result_page, image=qr_tk, bg="#000000")
+    qr_label.image = qr_tk
+    qr_label.place(relx=0.95, rely=0.95, anchor="se")
 
 def toggle_fullscreen():
     window.attributes('-fullscreen', True)
@@ -711,6 +2103,11 @@ def toggle_fullscreen():
 def exit_fullscreen(event=None):
     window.attributes('-fullscreen', False)
 
+if COMPOSITOR_CHILD:
+    args = sys.argv[sys.argv.index("--compositor") + 1:]
+    run_compositor_process(args[0], args[1], *(tuple(map(int, size.split("x"))) for size in args[2:4]))
+    sys.exit(0)
+
 window = tk.Tk()
 window.title("Фотобудка")
 window.geometry("900x1200")
@@ -723,6 +2120,10 @@ selected_mic = tk.StringVar(window, value=mic_devices[0] if mic_devices else "")
 use_mic = tk.BooleanVar(window, value=False)
 selected_rotation = tk.StringVar(window, value="90° вправо (вертикально)")
 selected_duration = tk.StringVar(window, value="5")
+
+for var in (selected_mic, use_mic, selected_rotation, selected_duration):
+    var.trace_add("write", on_settings_var_changed)
+on_settings_var_changed()
 selected_event = tk.StringVar(window)
 event_ids = {}
 reuse_var = tk.BooleanVar(window, value=False)
@@ -793,6 +2194,8 @@ ttk.Combobox(
     font=("Helvetica", 28),
     width=30
 ).pack(pady=(0,25))
+outbox_label = tk.Label(settings_page, text="", font=("Helvetica", 20), fg="white", bg="#000000")
+outbox_label.pack(pady=15)
 ttk.Button(settings_page, text="▶ Запустить", style="Custom.TButton", command=lambda: [settings_page.pack_forget(), show_main_page()]).pack(pady=50)
 
 main_page.pack(fill=tk.BOTH, expand=True)
@@ -829,6 +2232,8 @@ om["menu"].config(
 om.pack(pady=10, ipady=5)
 
 preview_label = tk.Label(main_page, bg="#000000")
+preview_surface = DisplaySurface(preview_label)
+preview_label.bind("<Configure>", on_preview_configure)
 preview_label.place(relx=0.5, rely=0.5, anchor="center", relwidth=0.95, relheight=0.7)
 btn_start = ttk.Button(main_page, text="▶", style="Custom.TButton", command=start_recording)
 btn_start.place(relx=0.35, rely=0.95, anchor="center")
@@ -852,5 +2257,126 @@ def on_new_event():
         if event_id:
             refresh_events()
 
-refresh_events()
-window.mainloop()
\ No newline at end of file
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__[len("benchmark_"):]] = func
+    return func
+
+def time_ms(func, repeat=50):
+    func()  # прогрев
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+@benchmark
+def benchmark_countdown():
+    # Цифра отсчёта на кадре превью: cv2.putText на каждом кадре против готового спрайта
+    for width, height in ((600, 900), (1200, 1800)):
+        base = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        frame = base.copy()
+        k = height / 900
+        org = (width//2 - int(60 * k), height//2 + int(60 * k))
+        def before():
+            cv2.putText(frame, "3", org, cv2.FONT_HERSHEY_SIMPLEX, 5 * k,
+                        (255,255,255), max(1, int(10 * k)), cv2.LINE_AA)
+        def after():
+            draw_countdown(frame, "3", k)
+        reference, sprite = base.copy(), base.copy()
+        cv2.putText(reference, "3", org, cv2.FONT_HERSHEY_SIMPLEX, 5 * k,
+                    (255,255,255), max(1, int(10 * k)), cv2.LINE_AA)
+        draw_countdown(sprite, "3", k)
+        diff = np.abs(reference.astype(np.int16) - sprite).max()
+        print(f"countdown {width}x{height}: putText {time_ms(before, 200):.3f} ms/frame, "
+              f"sprite {time_ms(after, 200):.3f} ms/frame (max diff {diff})")
+
+@benchmark
+def benchmark_pipeline(seconds=5.0, warmup=1.0):
+    # Превью 600x900 с отсчётом из синтетических кадров 1920x1080 при 30 fps,
+    # параллельно — «запись» 1200x1800 при 15 fps, как во время record_video()
+    global countdown_value, preview_size
+    preview_size = (600, 900)
+    countdown_value = 3
+    rotation = cv2.ROTATE_90_CLOCKWISE
+    snapshot = publish_settings(rotation=rotation)
+    frame = np.random.randint(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    surface = DisplaySurface(tk.Label(main_page))
+    message = {"rotation": rotation, "size": list(preview_size), "countdown": countdown_value,
+               "countdown_at": countdown_changed_at, "overlay": overlay_image_path}
+
+    def run(mode):
+        stop = threading.Event()
+        slot = LatestFrameSlot()
+        def camera_feed():
+            next_due = time.monotonic()
+            while not stop.is_set():
+                if mode == "threads":
+                    slot.put(frame, time.monotonic())
+                else:
+                    compositor.feed(frame, time.monotonic(), message)
+                next_due += 1 / 30
+                time.sleep(max(0.0, next_due - time.monotonic()))
+        def compose():
+            while not stop.is_set():
+                item = slot.take(timeout=0.1)
+                if item is not None:
+                    preview_slot.put(Image.fromarray(render_preview_frame(item[0], snapshot)), item[1])
+        def record():
+            while not stop.is_set():
+                apply_geometry(frame, rotation, 1200, 1800)
+                time.sleep(1 / 15)
+        workers = [camera_feed, record] + ([compose] if mode == "threads" else [])
+        threads = [threading.Thread(target=worker, daemon=True) for worker in workers]
+        for thread in threads:
+            thread.start()
+        take = preview_slot.take if mode == "threads" else compositor.take
+        start = None  # отсчёт с первого показанного кадра: запуск процесса не в счёт
+        measuring = False
+        shown, age_sum = 0, 0.0
+        while start is None or time.monotonic() - start < warmup + seconds:
+            if start is not None and not measuring and time.monotonic() - start >= warmup:
+                measuring = True
+                shown, age_sum = 0, 0.0
+                measure_start = time.monotonic()
+                cpu_start = time.process_time()
+                child_start = compositor.child_cpu()
+            item = take()
+            if item is None:
+                time.sleep(0.002)
+                continue
+            surface.show(item[0])
+            window.update_idletasks()
+            if start is None:
+                start = time.monotonic()
+            shown += 1
+            age_sum += (time.monotonic() - item[1]) * 1000
+        elapsed = time.monotonic() - measure_start
+        ui_cpu = (time.process_time() - cpu_start) / elapsed * 100
+        child_cpu = (compositor.child_cpu() - child_start) / elapsed * 100
+        stop.set()
+        for thread in threads:
+            thread.join()
+        compositor.stop()
+        line = (f"pipeline {mode}: {shown / elapsed:.1f} fps shown, frame age {age_sum / max(shown, 1):.0f} ms, "
+                f"UI process CPU {ui_cpu:.0f}%")
+        if mode == "processes":
+            line += f", compositor process CPU {child_cpu:.0f}%"
+        print(line)
+
+    compositor.max_output_size = preview_size
+    run("threads")
+    run("processes")
+
+def run_benchmarks(names):
+    for name in names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+if "--benchmark" in sys.argv:
+    run_benchmarks(sys.argv[sys.argv.index("--benchmark") + 1:])
+else:
+    refresh_events()
+    outbox.start()  # до пула: пул сверяет выданные папки с журналом
+    folder_pool.start()
+    update_outbox_status()
+    window.mainloop()
\ No newline at end of file
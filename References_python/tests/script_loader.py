@@ -0,0 +1,53 @@
+# Загрузка отдельных определений из скриптов фотобудки без запуска интерфейса.
+# Скрипты на уровне модуля подключают Drive, камеру, звук и создают окно Tk,
+# поэтому тест берёт из файла только импорты и нужные функции, классы и
+# константы верхнего уровня и исполняет их в отдельном пространстве имён.
+# Импорты, которых нет в окружении (Drive, sounddevice, vlc), пропускаются —
+# проверяемые функции их не используют
+import ast
+import os
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ScriptNamespace:
+    # Глобальные переменные загруженного кода; функции видят их изменения
+    def __init__(self, env):
+        self.env = env
+
+    def __getattr__(self, name):
+        try:
+            return self.env[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def defined_names(node):
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, ast.Assign):
+        return {t.id for t in node.targets if isinstance(t, ast.Name)}
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return {node.target.id}
+    return set()
+
+
+def load(script, names, **namespace):
+    path = os.path.join(SCRIPTS_DIR, script)
+    with open(path, encoding="utf-8") as fh:
+        tree = ast.parse(fh.read(), path)
+    env = {"__name__": "script_under_test", "__file__": path}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module([node], []), path, "exec"), env)
+            except ImportError:
+                pass
+    env.update(namespace)
+    wanted = set(names)
+    selected = [node for node in tree.body if defined_names(node) & wanted]
+    missing = wanted - set().union(*(defined_names(node) for node in selected))
+    if missing:
+        raise LookupError(f"{script} does not define {sorted(missing)}")
+    exec(compile(ast.Module(selected, []), path, "exec"), env)
+    return ScriptNamespace(env)
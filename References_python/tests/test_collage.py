@@ -0,0 +1,86 @@
+# Поиск окон в шаблоне рамки и перерисовка редактора позиций photobooth_photos(13)
+# на синтетических шаблонах: окна известны заранее, редактор сверяется с
+# полной перерисовкой
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from script_loader import load
+
+SCRIPT = "photobooth_photos(13).py"
+# Окна одной строки с чуть разным верхом и высотой, края не кратны масштабу поиска
+WINDOWS = [(61, 101, 518, 701), (622, 107, 517, 690), (59, 903, 521, 698), (618, 898, 523, 705)]
+
+
+@pytest.fixture(scope="module")
+def photos():
+    return load(SCRIPT, ["TEMPLATE_KEY_COLOR", "TEMPLATE_KEY_TOLERANCE", "TEMPLATE_ALPHA_THRESHOLD",
+                         "WINDOW_DETECT_SCALE", "WINDOW_MIN_AREA", "WINDOW_MIN_FILL", "template_window_mask",
+                         "refine_window", "detect_template_windows", "EDITOR_MAX_HEIGHT", "EDITOR_PAD",
+                         "EDITOR_BACKGROUND", "premultiply", "blend_into", "editor_proxy", "draw_position",
+                         "redraw_editor"])
+
+
+def alpha_template():
+    template = np.zeros((1800, 1200, 4), dtype=np.uint8)
+    template[:, :, :3] = (40, 80, 160)
+    template[:, :, 3] = 255
+    for x, y, w, h in WINDOWS:
+        template[y:y + h, x:x + w, 3] = 0
+    # Надпись с прозрачными буквами и мелкие дырки — не окна
+    cv2.putText(template, "PHOTO", (400, 1700), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0, 0), 8)
+    template[20:30, 20:30, 3] = 0
+    return template
+
+
+def test_detects_transparent_windows_in_reading_order(photos):
+    assert photos.detect_template_windows(alpha_template()) == WINDOWS
+
+
+def test_detects_chroma_key_windows(photos):
+    template = np.full((1800, 1200, 3), (200, 200, 200), dtype=np.uint8)
+    for x, y, w, h in WINDOWS:
+        template[y:y + h, x:x + w] = (10, 240, 20)  # зелёный в пределах допуска
+    assert photos.detect_template_windows(template) == WINDOWS
+
+
+def test_returns_largest_windows_only(photos):
+    template = alpha_template()
+    template[500:808, :, 3] = 255  # окна верхней строки вдвое ниже
+    template[1760:1790, 500:700, 3] = 0  # узкая полоса меньше минимальной площади
+    assert photos.detect_template_windows(template, count=2) == [WINDOWS[2], WINDOWS[3]]
+    assert photos.detect_template_windows(np.full((1800, 1200, 4), 255, dtype=np.uint8)) == []
+
+
+def test_editor_proxy_flattens_alpha(photos):
+    proxy, scale = photos.editor_proxy(alpha_template())
+    assert scale == photos.EDITOR_MAX_HEIGHT / 1800
+    assert proxy.shape == (900, 600, 3)
+    # Окна сведены на серый фон, рамка сохранила свой цвет
+    assert (proxy[300, 150] == photos.EDITOR_BACKGROUND).all()
+    assert tuple(proxy[10, 300]) == (40, 80, 160)
+
+
+def full_redraw(photos, proxy, rects):
+    canvas = proxy.copy()
+    for i, rect in enumerate(rects):
+        photos.draw_position(canvas, i, rect)
+    return canvas
+
+
+def test_dirty_redraw_matches_full_redraw(photos):
+    proxy, _ = photos.editor_proxy(alpha_template())
+    rects = [(30, 50, 200, 300), (330, 50, 200, 300), (30, 500, 200, 300), (330, 500, 200, 300)]
+    canvas, drawn = proxy.copy(), []
+    assert photos.redraw_editor(canvas, proxy, drawn, list(rects))
+    assert np.array_equal(canvas, full_redraw(photos, proxy, rects))
+    assert not photos.redraw_editor(canvas, proxy, drawn, list(rects))
+    # Перетаскивание окна и изменение размера другого, включая выход за край холста
+    for moves in [{0: (40, 60, 200, 300)}, {1: (350, 40, 240, 330)}, {3: (420, 620, 200, 300)},
+                  {2: (-20, 520, 180, 280), 0: (20, 30, 180, 280)}]:
+        for i, rect in moves.items():
+            rects[i] = rect
+        assert photos.redraw_editor(canvas, proxy, drawn, list(rects))
+        assert np.array_equal(canvas, full_redraw(photos, proxy, rects))
+    assert drawn == rects
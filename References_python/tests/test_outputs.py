@@ -0,0 +1,106 @@
+# Профили кодирования, артефакты сессии, рендишены и выбор лучшего кадра серии
+# в photo-soft16 и photobooth_photos(13). Каскады Хаара не загружаются — кадры
+# серии сравниваются по резкости
+import os
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from script_loader import load
+
+SCRIPTS = ["photo-soft16.py", "photobooth_photos(13).py"]
+
+
+@pytest.fixture(scope="module", params=SCRIPTS)
+def script(request):
+    return load(request.param, ["SessionIO", "SessionArtifact", "EncoderProfile", "ENCODER_PROFILES", "Rendition",
+                                "resize_to_width", "render_output", "geometry_cache", "geometry_cache_version",
+                                "get_geometry_plan", "apply_geometry", "BURST_SCORE_WIDTH", "BURST_SCORE_BUDGET",
+                                "score_burst_frame", "select_best_frame"],
+                settings=SimpleNamespace(version=0), get_burst_cascades=lambda: (None, None))
+
+
+def photo(h=600, w=400, seed=0):
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (h // 20, w // 20, 3), dtype=np.uint8)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+
+
+def test_encoder_profiles_round_trip(script, tmp_path):
+    image = photo()
+    session_io = script.SessionIO()
+    for name, profile in script.ENCODER_PROFILES.items():
+        artifact = script.SessionArtifact(session_io, str(tmp_path / f"{name}{profile.ext}"), image, profile=profile)
+        data = artifact.data()
+        assert artifact.data() is data, "encoded twice"
+        decoded = script.SessionArtifact(session_io, data=data).image()
+        assert decoded.shape == image.shape
+        diff = np.abs(decoded.astype(np.int16) - image)
+        if profile.ext == ".png":
+            assert not diff.any(), name
+        else:
+            assert diff.mean() < 3, name
+    assert session_io.bytes_read == session_io.bytes_written == 0
+
+
+def test_artifact_touches_disk_once(script, tmp_path):
+    session_io = script.SessionIO()
+    path = str(tmp_path / "photo.png")
+    artifact = script.SessionArtifact(session_io, path, photo(), profile=script.ENCODER_PROFILES["png"])
+    assert artifact.materialize() == path
+    assert artifact.materialize() == path
+    size = os.path.getsize(path)
+    assert session_io.bytes_written == size
+    loaded = script.SessionArtifact(session_io, path)
+    assert np.array_equal(loaded.image(), photo())
+    loaded.image()
+    loaded.data()
+    assert session_io.bytes_read == size
+    # Артефакт, прочитанный с диска, уже там и повторно не пишется
+    loaded.materialize()
+    assert session_io.bytes_written == size
+
+
+def test_resize_to_width(script):
+    image = photo(600, 400)
+    assert script.resize_to_width(image, None) is image
+    assert script.resize_to_width(image, 400) is image
+    assert script.resize_to_width(image, 800) is image
+    assert script.resize_to_width(image, 200).shape == (300, 200, 3)
+
+
+def test_render_output(script, tmp_path):
+    session_io = script.SessionIO()
+    base = str(tmp_path / "result")
+    profile = next(iter(script.ENCODER_PROFILES))
+    saved = script.render_output(photo(), base, script.Rendition(profile, None, "", True), session_io)
+    assert os.path.getsize(saved.path) == len(saved.data()) == session_io.bytes_written
+    share = script.render_output(photo(), base, script.Rendition(profile, 200, "_share", False), session_io)
+    assert share.path == base + "_share" + script.ENCODER_PROFILES[profile].ext
+    assert not os.path.exists(share.path)
+    assert share.image().shape == (300, 200, 3)
+    thumbnail = script.render_output(photo(), base, script.Rendition(None, 100, None, False), session_io)
+    assert thumbnail.path is None
+    assert thumbnail.image().shape == (150, 100, 3)
+
+
+def test_select_best_frame_prefers_sharp_frame(script):
+    sharp = cv2.resize(photo(120, 160, seed=1), (640, 480), interpolation=cv2.INTER_NEAREST)
+    blurred = cv2.GaussianBlur(sharp, (0, 0), 6)
+    frames = [(blurred, 1.0), (sharp, 1.05), (blurred, 1.1)]
+    best, score, scored, _ = script.select_best_frame(frames, 1.0, cv2.ROTATE_90_CLOCKWISE, budget=10)
+    assert best is frames[1]
+    assert scored == 3
+    assert score == script.score_burst_frame(sharp, cv2.ROTATE_90_CLOCKWISE)
+    assert score[0] == 0
+
+
+def test_select_best_frame_respects_budget(script):
+    frames = [(photo(480, 640, seed=i), 1.0 + i / 30) for i in range(5)]
+    best, _, scored, _ = script.select_best_frame(frames, 1.1, None, budget=0)
+    # Бюджет исчерпан сразу: оценён только ближайший к моменту снимка кадр
+    assert scored == 1
+    assert best is frames[3]
@@ -0,0 +1,173 @@
+# Чистые функции превью, общие для трёх скриптов: одноместный обмен кадрами,
+# смешивание в фиксированной точке, план геометрии и спрайты отсчёта.
+# Эталоны — float-формулы и прежний путь cv2.rotate + cv2.resize + обрезка
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from script_loader import load
+
+SCRIPTS = ["photo-soft16.py", "photobooth_photos(13).py", "soft31(working stability.py"]
+ROTATIONS = [None, cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE, cv2.ROTATE_180]
+
+
+@pytest.fixture(scope="module", params=SCRIPTS)
+def script(request):
+    return load(request.param, ["LatestFrameSlot", "premultiply", "blend_into", "geometry_cache",
+                                "geometry_cache_version", "get_geometry_plan", "apply_geometry", "COUNTDOWN_FONT",
+                                "COUNTDOWN_ANIMATION_FRAMES", "COUNTDOWN_SPRITES_MAX", "countdown_sprites",
+                                "get_countdown_sprite", "draw_countdown"],
+                settings=SimpleNamespace(version=0))
+
+
+def smooth_frame(h, w, channels=3, seed=0):
+    # Гладкий кадр: на шуме разница интерполяций в фиксированной точке больше 1 LSB
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (h // 16 + 2, w // 16 + 2, channels), dtype=np.uint8)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+
+
+def test_latest_frame_slot_keeps_newest(script):
+    slot = script.LatestFrameSlot()
+    assert slot.take() is None
+    for i in range(3):
+        slot.put(f"frame{i}", i)
+    assert slot.take() == ("frame2", 2)
+    assert slot.dropped == 2
+    assert slot.take() is None
+    slot.put("frame3", 3)
+    slot.clear()
+    assert slot.take(timeout=0.01) is None
+
+
+def test_latest_frame_slot_wakes_waiting_reader(script):
+    slot = script.LatestFrameSlot()
+    timer = threading.Timer(0.05, slot.put, ("frame", 1.0))
+    timer.start()
+    try:
+        assert slot.take(timeout=5) == ("frame", 1.0)
+    finally:
+        timer.cancel()
+
+
+def test_alpha_blend_within_one_lsb(script):
+    rng = np.random.default_rng(1)
+    frame = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    overlay = rng.integers(0, 256, (64, 64, 4), dtype=np.uint8)
+    overlay[0, :, 3] = 0
+    overlay[1, :, 3] = 255
+    a = overlay[:, :, 3:].astype(np.float64) / 255
+    expected = frame * (1 - a) + overlay[:, :, :3] * a
+    result = script.blend_into(frame.copy(), *script.premultiply(overlay))
+    assert result.dtype == np.uint8
+    assert np.abs(result - expected).max() <= 1
+    # Полностью прозрачная и полностью непрозрачная рамка — точно
+    assert np.array_equal(result[0], frame[0])
+    assert np.array_equal(result[1], overlay[1, :, :3])
+
+
+def test_weighted_blend_within_one_lsb(script):
+    rng = np.random.default_rng(2)
+    frame = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    overlay = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    expected = cv2.addWeighted(frame, 0.7, overlay, 0.3, 0)
+    result = script.blend_into(frame.copy(), *script.premultiply(overlay))
+    assert np.abs(result.astype(np.int16) - expected).max() <= 1
+
+
+def test_blend_writes_into_roi(script):
+    frame = np.zeros((40, 40, 3), dtype=np.uint8)
+    overlay = np.full((10, 10, 4), 255, dtype=np.uint8)
+    script.blend_into(frame[5:15, 20:30], *script.premultiply(overlay))
+    assert (frame[5:15, 20:30] == 255).all()
+    frame[5:15, 20:30] = 0
+    assert not frame.any()
+
+
+def old_geometry(frame, rotation, target_w=None, target_h=None, mirror=False):
+    # Прежний путь: поворот, масштаб по ширине, центрированная обрезка или поля, зеркало
+    if rotation is not None:
+        frame = cv2.rotate(frame, rotation)
+    h, w = frame.shape[:2]
+    if target_w:
+        frame = cv2.resize(frame, (target_w, int(h * target_w / w)), interpolation=cv2.INTER_LINEAR)
+    if target_h:
+        nh = frame.shape[0]
+        if nh > target_h:
+            top = (nh - target_h) // 2
+            frame = frame[top:top + target_h]
+        elif nh < target_h:
+            top = (target_h - nh) // 2
+            frame = cv2.copyMakeBorder(frame, top, target_h - nh - top, 0, 0, cv2.BORDER_CONSTANT, value=0)
+    if mirror:
+        frame = cv2.flip(frame, 1)
+    return frame
+
+
+@pytest.mark.parametrize("rotation", ROTATIONS)
+@pytest.mark.parametrize("mirror", [False, True])
+def test_geometry_without_scaling_is_exact(script, rotation, mirror):
+    frame = np.random.default_rng(3).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    result = script.apply_geometry(frame, rotation, mirror=mirror)
+    assert np.array_equal(result, old_geometry(frame, rotation, mirror=mirror))
+
+
+def test_geometry_identity_returns_frame(script):
+    frame = np.zeros((48, 64, 3), dtype=np.uint8)
+    assert script.apply_geometry(frame, None) is frame
+
+
+@pytest.mark.parametrize("rotation", ROTATIONS)
+@pytest.mark.parametrize("target", [(320, None), (400, 600), (300, 200), (640, 1200)])
+@pytest.mark.parametrize("mirror", [False, True])
+def test_geometry_plan_matches_old_path(script, rotation, target, mirror):
+    frame = smooth_frame(480, 640)
+    result = script.apply_geometry(frame, rotation, *target, mirror=mirror)
+    expected = old_geometry(frame, rotation, *target, mirror=mirror)
+    assert result.shape == expected.shape
+    diff = np.abs(result.astype(np.int16) - expected)
+    assert diff.max() <= 2
+    assert diff.mean() < 0.5
+
+
+def test_geometry_plan_cache_follows_settings_version(script):
+    plan = script.get_geometry_plan(640, 480, cv2.ROTATE_90_CLOCKWISE, 320)
+    assert script.get_geometry_plan(640, 480, cv2.ROTATE_90_CLOCKWISE, 320) is plan
+    script.env["settings"] = SimpleNamespace(version=script.geometry_cache_version + 1)
+    try:
+        assert script.get_geometry_plan(640, 480, cv2.ROTATE_90_CLOCKWISE, 320) is not plan
+        assert len(script.geometry_cache) == 1
+    finally:
+        script.env["settings"] = SimpleNamespace(version=0)
+
+
+@pytest.mark.parametrize("text", ["1", "3", "10"])
+@pytest.mark.parametrize("k", [0.5, 1.0])
+def test_countdown_sprite_matches_put_text(script, text, k):
+    h, w = 720, 960
+    frame = np.zeros((h, w, 3), dtype=np.uint8)
+    script.draw_countdown(frame, text, k)
+    expected = np.zeros((h, w), dtype=np.uint8)
+    cv2.putText(expected, text, (int(w / 2 - 60 * k), int(h / 2 + 60 * k)), script.COUNTDOWN_FONT, 5 * k, 255,
+                max(1, int(10 * k)), cv2.LINE_AA)
+    ys, xs = np.nonzero(frame.max(axis=2))
+    eys, exs = np.nonzero(expected)
+    # Цифра стоит там же, где её рисовал cv2.putText, с точностью до пикселя округления
+    assert abs(xs.min() - exs.min()) <= 1 and abs(xs.max() - exs.max()) <= 1
+    assert abs(ys.min() - eys.min()) <= 1 and abs(ys.max() - eys.max()) <= 1
+    # Белая цифра: внутри штриха — 255, каналы одинаковы
+    assert frame.max() == 255
+    assert np.array_equal(frame[:, :, 0], frame[:, :, 2])
+
+
+def test_countdown_sprite_is_cached_and_clipped(script):
+    sprite = script.get_countdown_sprite("5", 1.0)
+    assert script.get_countdown_sprite("5", 1.0) is sprite
+    # Кадр меньше спрайта: рисуется только видимая часть, без ошибок выхода за границы
+    frame = np.full((60, 80, 3), 10, dtype=np.uint8)
+    script.draw_countdown(frame, "5", 1.0)
+    assert frame.max() > 10
@@ -0,0 +1,153 @@
+# Возобновляемая загрузка soft31 против локального сервера по протоколу Drive.
+# Сервер рвёт соединение посреди каждого третьего куска и сохраняет только
+# целые блоки по 256 КБ. Первый вызов «падает» после двух подтверждённых
+# кусков, второй должен продолжить ту же сессию из файла сессий с последнего
+# подтверждённого байта
+import http.client
+import os
+import threading
+import urllib.parse
+from json import dumps, loads
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from script_loader import load
+
+BLOCK = 256 * 1024
+SCRIPT = "soft31(working stability.py"
+
+
+@pytest.fixture(scope="module")
+def soft31():
+    return load(SCRIPT, ["RESUMABLE_CHUNK_SIZE", "RESUMABLE_RETRIES", "RESUMABLE_BACKOFF", "UPLOAD_SESSIONS_FILE",
+                         "DRIVE_UPLOAD_URL", "upload_sessions_lock", "load_upload_sessions", "save_upload_session",
+                         "uploaded_offset", "query_upload_offset", "resumable_upload"])
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status_code = status
+        self.headers = {k.title(): v for k, v in headers}
+        self.body = body
+
+    def json(self):
+        return loads(self.body)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+
+class Client:
+    # Минимальная HTTP-сессия с интерфейсом, который использует resumable_upload;
+    # обрыв соединения — OSError, как у requests
+    def request(self, method, url, body, headers):
+        parts = urllib.parse.urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+        try:
+            conn.request(method, parts.path, body=body, headers=headers)
+            response = conn.getresponse()
+            return Response(response.status, response.getheaders(), response.read())
+        except http.client.HTTPException as e:
+            raise ConnectionError(str(e)) from e
+        finally:
+            conn.close()
+
+    def put(self, url, data=b"", headers=None):
+        return self.request("PUT", url, data, headers or {})
+
+    def post(self, url, json=None, headers=None):
+        return self.request("POST", url, dumps(json).encode(), headers or {})
+
+
+class SimulatedRestart(Exception):
+    pass
+
+
+@pytest.fixture
+def server():
+    state = {"received": bytearray(), "puts": [], "sessions": 0, "drops": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            state["sessions"] += 1
+            self.send_response(200)
+            self.send_header("Location", f"http://127.0.0.1:{httpd.server_address[1]}/session")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_PUT(self):
+            length = int(self.headers.get("Content-Length", 0))
+            content_range = self.headers["Content-Range"]
+            total = int(content_range.split("/")[1])
+            received = state["received"]
+            if length:
+                state["puts"].append(content_range)
+                start = int(content_range.split()[1].split("-")[0])
+                if len(state["puts"]) % 3 == 0:
+                    part = self.rfile.read(length // 2)
+                    if start == len(received):
+                        received.extend(part[:len(part) // BLOCK * BLOCK])
+                    state["drops"] += 1
+                    self.close_connection = True
+                    return
+                body = self.rfile.read(length)
+                if start == len(received):
+                    received.extend(body)
+            if len(received) >= total:
+                data = b'{"id": "uploaded"}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self.send_response(308)
+            if received:
+                self.send_header("Range", f"bytes=0-{len(received) - 1}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield state, f"http://127.0.0.1:{httpd.server_address[1]}/upload"
+    httpd.shutdown()
+
+
+def test_restart_resumes_from_acknowledged_offset(soft31, server, tmp_path):
+    state, url = server
+    payload = os.urandom(6 * 1024 * 1024 + 12345)
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(payload)
+    sessions_file = str(tmp_path / "sessions.json")
+    sent = []
+
+    def crash_after_two_chunks(size):
+        sent.append(size)
+        if len(state["puts"]) >= 2:
+            raise SimulatedRestart()
+
+    with pytest.raises(SimulatedRestart):
+        soft31.resumable_upload(Client(), str(path), {"name": "clip.mp4"}, "video/mp4", chunk_size=4 * BLOCK,
+                                on_sent=crash_after_two_chunks, url=url, sessions_file=sessions_file, backoff=0.01)
+    acknowledged = len(state["received"])
+    puts_before_restart = len(state["puts"])
+    assert acknowledged == 8 * BLOCK
+
+    result = soft31.resumable_upload(Client(), str(path), {"name": "clip.mp4"}, "video/mp4", chunk_size=4 * BLOCK,
+                                     on_sent=sent.append, url=url, sessions_file=sessions_file, backoff=0.01)
+
+    assert result == {"id": "uploaded"}
+    assert bytes(state["received"]) == payload
+    assert state["sessions"] == 1, "the restart opened a new upload session"
+    assert state["drops"] > 0
+    # Первый кусок после перезапуска начинается с подтверждённого смещения, а не с нуля
+    assert state["puts"][puts_before_restart].startswith(f"bytes {acknowledged}-")
+    # Оборванные куски не учитываются: подтверждённые байты складываются ровно в файл
+    assert sum(sent) == len(payload)
+    assert soft31.load_upload_sessions(sessions_file) == {}